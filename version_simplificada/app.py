@@ -2,56 +2,135 @@
 Aplicación para procesamiento de facturas con autenticación
 Versión simplificada y funcional
 """
-from flask import Flask, render_template, jsonify, send_from_directory, request, url_for, send_file, redirect, session, flash
+from flask import Flask, Request, Response, stream_with_context, render_template, jsonify, send_from_directory, request, url_for, send_file, redirect, session, flash, make_response
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import Engine
+from werkzeug.datastructures import ImmutableMultiDict
+from werkzeug.exceptions import RequestTimeout
 import os
+import csv
+import gc
 import json
+import multiprocessing
+import pickle
 import re
 import random
 import tempfile
 import base64
-from io import BytesIO
-from datetime import datetime, timedelta
-
-# Intentar importar las librerías opcionales
-try:
-    import PyPDF2
-    PYPDF2_ENABLED = True
-except ImportError:
-    PYPDF2_ENABLED = False
-    print("Advertencia: PyPDF2 no disponible. La extracción de texto de PDFs estará deshabilitada.")
-
-try:
-    from PIL import Image, ImageDraw, ImageFont
-    PIL_ENABLED = True
-except ImportError:
-    PIL_ENABLED = False
-    print("Advertencia: Pillow no disponible. Las vistas previas estarán limitadas.")
-
-try:
-    from pdf2image import convert_from_path
-    PDF_PREVIEW_ENABLED = True
-    
-    # Diagnóstico de poppler al iniciar
-    import shutil
-    if shutil.which('pdftoppm'):
-        print("✅ Poppler detectado correctamente")
+import hashlib
+import importlib
+import importlib.util
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO, StringIO
+from xml.sax.saxutils import escape as escapar_xml
+from types import MappingProxyType
+from datetime import date, datetime, timedelta
+
+# Librerías opcionales: no se importan al cargar el módulo sino la primera vez que se
+# usan, para que importar app.py (scripts, workers de gunicorn) sea rápido.
+# Nombre -> (módulo, aviso si no está instalada)
+DEPENDENCIAS_OPCIONALES = {
+    'pypdf2': ('PyPDF2', "PyPDF2 no disponible. La extracción de texto de PDFs estará deshabilitada."),
+    'pil': ('PIL.Image', "Pillow no disponible. Las vistas previas estarán limitadas."),
+    'pdf2image': ('pdf2image', "pdf2image no disponible. Las vistas previas de PDF estarán limitadas."),
+}
+_MODULOS_OPCIONALES = {}
+
+def dependencia_opcional(nombre):
+    """Módulo de la librería opcional, importado la primera vez; None si no está instalada"""
+    if nombre not in _MODULOS_OPCIONALES:
+        modulo, aviso = DEPENDENCIAS_OPCIONALES[nombre]
+        try:
+            _MODULOS_OPCIONALES[nombre] = importlib.import_module(modulo)
+        except ImportError:
+            _MODULOS_OPCIONALES[nombre] = None
+            print(f"Advertencia: {aviso}")
+    return _MODULOS_OPCIONALES[nombre]
+
+def dependencia_instalada(nombre):
+    """True si la librería opcional está instalada, sin llegar a importarla"""
+    return importlib.util.find_spec(DEPENDENCIAS_OPCIONALES[nombre][0].split('.')[0]) is not None
+
+# Registro de capacidades del sistema. Se detecta una sola vez, la primera vez que se
+# consulta (y de nuevo solo bajo demanda desde /diagnostico); las vistas previas leen
+# el resultado en lugar de lanzar subprocesos en cada petición.
+RUTAS_POPPLER = ['/usr/bin', '/usr/local/bin', '/bin', '/opt/poppler/bin']
+CAPACIDADES = {}
+_CAPACIDADES_LOCK = threading.Lock()
+
+def detectar_poppler():
+    """Busca pdftoppm en el PATH y en RUTAS_POPPLER y comprueba que se puede ejecutar"""
+    en_path = shutil.which('pdftoppm')
+    rutas = [os.path.join(r, 'pdftoppm') for r in RUTAS_POPPLER if os.path.exists(os.path.join(r, 'pdftoppm'))]
+    info = {
+        'disponible': False,
+        'en_path': bool(en_path),
+        'ruta': None,
+        'version': None,
+        'rutas': rutas,
+        'error': None,
+        'detectado': datetime.now().isoformat(timespec='seconds'),
+    }
+    # Primero el del PATH (pdf2image no necesita ruta); después las rutas conocidas
+    candidatos = ([(en_path, None)] if en_path else []) + [(r, os.path.dirname(r)) for r in rutas]
+    for ejecutable, carpeta in candidatos:
+        try:
+            result = subprocess.run([ejecutable, '-v'], capture_output=True, text=True, timeout=5)
+        except Exception as e:
+            info['error'] = str(e)
+            continue
+        if result.returncode == 0:
+            info.update(disponible=True, ruta=carpeta, error=None,
+                        version=(result.stderr or result.stdout).strip())
+            break
+
+    # pdftotext viene en el mismo paquete; lo usa el backend de texto opcional
+    info['pdftotext'] = shutil.which('pdftotext', path=info['ruta']) if info['disponible'] else None
+
+    if info['disponible']:
+        print(f"✅ Poppler disponible: {info['version'].splitlines()[0] if info['version'] else ejecutable}")
     else:
-        print("⚠️ Poppler no encontrado en PATH")
-        # Buscar en rutas comunes
-        common_paths = ['/usr/bin/pdftoppm', '/usr/local/bin/pdftoppm', '/bin/pdftoppm']
-        for path in common_paths:
-            if os.path.exists(path):
-                print(f"✅ Poppler encontrado en: {path}")
-                break
-        else:
-            print("❌ Poppler no encontrado en rutas comunes")
-            
-except ImportError:
-    PDF_PREVIEW_ENABLED = False
-    print("Advertencia: pdf2image no disponible. Las vistas previas de PDF estarán limitadas.")
+        print("❌ Poppler no encontrado: las vistas previas usarán el texto extraído")
+    return info
+
+def _pil_soporta_webp():
+    from PIL import features
+    return bool(features.check('webp'))
+
+def detectar_capacidades():
+    """(Re)detecta las capacidades del sistema y actualiza CAPACIDADES"""
+    poppler = detectar_poppler()
+    pil = dependencia_instalada('pil')
+    nuevas = {
+        'pypdf2': dependencia_instalada('pypdf2'),
+        'pil': pil,
+        'pdf2image': dependencia_instalada('pdf2image'),
+        'webp': pil and _pil_soporta_webp(),
+        'poppler': poppler,
+    }
+    with _CAPACIDADES_LOCK:
+        CAPACIDADES.update(nuevas)
+    return CAPACIDADES
+
+def capacidades():
+    """Registro de capacidades; la primera consulta de cada proceso lo detecta"""
+    if not CAPACIDADES:
+        detectar_capacidades()
+    return CAPACIDADES
 
 # Configuración de Flask
 app = Flask(__name__)
@@ -60,8 +139,10 @@ app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024  # 32MB límite de subida de
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 
 # Configuración de base de datos SQLite
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///facturas_users.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///facturas_users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Espera a que se libere el bloqueo de escritura en lugar de fallar en el acto
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
 
 # Inicializar extensiones
 db = SQLAlchemy(app)
@@ -81,6 +162,133 @@ class User(UserMixin, db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+# Modelo de Factura procesada (compartido entre todos los workers)
+class Factura(db.Model):
+    __tablename__ = 'facturas'
+    id = db.Column(db.String(255), primary_key=True)
+    nombre = db.Column(db.String(255), nullable=False, index=True)
+    archivo_procesado = db.Column(db.String(512), index=True)
+    cups = db.Column(db.String(64))
+    direccion = db.Column(db.String(255))
+    fecha = db.Column(db.Date, index=True)
+    tipo = db.Column(db.String(20), index=True)
+    importe = db.Column(db.String(32))
+    estado = db.Column(db.String(10))
+    comunidad = db.Column(db.String(255), index=True)
+    cuenta = db.Column(db.String(20), index=True)
+    procesado = db.Column(db.Boolean, default=False, nullable=False)
+    movimiento_contable = db.Column(db.Text)
+    aprobacion = db.Column(db.String(255))
+    periodo = db.Column(db.String(64))
+    trabajo_id = db.Column(db.String(32), index=True)
+    posicion = db.Column(db.Integer)
+    tiempos = db.Column(db.Text)
+    sha256 = db.Column(db.String(64), index=True)
+    campos = db.Column(db.Text)  # JSON con los campos detectados, para reasignar sin leer el PDF
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    @classmethod
+    def desde_dict(cls, datos, trabajo_id=None, posicion=None, tiempos=None, sha256=None, campos=None):
+        """Crea la fila a partir del diccionario que genera construir_factura"""
+        try:
+            fecha = datetime.strptime(datos.get('fecha') or '', '%d/%m/%Y').date()
+        except ValueError:
+            fecha = None
+        return cls(
+            id=datos['id'],
+            nombre=datos['nombre'],
+            archivo_procesado=datos.get('archivo_procesado'),
+            cups=datos.get('cups'),
+            direccion=datos.get('direccion'),
+            fecha=fecha,
+            tipo=datos.get('tipo'),
+            importe=datos.get('importe'),
+            estado=datos.get('estado'),
+            comunidad=datos.get('comunidad'),
+            cuenta=datos.get('cuenta'),
+            procesado=bool(datos.get('procesado')),
+            movimiento_contable=datos.get('movimiento_contable'),
+            aprobacion=datos.get('aprobacion'),
+            periodo=datos.get('periodo'),
+            trabajo_id=trabajo_id,
+            posicion=posicion,
+            tiempos=json.dumps(tiempos) if tiempos is not None else None,
+            sha256=sha256,
+            campos=json.dumps(campos, ensure_ascii=False) if campos is not None else None,
+            created_at=datetime.utcnow(),
+        )
+
+    def to_dict(self):
+        """Mismo formato que usaban el dashboard y la API con FACTURAS_DATA"""
+        return {
+            "id": self.id,
+            "nombre": self.nombre,
+            "archivo_procesado": self.archivo_procesado,
+            "cups": self.cups,
+            "direccion": self.direccion,
+            "fecha": self.fecha.strftime("%d/%m/%Y") if self.fecha else None,
+            "tipo": self.tipo,
+            "importe": self.importe,
+            "estado": self.estado,
+            "comunidad": self.comunidad,
+            "cuenta": self.cuenta,
+            "cuenta_contable": self.cuenta,
+            "procesado": self.procesado,
+            "movimiento_contable": self.movimiento_contable,
+            "aprobacion": self.aprobacion,
+            "periodo": self.periodo,
+            "acciones": "ver"
+        }
+
+# Metadatos de cada PDF subido, por contenido (Factura.sha256): se obtienen al procesarlo
+# para que la vista previa no tenga que volver a abrir el archivo
+class DocumentoPDF(db.Model):
+    __tablename__ = 'documentos_pdf'
+    sha256 = db.Column(db.String(64), primary_key=True)
+    tamano = db.Column(db.Integer, nullable=False)
+    num_paginas = db.Column(db.Integer, nullable=False)
+    textos = db.Column(db.Text)  # JSON con el texto de las páginas leídas al procesarlo
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def texto_pagina(self, pagina):
+        """Texto guardado de la página (numeradas desde 1), o None si no se llegó a leer"""
+        textos = json.loads(self.textos or '[]')
+        return textos[pagina - 1] if 1 <= pagina <= len(textos) else None
+
+# Modelo de trabajo de carga: el progreso se guarda en la base de datos para que
+# cualquier worker pueda responder a las consultas de estado
+class TrabajoCarga(db.Model):
+    __tablename__ = 'trabajos_carga'
+    id = db.Column(db.String(32), primary_key=True)
+    estado = db.Column(db.String(20), nullable=False, default='en_cola')
+    modo = db.Column(db.String(20), nullable=False)
+    total = db.Column(db.Integer, nullable=False)
+    procesadas = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    creado = db.Column(db.Float, nullable=False)
+    iniciado = db.Column(db.Float)
+    terminado = db.Column(db.Float, index=True)
+    actualizado = db.Column(db.Float)  # último avance: sin avances, el worker que lo atendía se detuvo
+
+# Reasignaciones automáticas tras un cambio del mapeo: todos los workers detectan el mismo
+# cambio, pero solo el que consigue insertar la fila de esa versión reasigna las facturas
+class ReasignacionMapeo(db.Model):
+    __tablename__ = 'reasignaciones_mapeo'
+    clave = db.Column(db.String(64), primary_key=True)  # huella del mapeo y fecha del archivo
+    worker = db.Column(db.Integer, nullable=False)
+    iniciada = db.Column(db.Float, nullable=False)
+    terminada = db.Column(db.Float)
+    resumen = db.Column(db.Text)
+
+@event.listens_for(Engine, 'connect')
+def _configurar_sqlite(dbapi_connection, connection_record):
+    """WAL para que varios workers puedan leer mientras otro escribe"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
@@ -130,89 +338,685 @@ def create_default_users():
     db.session.commit()
     print("✅ Usuarios por defecto creados/verificados")
 
-# Datos de facturas (simulado)
-FACTURAS_DATA = []
+def agregar_columnas_nuevas():
+    """Añade a las tablas ya existentes las columnas e índices nuevos de los modelos.
+
+    db.create_all solo crea las tablas que faltan, así que una base de datos de una
+    versión anterior se quedaría sin las columnas añadidas después.
+    """
+    inspector = db.inspect(db.engine)
+    for tabla in db.metadata.sorted_tables:
+        if not inspector.has_table(tabla.name):
+            continue
+        existentes = {columna['name'] for columna in inspector.get_columns(tabla.name)}
+        for columna in tabla.columns:
+            if columna.name not in existentes:
+                tipo = columna.type.compile(db.engine.dialect)
+                db.session.execute(db.text(f'ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}'))
+                print(f"🔧 Columna {tabla.name}.{columna.name} añadida")
+        db.session.commit()
+        for indice in tabla.indexes:
+            indice.create(db.engine, checkfirst=True)
+
+def inicializar_base_datos():
+    """Crea las tablas, las pone al día y asegura los usuarios por defecto"""
+    db.create_all()
+    agregar_columnas_nuevas()
+    create_default_users()
+
+# Normalización de direcciones
+_RE_DIR_KEY_SEPARADORES = re.compile(r'[\.,/\\#\-]')
+_RE_ESPACIOS = re.compile(r'\s+')
+
+def _normalize_dir_key(s):
+    if not s:
+        return ''
+    k = s.upper()
+    k = _RE_DIR_KEY_SEPARADORES.sub(' ', k)
+    k = _RE_ESPACIOS.sub(' ', k).strip()
+    return k
+
+# Índices de búsqueda sobre los mappings
+class IndiceSubcadenas:
+    """Autómata Aho-Corasick sobre un conjunto de patrones con prioridad.
+
+    Sustituye a los bucles del tipo `for k in mapeo: if k in texto` por una sola pasada
+    lineal sobre el texto, independiente del número de patrones. La prioridad de cada
+    patrón es su posición en la lista de entrada (la del orden de inserción del mapeo),
+    así que primera_coincidencia devuelve lo mismo que el bucle original.
+
+    Con pocos patrones, recorrer el texto carácter a carácter en Python es más lento que
+    unas cuantas búsquedas `in` (implementadas en C), así que por debajo de
+    UMBRAL_AUTOMATA se usa la comprobación directa.
+    """
+    UMBRAL_AUTOMATA = 64
+
+    def __init__(self, patrones):
+        """patrones: iterable de (patron, valor) en orden de prioridad"""
+        self.valores = []
+        self._patrones = []
+        self._hijos = [{}]
+        self._fallo = [0]
+        self._propios = [[]]   # prioridades de los patrones que terminan en cada nodo
+        self._salida = [0]     # siguiente nodo (por enlaces de fallo) con patrones propios
+        self._mejor = [None]   # menor prioridad alcanzable desde cada nodo
+        self._prioridad_vacio = None
+        for prioridad, (patron, valor) in enumerate(patrones):
+            self.valores.append(valor)
+            self._patrones.append(patron)
+            if not patron:
+                # La cadena vacía está contenida en cualquier texto
+                if self._prioridad_vacio is None:
+                    self._prioridad_vacio = prioridad
+                continue
+            nodo = 0
+            for ch in patron:
+                siguiente = self._hijos[nodo].get(ch)
+                if siguiente is None:
+                    siguiente = len(self._hijos)
+                    self._hijos.append({})
+                    self._fallo.append(0)
+                    self._propios.append([])
+                    self._salida.append(0)
+                    self._mejor.append(None)
+                    self._hijos[nodo][ch] = siguiente
+                nodo = siguiente
+            self._propios[nodo].append(prioridad)
+        self._construir_enlaces()
+
+    def _construir_enlaces(self):
+        cola = deque()
+        for hijo in self._hijos[0].values():
+            self._mejor[hijo] = min(self._propios[hijo], default=None)
+            cola.append(hijo)
+        while cola:
+            nodo = cola.popleft()
+            for ch, hijo in self._hijos[nodo].items():
+                fallo = self._fallo[nodo]
+                while fallo and ch not in self._hijos[fallo]:
+                    fallo = self._fallo[fallo]
+                fallo = self._hijos[fallo].get(ch, 0)
+                self._fallo[hijo] = fallo
+                self._salida[hijo] = fallo if self._propios[fallo] else self._salida[fallo]
+                candidatos = [p for p in (min(self._propios[hijo], default=None), self._mejor[fallo]) if p is not None]
+                self._mejor[hijo] = min(candidatos) if candidatos else None
+                cola.append(hijo)
+
+    def __len__(self):
+        return len(self.valores)
+
+    def _recorrer(self, texto):
+        """Genera el nodo del autómata alcanzado tras cada carácter del texto"""
+        hijos = self._hijos
+        fallo = self._fallo
+        nodo = 0
+        for ch in texto:
+            while nodo and ch not in hijos[nodo]:
+                nodo = fallo[nodo]
+            nodo = hijos[nodo].get(ch, 0)
+            yield nodo
+
+    def primera_coincidencia(self, texto):
+        """Valor del patrón de mayor prioridad contenido en el texto (None si no hay)"""
+        if len(self._patrones) <= self.UMBRAL_AUTOMATA:
+            for prioridad, patron in enumerate(self._patrones):
+                if patron in texto:
+                    return self.valores[prioridad]
+            return None
+
+        hijos = self._hijos
+        fallo = self._fallo
+        mejores = self._mejor
+        mejor = self._prioridad_vacio
+        nodo = 0
+        for ch in texto:
+            while nodo and ch not in hijos[nodo]:
+                nodo = fallo[nodo]
+            nodo = hijos[nodo].get(ch, 0)
+            p = mejores[nodo]
+            if p is not None and (mejor is None or p < mejor):
+                mejor = p
+                if mejor == 0:
+                    break
+        return None if mejor is None else self.valores[mejor]
+
+    def coincidencias(self, texto):
+        """Valores de todos los patrones contenidos en el texto, en orden de prioridad"""
+        encontradas = set()
+        if self._prioridad_vacio is not None:
+            encontradas.add(self._prioridad_vacio)
+        for nodo in self._recorrer(texto):
+            while nodo:
+                encontradas.update(self._propios[nodo])
+                nodo = self._salida[nodo]
+        return [self.valores[p] for p in sorted(encontradas)]
+
+def _indices_direcciones_por_tipo(direcciones):
+    """Índices por tipo de gasto sobre DIRECCIONES_POR_TIPO.
+
+    - normalizadas: {tipo: {clave normalizada: datos}} para coincidencias exactas en O(1)
+      (se conserva la primera entrada de cada clave, como hacía el recorrido lineal).
+    - parciales: {tipo: IndiceSubcadenas} con las direcciones en mayúsculas, para las
+      coincidencias parciales sin recorrer el diccionario completo.
+    """
+    normalizadas = {}
+    parciales = {}
+    for clave, datos in direcciones.items():
+        if not (isinstance(clave, tuple) and len(clave) == 2):
+            continue
+        tipo, direccion = clave
+        normalizadas.setdefault(tipo, {}).setdefault(_normalize_dir_key(direccion), datos)
+        parciales.setdefault(tipo, []).append((direccion.upper(), datos))
+    return normalizadas, {tipo: IndiceSubcadenas(patrones) for tipo, patrones in parciales.items()}
+
+_RE_TOKEN_VALOR = re.compile(r'\w+')
+
+def _indice_inverso_valores(mapeo):
+    """Índice inverso {token en mayúsculas: [(prioridad, clave), ...]} de los valores del mapeo.
+
+    Permite resolver una póliza o un Cód. Abast. en O(1). Cada lista queda ordenada por
+    prioridad (orden de la entrada en el mapeo).
+    """
+    indice = {}
+    for prioridad, (clave, info) in enumerate(mapeo.items()):
+        tokens = set()
+        for valor in (info or {}).values():
+            if valor:
+                tokens.update(_RE_TOKEN_VALOR.findall(str(valor).upper()))
+        for token in tokens:
+            indice.setdefault(token, []).append((prioridad, clave))
+    return indice
+
+def construir_indices_mapeo(mapeo, direcciones):
+    """Construye los índices derivados del mapeo (claves y direcciones de referencia)"""
+    direcciones_normalizadas, direcciones_parciales = _indices_direcciones_por_tipo(direcciones)
+    return {
+        # Claves del mapeo (CUPS/contadores) en mayúsculas -> clave original
+        'claves': IndiceSubcadenas((k.upper(), k) for k in mapeo),
+        # Direcciones de referencia en mayúsculas -> (direccion_referencia, entrada)
+        'direcciones_referencia': IndiceSubcadenas(
+            ((v.get('direccion_referencia') or '').upper(), (v.get('direccion_referencia'), v))
+            for v in mapeo.values() if v.get('direccion_referencia')),
+        # DIRECCIONES_POR_TIPO indexado por tipo de gasto
+        'direcciones_normalizadas': direcciones_normalizadas,
+        'direcciones_parciales': direcciones_parciales,
+        # Póliza / Cód. Abast. (y cualquier otro valor de las entradas) -> entradas
+        'valores': _indice_inverso_valores(mapeo),
+    }
+
+def huella_mapeo(mapeo, direcciones, codigos):
+    """Hash corto del contenido del mapeo; cambia cuando cambia cualquier entrada"""
+    contenido = json.dumps(
+        [mapeo, sorted([list(k) if isinstance(k, tuple) else k, v] for k, v in direcciones.items()), codigos],
+        sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()[:16]
+
+def construir_configuracion_mapeo(mapeo, direcciones, codigos=None):
+    """Agrupa los mapeos y sus índices con el formato que devuelve load_mapeo_config"""
+    codigos = codigos if codigos is not None else []
+    inicio = time.perf_counter()
+    indices = construir_indices_mapeo(mapeo, direcciones)
+    print(f"🗂️ Índices de mapeo construidos en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+    return {
+        'MAPEO_CUENTAS_CONTABLES': mapeo,
+        'DIRECCIONES_POR_TIPO': direcciones,
+        'CODIGOS_AGUA_DISPONIBLES': codigos,
+        'INDICES_MAPEO': indices,
+        'HUELLA_MAPEO': huella_mapeo(mapeo, direcciones, codigos)
+    }
+
+def cambios_mapeo(mapeo_anterior, direcciones_anterior, mapeo_nuevo, direcciones_nuevo):
+    """Entradas añadidas, quitadas o modificadas entre dos versiones del mapeo.
+
+    De cada entrada cambiada se guarda lo que puede hacer que una factura la encuentre
+    (en su versión anterior y en la nueva), con el formato que usa campos_afectados.
+    """
+    claves = {k for k in mapeo_anterior.keys() | mapeo_nuevo.keys()
+              if mapeo_anterior.get(k) != mapeo_nuevo.get(k)}
+    direcciones = [k for k in direcciones_anterior.keys() | direcciones_nuevo.keys()
+                   if direcciones_anterior.get(k) != direcciones_nuevo.get(k)]
+    tokens = set()
+    referencias = set()
+    for clave in claves:
+        for info in (mapeo_anterior.get(clave), mapeo_nuevo.get(clave)):
+            for valor in (info or {}).values():
+                if valor:
+                    tokens.update(_RE_TOKEN_VALOR.findall(str(valor).upper()))
+            if info and info.get('direccion_referencia'):
+                referencias.add(info['direccion_referencia'].upper())
+    por_tipo = {}
+    for clave in direcciones:
+        if isinstance(clave, tuple) and len(clave) == 2:
+            tipo, direccion = clave
+            por_tipo.setdefault(tipo, set()).add(direccion.upper())
+    return {
+        'entradas': len(claves) + len(direcciones),
+        'claves': claves,
+        'tokens': tokens,
+        'referencias': referencias,
+        'direcciones': por_tipo,
+    }
+
+def campos_afectados(campos, cambios):
+    """True si alguna entrada cambiada (ver cambios_mapeo) puede alterar la asignación.
+
+    Sigue los mismos pasos que asignar_comunidad_cuenta: contador/CUPS como clave,
+    póliza/Cód. Abast. como valor, dirección exacta, normalizada o parcial por tipo y
+    dirección de referencia. Puede dar algún falso positivo, nunca un falso negativo.
+    """
+    if campos.get('comunidad_especifica'):
+        return False
+    if campos.get('cups') in cambios['claves'] or campos.get('contador') in cambios['claves']:
+        return True
+    for valor in (campos.get('poliza'), campos.get('cod_abast')):
+        if valor and str(valor).upper() in cambios['tokens']:
+            return True
+    direccion = (campos.get('direccion') or '').upper()
+    if not direccion:
+        return False
+    if any(referencia in direccion for referencia in cambios['referencias']):
+        return True
+    normalizada = _normalize_dir_key(direccion)
+    return any(cambiada in direccion or _normalize_dir_key(cambiada) == normalizada
+               for cambiada in cambios['direcciones'].get(campos.get('tipo'), ()))
+
+_CLAVES_MAPEO = ('MAPEO_CUENTAS_CONTABLES', 'DIRECCIONES_POR_TIPO', 'CODIGOS_AGUA_DISPONIBLES',
+                 'INDICES_MAPEO', 'HUELLA_MAPEO')
+_MAPEO_LOCK = threading.Lock()
+# Se incrementa cada vez que se instala una configuración de mapeo
+VERSION_MAPEO = 0
+
+def establecer_mapeo(config):
+    """Instala una configuración de mapeo (como la de load_mapeo_config) en el módulo.
+
+    La configuración se publica de solo lectura en MAPEO_ACTUAL con una única
+    asignación: quien analiza una factura la lee una vez y la pasa a toda la cadena de
+    detección y asignación, así que nunca mezcla entradas de dos versiones. Los
+    globales sueltos (MAPEO_CUENTAS_CONTABLES, ...) se mantienen para los scripts.
+    """
+    global VERSION_MAPEO, MAPEO_ACTUAL
+    config = MappingProxyType({clave: config[clave] for clave in _CLAVES_MAPEO})
+    with _MAPEO_LOCK:
+        MAPEO_ACTUAL = config
+        globals().update(config)
+        VERSION_MAPEO += 1
+        return VERSION_MAPEO
 
 # Cargar mappings secretos desde múltiples fuentes
 MAPEO_CUENTAS_CONTABLES = {}
 DIRECCIONES_POR_TIPO = {}
 CODIGOS_AGUA_DISPONIBLES = {}
+INDICES_MAPEO = construir_indices_mapeo({}, {})
+HUELLA_MAPEO = huella_mapeo({}, {}, [])
+# Configuración de mapeo vigente, de solo lectura (ver establecer_mapeo)
+MAPEO_ACTUAL = MappingProxyType({clave: globals()[clave] for clave in _CLAVES_MAPEO})
+
+# Archivo JSON con el mapeo sensible (montado en /app/config en producción)
+MAPEO_CONFIG_PATH = os.environ.get('MAPEO_CONFIG_PATH', '/app/config/mapeo_sensible.json')
+
+# Snapshot precompilado del mapeo y sus índices, generado a partir del JSON
+MAPEO_SNAPSHOT_PATH = os.environ.get('MAPEO_SNAPSHOT_PATH', os.path.join(app.instance_path, 'mapeo_snapshot.pkl'))
+# Incrementarlo al cambiar construir_configuracion_mapeo o las clases de los índices
+FORMATO_SNAPSHOT_MAPEO = 1
+
+def _cabecera_snapshot_mapeo(sha_json):
+    """Lo que debe coincidir para reutilizar un snapshot: formato, Python, módulo y JSON de origen"""
+    return {
+        'formato': FORMATO_SNAPSHOT_MAPEO,
+        'python': list(sys.version_info[:2]),
+        # Las clases se guardan por módulo: 'app' con gunicorn, '__main__' con python app.py
+        'modulo': IndiceSubcadenas.__module__,
+        'json_sha256': sha_json,
+    }
+
+def cargar_snapshot_mapeo(ruta, sha_json):
+    """Configuración guardada en el snapshot si corresponde a ese JSON; None si no sirve.
+
+    El archivo tiene dos pickles: la cabecera, pequeña, y la configuración, que solo se
+    lee si la cabecera coincide. Solo se cargan snapshots que escribe la propia
+    aplicación en su carpeta instance (pickle no es seguro con archivos ajenos).
+    """
+    try:
+        with open(ruta, 'rb') as f:
+            if pickle.load(f) != _cabecera_snapshot_mapeo(sha_json):
+                return None
+            # El recolector de ciclos recorre una y otra vez los miles de objetos que
+            # se van creando; sin él, la carga es varias veces más rápida
+            gc_activo = gc.isenabled()
+            gc.disable()
+            try:
+                return pickle.load(f)
+            finally:
+                if gc_activo:
+                    gc.enable()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ Snapshot del mapeo no válido, se reconstruye: {e}")
+        return None
+
+def guardar_snapshot_mapeo(ruta, sha_json, config):
+    """Escribe el snapshot de forma atómica; si no se puede, solo lo avisa"""
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        with open(temporal, 'wb') as f:
+            pickle.dump(_cabecera_snapshot_mapeo(sha_json), f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(config, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar el snapshot del mapeo: {e}")
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+
+def leer_mapeo_json(config_path, ruta_snapshot=None):
+    """Lee el JSON del mapeo y construye la configuración; lanza la excepción si falla.
+
+    Si hay un snapshot de ese mismo JSON (ruta_snapshot, por defecto MAPEO_SNAPSHOT_PATH)
+    se carga de él en lugar de reconstruir los índices; si no, se construye y se guarda.
+    """
+    ruta_snapshot = ruta_snapshot or MAPEO_SNAPSHOT_PATH
+    with open(config_path, 'rb') as f:
+        contenido = f.read()
+    sha_json = hashlib.sha256(contenido).hexdigest()
+    inicio = time.perf_counter()
+    config = cargar_snapshot_mapeo(ruta_snapshot, sha_json)
+    if config is not None:
+        print(f"⚡ Mapeo cargado del snapshot en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+        return config
+
+    data = json.loads(contenido.decode('utf-8'))
+
+    # Convertir direcciones_por_tipo de vuelta a tuplas
+    direcciones_tuplas = {}
+    for key, value in data.get('direcciones_por_tipo', {}).items():
+        if isinstance(key, str) and ',' in key:
+            tipo, direccion = key.split(',', 1)
+            direcciones_tuplas[(tipo, direccion)] = value
+        else:
+            # Si la clave no contiene coma, usarla tal cual
+            direcciones_tuplas[key] = value
+
+    config = construir_configuracion_mapeo(
+        data.get('mapeo_cuentas_contables', {}),
+        direcciones_tuplas,
+        data.get('codigos_agua_disponibles', [])
+    )
+    guardar_snapshot_mapeo(ruta_snapshot, sha_json, config)
+    return config
 
 def load_mapeo_config():
-    """Carga la configuración sensible desde archivo JSON en /app/config/mapeo_sensible.json
+    """Carga la configuración sensible desde el archivo JSON (MAPEO_CONFIG_PATH)
 
     Esta versión prioriza la carga desde un JSON montado en /app/config. Si no está
     presente, devuelve mapeos vacíos.
     """
-    config_path = '/app/config/mapeo_sensible.json'
+    config_path = MAPEO_CONFIG_PATH
     try:
         if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # Convertir direcciones_por_tipo de vuelta a tuplas
-            direcciones_tuplas = {}
-            for key, value in data.get('direcciones_por_tipo', {}).items():
-                if isinstance(key, str) and ',' in key:
-                    tipo, direccion = key.split(',', 1)
-                    direcciones_tuplas[(tipo, direccion)] = value
-                else:
-                    # Si la clave no contiene coma, usarla tal cual
-                    direcciones_tuplas[key] = value
-
+            config = leer_mapeo_json(config_path)
             print("✅ Configuración secreta cargada desde JSON")
-            return {
-                'MAPEO_CUENTAS_CONTABLES': data.get('mapeo_cuentas_contables', {}),
-                'DIRECCIONES_POR_TIPO': direcciones_tuplas,
-                'CODIGOS_AGUA_DISPONIBLES': data.get('codigos_agua_disponibles', [])
-            }
+            return config
         else:
             print(f"⚠️ No se encontró el archivo de configuración en {config_path}")
-            return {
-                'MAPEO_CUENTAS_CONTABLES': {},
-                'DIRECCIONES_POR_TIPO': {},
-                'CODIGOS_AGUA_DISPONIBLES': []
-            }
+            return construir_configuracion_mapeo({}, {}, [])
     except Exception as e:
         print(f"❌ Error cargando configuración: {e}")
-        return {
-            'MAPEO_CUENTAS_CONTABLES': {},
-            'DIRECCIONES_POR_TIPO': {},
-            'CODIGOS_AGUA_DISPONIBLES': []
+        return construir_configuracion_mapeo({}, {}, [])
+
+class ServicioMapeo:
+    """Recarga el mapeo cuando cambia el archivo JSON, sin reiniciar los workers.
+
+    Un hilo en segundo plano comprueba la fecha de modificación del archivo cada
+    `intervalo` segundos; si ha cambiado, construye la configuración nueva (en ese hilo)
+    y la instala con establecer_mapeo. Si el JSON nuevo no es válido se mantiene el mapeo
+    actual y el error queda en el estado. Tras instalarla se programa la reasignación de
+    las facturas guardadas a las que afectan las entradas cambiadas.
+
+    Una recarga pedida a un worker se avisa al resto tocando el archivo ruta_aviso: cada
+    worker compara su fecha en cada petición y, si ha cambiado, despierta a su hilo de
+    vigilancia, que es quien recarga; la petición no espera a la reconstrucción.
+    """
+
+    def __init__(self, ruta, intervalo, ruta_aviso):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.ruta_aviso = ruta_aviso
+        self._mtime = None
+        self._aviso = self._fecha(ruta_aviso)
+        self._lock = threading.Lock()
+        self._lock_aviso = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+        self.estado = {'version': VERSION_MAPEO, 'error': None}
+
+    @staticmethod
+    def _fecha(ruta):
+        try:
+            return os.stat(ruta).st_mtime_ns
+        except OSError:
+            return None
+
+    def fecha_archivo(self):
+        return self._fecha(self.ruta)
+
+    def avisar_recarga(self):
+        """Pide a todos los workers que vuelvan a leer el archivo, sin esperar a la vigilancia"""
+        os.makedirs(os.path.dirname(self.ruta_aviso), exist_ok=True)
+        with self._lock_aviso:
+            with open(self.ruta_aviso, 'w') as f:
+                f.write(f"{os.getpid()} {time.time()}\n")
+            # Este worker recarga ahora mismo: no tiene que atender su propio aviso
+            self._aviso = self._fecha(self.ruta_aviso)
+        return self.recargar(forzar=True)
+
+    def comprobar_aviso(self):
+        """Despierta al hilo de vigilancia si otro worker ha pedido una recarga.
+
+        Se llama en cada petición, así que solo compara la fecha del aviso.
+        """
+        if self._fecha(self.ruta_aviso) != self._aviso:
+            self._despertar.set()
+
+    def atender_aviso(self):
+        """Recarga si hay un aviso nuevo desde la última vez; True si ha recargado"""
+        aviso = self._fecha(self.ruta_aviso)
+        with self._lock_aviso:
+            if aviso == self._aviso:
+                return False
+            self._aviso = aviso
+        print("📣 Recarga del mapeo pedida desde otro worker")
+        self.recargar(forzar=True)
+        return True
+
+    def recargar(self, forzar=False):
+        """Vuelve a leer el archivo si ha cambiado (o siempre, con forzar) y devuelve el estado"""
+        with self._lock:
+            mtime = self.fecha_archivo()
+            if not forzar and mtime == self._mtime:
+                return self.estado
+            inicio = time.perf_counter()
+            try:
+                if mtime is None:
+                    raise FileNotFoundError(f"No se encontró el archivo de configuración en {self.ruta}")
+                config = leer_mapeo_json(self.ruta)
+            except Exception as e:
+                print(f"❌ Error recargando el mapeo (se mantiene la versión {VERSION_MAPEO}): {e}")
+                self._mtime = mtime
+                self.estado = dict(self.estado, error=str(e))
+                return self.estado
+            duracion = time.perf_counter() - inicio
+            cambios = cambios_mapeo(MAPEO_CUENTAS_CONTABLES, DIRECCIONES_POR_TIPO,
+                                    config['MAPEO_CUENTAS_CONTABLES'], config['DIRECCIONES_POR_TIPO'])
+            self.instalar(config, duracion, mtime)
+            print(f"🔄 Mapeo v{self.estado['version']} instalado en {duracion * 1000:.0f} ms "
+                  f"({len(config['MAPEO_CUENTAS_CONTABLES'])} CUPS/contadores, "
+                  f"{cambios['entradas']} entradas cambiadas)")
+            if cambios['entradas']:
+                programar_reasignacion(cambios, f"{config['HUELLA_MAPEO']}:{mtime}")
+            return self.estado
+
+    def instalar(self, config, duracion, mtime):
+        """Instala una configuración ya construida a partir del archivo con fecha mtime"""
+        version = establecer_mapeo(config)
+        self._mtime = mtime
+        self.estado = {
+            'version': version,
+            'huella': config['HUELLA_MAPEO'],
+            'ruta': self.ruta,
+            'cargado': datetime.now().isoformat(timespec='seconds'),
+            'construccion_ms': round(duracion * 1000, 2),
+            'entradas': {
+                'cups_contadores': len(config['MAPEO_CUENTAS_CONTABLES']),
+                'direcciones_por_tipo': len(config['DIRECCIONES_POR_TIPO']),
+                'codigos_agua': len(config['CODIGOS_AGUA_DISPONIBLES']),
+            },
+            'error': None,
         }
 
-# Cargar configuración al inicio
-try:
-    config = load_mapeo_config()
-    MAPEO_CUENTAS_CONTABLES = config['MAPEO_CUENTAS_CONTABLES']
-    DIRECCIONES_POR_TIPO = config['DIRECCIONES_POR_TIPO']
-    CODIGOS_AGUA_DISPONIBLES = config['CODIGOS_AGUA_DISPONIBLES']
-    
-    print(f"📊 Configuración final cargada:")
-    print(f"   - CUPS/Contadores: {len(MAPEO_CUENTAS_CONTABLES)} entradas")
-    print(f"   - Direcciones por tipo: {len(DIRECCIONES_POR_TIPO)} entradas")
-    print(f"   - Códigos agua: {len(CODIGOS_AGUA_DISPONIBLES)} entradas")
-    
-except Exception as e:
-    print(f"❌ Error crítico cargando configuración: {e}")
-    MAPEO_CUENTAS_CONTABLES = {}
-    DIRECCIONES_POR_TIPO = {}
-    CODIGOS_AGUA_DISPONIBLES = {}
+    def _vigilar(self):
+        while True:
+            # Con intervalo 0 no se mira el JSON: el hilo solo atiende los avisos
+            self._despertar.wait(self.intervalo if self.intervalo > 0 else None)
+            self._despertar.clear()
+            try:
+                self.atender_aviso()
+                if self.intervalo > 0:
+                    self.recargar()
+            except Exception as e:
+                print(f"❌ Error vigilando el archivo de mapeo: {e}")
+
+    def iniciar_vigilancia(self):
+        """Arranca el hilo de vigilancia (una vez por proceso)"""
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=self._vigilar, name='vigilancia-mapeo', daemon=True)
+        self._hilo.start()
+
+# Segundos entre comprobaciones del archivo de mapeo; 0 desactiva la recarga automática
+# (los avisos de POST /api/mapeo/recargar se siguen atendiendo)
+MAPEO_INTERVALO_RECARGA = float(os.environ.get('MAPEO_INTERVALO_RECARGA', 5))
+# Archivo que se toca para que todos los workers recarguen (POST /api/mapeo/recargar)
+MAPEO_AVISO_RECARGA_PATH = os.environ.get('MAPEO_AVISO_RECARGA_PATH', os.path.join(app.instance_path, 'mapeo_recarga'))
+SERVICIO_MAPEO = ServicioMapeo(MAPEO_CONFIG_PATH, MAPEO_INTERVALO_RECARGA, MAPEO_AVISO_RECARGA_PATH)
+
+def cargar_mapeo_inicial():
+    """Carga la configuración al arrancar (la llama create_app)"""
+    try:
+        # La fecha se toma antes de leer: un cambio durante la lectura se detectará después
+        mtime_mapeo = SERVICIO_MAPEO.fecha_archivo()
+        inicio_mapeo = time.perf_counter()
+        config = load_mapeo_config()
+        SERVICIO_MAPEO.instalar(config, time.perf_counter() - inicio_mapeo, mtime_mapeo)
+
+        print(f"📊 Configuración final cargada:")
+        print(f"   - CUPS/Contadores: {len(MAPEO_CUENTAS_CONTABLES)} entradas")
+        print(f"   - Direcciones por tipo: {len(DIRECCIONES_POR_TIPO)} entradas")
+        print(f"   - Códigos agua: {len(CODIGOS_AGUA_DISPONIBLES)} entradas")
+
+    except Exception as e:
+        print(f"❌ Error crítico cargando configuración: {e}")
+        establecer_mapeo(construir_configuracion_mapeo({}, {}, []))
 
 # Utilidades de detección
-def _normalize_dir_key(s):
-    if not s:
-        return ''
-    k = s.upper()
-    k = re.sub(r'[\.,/\\#\-]', ' ', k)
-    k = re.sub(r'\s+', ' ', k).strip()
-    return k
+
+# Patrones precompilados de los extractores: se compilan una sola vez al importar el
+# módulo en lugar de en cada llamada.
+_MESES = r'(?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)'
+_NUMERO_IMPORTE = r'([0-9]{1,3}(?:[\.,]\d{3})*[\.,]\d{2})'
+_FECHA = r'(\d{1,2}[\/\-.]\d{1,2}[\/\-.]\d{2,4})'
+
+_RE_CUPS_ESTANDAR = re.compile(r'(ES[0-9A-Z]{16,20})', re.IGNORECASE)
+_RE_CODIGO_10 = re.compile(r'\b(0\d{9})\b')
+_RE_CODIGO_9_10 = re.compile(r'\b(\d{9,10})\b')
+_RE_CUPS_ETIQUETA = re.compile(r'CUPS[:\s]*([A-Z0-9]{10,20})')
+_RE_CONTRATO = re.compile(r'(?:CONTRATO|REFERENCIA)[:\s]*([A-Z0-9]{8,15})')
+
+_RE_DIR_SUMINISTRO_LARGA = re.compile(r'Direcci[óo]n\s+de\s+suministro[:\s]*([^,\n\r]+)', re.IGNORECASE)
+_RE_DIR_TOLEDO = re.compile(r',?\s*TOLEDO.*$', re.IGNORECASE)
+_RE_DIR_CP = re.compile(r',?\s*\d{5}.*$')
+_RE_BAJO_A = re.compile(r'BAJ\s+O\s+A', re.IGNORECASE)
+_RE_BAJO_B = re.compile(r'BAJ\s+O\s+B', re.IGNORECASE)
+_RE_BAJO = re.compile(r'BAJ\s+O', re.IGNORECASE)
+_RE_DIR_SUMINISTRO_CORTA = re.compile(r'Dir\.?\s*Suministro[:\s]*([^,\-/\n\r]+)', re.IGNORECASE)
+_RE_AVDA = re.compile(r'AVDA\.?\s*[A-Z]+\s*\d+[^,\-/\n\r]*', re.IGNORECASE)
+_RE_CALLE_NUMERO = re.compile(r'[A-Z]+\s*\d+[^,\-/\n\r]*')
+_RE_CALLE_GENERICA = re.compile(r'CL(?:ALE )?\.?\s*[A-Z0-9\s]+\d+[^,\-/\n\r]*')
+_RE_FINAL_DIRECCION = re.compile(r'[,\-/\s]+$')
+
+_RE_IMPORTES_TOTAL = [
+    re.compile(r'TOTAL[:\s]*' + _NUMERO_IMPORTE),
+    re.compile(r'TOTAL A FACTURAR[:\s]*' + _NUMERO_IMPORTE),
+]
+_RE_IMPORTE_EUROS = re.compile(_NUMERO_IMPORTE + r'\s*€')
+_RE_IMPORTE_SUELTO = re.compile(r'(\d+[\.,]\d{2})')
+
+_RE_FECHAS_FACTURA = [
+    re.compile(r'FECHA\s*(?:DE\s*)?(?:EMISI[OÓ]N|FACTURA)[:\s]*' + _FECHA),
+    re.compile(r'(?:EMITIDO|EMISIÓN)[:\s]*' + _FECHA),
+    re.compile(r'FACTURA\s*(?:N[º°]?[:\s]*\d+\s*)?(?:DE\s*)?FECHA[:\s]*' + _FECHA),
+    re.compile(r'(\d{1,2}[\/\-.]\d{1,2}[\/\-.]\d{4})'),
+]
+
+_RE_PERIODO_MEDIDA = re.compile(r'PERIODO\s*DE\s*MEDIDA\s*:\s*(.*?)(?:\n|$)')
+_RE_PERIODO_FACTURADO = re.compile(
+    r'PERIODO\s*FACTURADO[:\s]*(' + _MESES + r'[^0-9]*\d{4}(?:\s*[-–—]\s*' + _MESES + r'[^0-9]*\d{4})?)')
+_RE_PERIODO_MESES = re.compile(
+    r'(' + _MESES + r'\s*(?:[-–—]\s*)?' + _MESES + r'?\s*\d{4}(?:\s*[-–—]\s*' + _MESES + r'?\s*\d{4})?)')
+
+_RE_COD_ABAST = re.compile(r'C\.?\s*ABAST[:\.]?\s*(\d{1,6})')
+_RE_COD_ABAST_ALT = re.compile(r'COD\s*ABAST[:\.]?\s*(\d{1,6})')
+_RE_POLIZA = re.compile(r'P\.?OLI?Z?A?[:\.]?\s*(\d{1,10})')
+_RE_POLIZA_ALT = re.compile(r'POLIZA[:\.]?\s*(\d{1,10})')
+
+_RE_CONTADOR_ETIQUETA = re.compile(r'Contador:\s*([A-Z0-9\-]{5,30})')
+_RE_CONTADOR = re.compile(r'CONTADOR[:\s]*([A-Z0-9\-]{5,30})')
+_RE_CONTADOR_TOKEN = re.compile(r'([A-Z]{1,3}[0-9A-Z]{6,20})')
+
+_RE_COMUNIDAD_AGUA = re.compile(r'Dir\.?\s*Suministro[:\s]*([^\n\r]+)', re.IGNORECASE)
+_RE_COMUNIDAD_LUZ = re.compile(r'Nombre[/\s]*Razón\s+social[:\s]*([^\n\r]+)', re.IGNORECASE)
+_RE_COM_PROP = re.compile(r'COM\s*PROP[^\w]*', re.IGNORECASE)
+_RE_COMUNIDAD_PROPIETARIOS = re.compile(r'COMUNIDAD\s+DE\s+PROPIETARIOS[^\w]*', re.IGNORECASE)
+_RE_FINAL_COMUNIDAD = re.compile(r'[\s,\-]+$')
+
+class TextoFactura:
+    """Texto de una factura con sus normalizaciones (mayúsculas/minúsculas) calculadas una vez.
+
+    Los extractores aceptan indistintamente una cadena o un TextoFactura; al pasar el
+    mismo objeto a todos ellos el texto se normaliza una sola vez por documento.
+    """
+    __slots__ = ('original', '_upper', '_lower')
+
+    def __init__(self, texto):
+        self.original = texto or ''
+        self._upper = None
+        self._lower = None
+
+    @classmethod
+    def de(cls, texto):
+        return texto if isinstance(texto, cls) else cls(texto)
+
+    @property
+    def upper(self):
+        if self._upper is None:
+            self._upper = self.original.upper()
+        return self._upper
+
+    @property
+    def lower(self):
+        if self._lower is None:
+            self._lower = self.original.lower()
+        return self._lower
+
+    def __bool__(self):
+        return bool(self.original)
 
 def detectar_tipo_gasto(texto, filename=None):
-    t = (texto or '')
+    t = TextoFactura.de(texto).lower
     if filename:
-        t += ' ' + filename
-    t = t.lower()
+        t += ' ' + filename.lower()
     if any(x in t for x in ['aqualia', 'agua']):
         return 'Agua'
     if any(x in t for x in ['electric', 'eléctr', 'eléctrico', 'energ', 'luz']):
@@ -221,187 +1025,191 @@ def detectar_tipo_gasto(texto, filename=None):
         return 'Limpieza'
     return 'Otros'
 
-def detectar_cups_o_contador(texto):
-    """Detecta CUPS o contador en el texto"""
-    if not texto:
+def detectar_cups_o_contador(texto, mapeo=None):
+    """Detecta CUPS o contador en el texto (mapeo: configuración a usar, por defecto MAPEO_ACTUAL)"""
+    mapeo = mapeo or MAPEO_ACTUAL
+    tf = TextoFactura.de(texto)
+    if not tf:
         return None
+    texto = tf.original
     
     # 1. Buscar CUPS estándar (ES + 16-20 caracteres)
-    m = re.search(r'(ES[0-9A-Z]{16,20})', texto, re.IGNORECASE)
+    m = _RE_CUPS_ESTANDAR.search(texto)
     if m:
         return m.group(1).upper()
     
     # 2. Buscar códigos numéricos específicos de facturas
     # Patrones para códigos de 10 dígitos como 0039889075, 0016633368, etc.
-    m_codigo = re.search(r'\b(0\d{9})\b', texto)
+    m_codigo = _RE_CODIGO_10.search(texto)
     if m_codigo:
         return m_codigo.group(1)
     
     # 3. Buscar códigos sin cero inicial pero de 9-10 dígitos
-    m_codigo2 = re.search(r'\b(\d{9,10})\b', texto)
+    m_codigo2 = _RE_CODIGO_9_10.search(texto)
     if m_codigo2:
         codigo = m_codigo2.group(1)
         # Verificar si está en nuestro mapeo
-        if codigo in MAPEO_CUENTAS_CONTABLES:
+        if codigo in mapeo['MAPEO_CUENTAS_CONTABLES']:
             return codigo
     
-    # 4. Buscar claves específicas en los mappings secretos
-    for k in MAPEO_CUENTAS_CONTABLES.keys():
-        if k.upper() in texto.upper():
-            return k
+    # 4. Buscar claves específicas en los mappings secretos (una pasada con el índice)
+    texto_u = tf.upper
+    clave = mapeo['INDICES_MAPEO']['claves'].primera_coincidencia(texto_u)
+    if clave is not None:
+        return clave
     
     # 5. Buscar en patrones específicos de facturas de luz
     # Buscar después de "CUPS:" o "Código CUPS:"
-    m_cups = re.search(r'CUPS[:\s]*([A-Z0-9]{10,20})', texto.upper())
+    m_cups = _RE_CUPS_ETIQUETA.search(texto_u)
     if m_cups:
         return m_cups.group(1)
     
     # 6. Buscar números de contrato o referencia
-    m_contrato = re.search(r'(?:CONTRATO|REFERENCIA)[:\s]*([A-Z0-9]{8,15})', texto.upper())
+    m_contrato = _RE_CONTRATO.search(texto_u)
     if m_contrato:
         return m_contrato.group(1)
     
     return None
 
-def detectar_direccion(texto):
-    if not texto:
+def detectar_direccion(texto, mapeo=None):
+    mapeo = mapeo or MAPEO_ACTUAL
+    tf = TextoFactura.de(texto)
+    if not tf:
         return None
+    texto = tf.original
     
     # 1. Buscar "Dirección de suministro:" (para facturas de luz)
-    m_dir_suministro = re.search(r'Direcci[óo]n\s+de\s+suministro[:\s]*([^,\n\r]+)', texto, re.IGNORECASE)
+    m_dir_suministro = _RE_DIR_SUMINISTRO_LARGA.search(texto)
     if m_dir_suministro:
         direccion = m_dir_suministro.group(1).strip()
         # Limpiar la dirección
-        direccion = re.sub(r'\s+', ' ', direccion)
+        direccion = _RE_ESPACIOS.sub(' ', direccion)
         # Remover ciudad y código postal del final
-        direccion = re.sub(r',?\s*TOLEDO.*$', '', direccion, flags=re.IGNORECASE)
-        direccion = re.sub(r',?\s*\d{5}.*$', '', direccion)
+        direccion = _RE_DIR_TOLEDO.sub('', direccion)
+        direccion = _RE_DIR_CP.sub('', direccion)
         # Arreglar espacios raros como "BAJ O A" -> "BAJO A"
-        direccion = re.sub(r'BAJ\s+O\s+A', 'BAJO A', direccion, flags=re.IGNORECASE)
-        direccion = re.sub(r'BAJ\s+O\s+B', 'BAJO B', direccion, flags=re.IGNORECASE)
-        direccion = re.sub(r'BAJ\s+O', 'BAJO', direccion, flags=re.IGNORECASE)
+        direccion = _RE_BAJO_A.sub('BAJO A', direccion)
+        direccion = _RE_BAJO_B.sub('BAJO B', direccion)
+        direccion = _RE_BAJO.sub('BAJO', direccion)
         return direccion.strip()
     
     # 2. Buscar "Dir. Suministro:" (formato corto)
-    m_suministro = re.search(r'Dir\.?\s*Suministro[:\s]*([^,\-/\n\r]+)', texto, re.IGNORECASE)
+    m_suministro = _RE_DIR_SUMINISTRO_CORTA.search(texto)
     if m_suministro:
         direccion = m_suministro.group(1).strip()
         # Limpiar la dirección y quitar espacios extra
-        direccion = re.sub(r'\s+', ' ', direccion)
+        direccion = _RE_ESPACIOS.sub(' ', direccion)
         return direccion
     
-    # 3. Buscar direcciones genéricas en mappings primero
-    for v in MAPEO_CUENTAS_CONTABLES.values():
-        dirref = v.get('direccion_referencia', '')
-        if dirref and dirref.upper() in texto.upper():
-            return dirref
+    # 3. Buscar direcciones genéricas en mappings primero (una pasada con el índice)
+    tex = tf.upper
+    coincidencia = mapeo['INDICES_MAPEO']['direcciones_referencia'].primera_coincidencia(tex)
+    if coincidencia:
+        return coincidencia[0]
     
     # Buscar patrones genéricos de direcciones
-    m_avda = re.search(r'AVDA\.?\s*[A-Z]+\s*\d+[^,\-/\n\r]*', texto, re.IGNORECASE)
+    m_avda = _RE_AVDA.search(texto)
     if m_avda:
         direccion = m_avda.group(0).strip()
         # Quitar caracteres al final que puedan ser problemáticos
-        direccion = re.sub(r'[,\-/\s]+$', '', direccion)
+        direccion = _RE_FINAL_DIRECCION.sub('', direccion)
         return direccion
     
     # Buscar variantes genéricas
-    tex = texto.upper()
     # Buscar cualquier patrón de calle + número
-    m = re.search(r'[A-Z]+\s*\d+[^,\-/\n\r]*', tex)
+    m = _RE_CALLE_NUMERO.search(tex)
     if m:
         direccion = m.group(0).strip()
-        direccion = re.sub(r'[,\-/\s]+$', '', direccion)
+        direccion = _RE_FINAL_DIRECCION.sub('', direccion)
         return direccion
     
     # fallback genérico
-    m2 = re.search(r'CL(?:ALE )?\.?\s*[A-Z0-9\s]+\d+[^,\-/\n\r]*', tex)
+    m2 = _RE_CALLE_GENERICA.search(tex)
     if m2:
         direccion = m2.group(0).strip()
-        direccion = re.sub(r'[,\-/\s]+$', '', direccion)
+        direccion = _RE_FINAL_DIRECCION.sub('', direccion)
         return direccion
     return None
 
-def detectar_importe_total(texto):
-    if not texto:
+def _parse_numero(s):
+    s = s.strip()
+    # si tiene punto y coma europeos: punto = miles, coma = decimales
+    if ',' in s and '.' in s:
+        s = s.replace('.', '').replace(',', '.')
+    elif ',' in s and not '.' in s:
+        s = s.replace(',', '.')
+    try:
+        return float(s)
+    except Exception:
         return None
 
-    def parse_numero(s):
-        s = s.strip()
-        # si tiene punto y coma europeos: punto = miles, coma = decimales
-        if ',' in s and '.' in s:
-            s = s.replace('.', '').replace(',', '.')
-        elif ',' in s and not '.' in s:
-            s = s.replace(',', '.')
-        try:
-            return float(s)
-        except Exception:
-            return None
+def importe_total_explicito(texto):
+    """Importe de la primera línea TOTAL del texto (None si no la hay)"""
+    tf = TextoFactura.de(texto)
+    m = _RE_IMPORTES_TOTAL[0].search(tf.upper) if tf else None
+    return _parse_numero(m.group(1)) or None if m else None
 
-    texto_u = texto.upper()
-    patrones = [
-        r'TOTAL[:\s]*([0-9]{1,3}(?:[\.,]\d{3})*[\.,]\d{2})',
-        r'TOTAL A FACTURAR[:\s]*([0-9]{1,3}(?:[\.,]\d{3})*[\.,]\d{2})'
-    ]
-    for patron in patrones:
-        m = re.search(patron, texto_u)
+def detectar_importe_total(texto):
+    tf = TextoFactura.de(texto)
+    if not tf:
+        return None
+
+    texto_u = tf.upper
+    for patron in _RE_IMPORTES_TOTAL:
+        m = patron.search(texto_u)
         if m:
-            val = parse_numero(m.group(1))
+            val = _parse_numero(m.group(1))
             if val:
                 return val
     
-    matches = re.findall(r'([0-9]{1,3}(?:[\.,]\d{3})*[\.,]\d{2})\s*€', texto)
-    vals = [parse_numero(s) for s in matches if parse_numero(s) is not None]
+    matches = _RE_IMPORTE_EUROS.findall(tf.original)
+    vals = [v for v in (_parse_numero(s) for s in matches) if v is not None]
     if vals:
         return max(vals)
     
-    m2 = re.search(r'(\d+[\.,]\d{2})', texto)
+    m2 = _RE_IMPORTE_SUELTO.search(tf.original)
     if m2:
-        val = parse_numero(m2.group(1))
+        val = _parse_numero(m2.group(1))
         if val:
             return val
     return None
 
 def detectar_fecha_factura(texto):
     """Detecta la fecha de emisión de la factura del PDF"""
-    if not texto:
+    tf = TextoFactura.de(texto)
+    if not tf:
         return None
     
     # Buscar "Fecha emisión:", "Fecha factura:", etc.
-    patrones_fecha = [
-        r'FECHA\s*(?:DE\s*)?(?:EMISI[OÓ]N|FACTURA)[:\s]*(\d{1,2}[\/\-.]\d{1,2}[\/\-.]\d{2,4})',
-        r'(?:EMITIDO|EMISIÓN)[:\s]*(\d{1,2}[\/\-.]\d{1,2}[\/\-.]\d{2,4})',
-        r'FACTURA\s*(?:N[º°]?[:\s]*\d+\s*)?(?:DE\s*)?FECHA[:\s]*(\d{1,2}[\/\-.]\d{1,2}[\/\-.]\d{2,4})',
-        r'(\d{1,2}[\/\-.]\d{1,2}[\/\-.]\d{4})'
-    ]
-    
-    texto_u = texto.upper()
-    for patron in patrones_fecha:
-        m = re.search(patron, texto_u)
+    texto_u = tf.upper
+    for patron in _RE_FECHAS_FACTURA:
+        m = patron.search(texto_u)
         if m:
             return m.group(1)
     
     return None
 
 def detectar_periodo_facturacion(texto):
-    if not texto:
+    tf = TextoFactura.de(texto)
+    if not tf:
         return None
-    texto_u = texto.upper()
+    texto_u = tf.upper
     
     # 1. Buscar "Periodo de Medida:" específico para facturas de luz
-    m_medida = re.search(r'PERIODO\s*DE\s*MEDIDA\s*:\s*(.*?)(?:\n|$)', texto_u)
+    m_medida = _RE_PERIODO_MEDIDA.search(texto_u)
     if m_medida:
         periodo_texto = m_medida.group(1).strip()
         # Limpiar texto extra pero mantener fechas completas
-        periodo_limpio = re.sub(r'\s+', ' ', periodo_texto)
+        periodo_limpio = _RE_ESPACIOS.sub(' ', periodo_texto)
         return periodo_limpio
     
     # 2. Buscar "Periodo Facturado:" seguido del periodo
-    m_facturado = re.search(r'PERIODO\s*FACTURADO[:\s]*((?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)[^0-9]*\d{4}(?:\s*[-–—]\s*(?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)[^0-9]*\d{4})?)', texto_u)
+    m_facturado = _RE_PERIODO_FACTURADO.search(texto_u)
     if m_facturado:
         return m_facturado.group(1)
     
     # 3. Buscar formatos como "FEB-MAR 2024" o "DIC 2024 - ENE 2025"
-    m_meses = re.search(r'((?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)\s*(?:[-–—]\s*)?(?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)?\s*\d{4}(?:\s*[-–—]\s*(?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)?\s*\d{4})?)', texto_u)
+    m_meses = _RE_PERIODO_MESES.search(texto_u)
     if m_meses:
         return m_meses.group(1)
     
@@ -409,20 +1217,21 @@ def detectar_periodo_facturacion(texto):
 
 def detectar_poliza_y_cod_abast(texto):
     """Busca Cód. Abast. y Póliza en el texto. Devuelve (cod_abast, poliza) o (None, None)."""
-    if not texto:
+    tf = TextoFactura.de(texto)
+    if not tf:
         return (None, None)
-    texto_u = texto.upper()
+    texto_u = tf.upper
     cod = None
     pol = None
-    m_cod = re.search(r'C\.?\s*ABAST[:\.]?\s*(\d{1,6})', texto_u)
+    m_cod = _RE_COD_ABAST.search(texto_u)
     if not m_cod:
-        m_cod = re.search(r'COD\s*ABAST[:\.]?\s*(\d{1,6})', texto_u)
+        m_cod = _RE_COD_ABAST_ALT.search(texto_u)
     if m_cod:
         cod = m_cod.group(1)
 
-    m_pol = re.search(r'P\.?OLI?Z?A?[:\.]?\s*(\d{1,10})', texto_u)
+    m_pol = _RE_POLIZA.search(texto_u)
     if not m_pol:
-        m_pol = re.search(r'POLIZA[:\.]?\s*(\d{1,10})', texto_u)
+        m_pol = _RE_POLIZA_ALT.search(texto_u)
     if m_pol:
         pol = m_pol.group(1)
 
@@ -430,96 +1239,103 @@ def detectar_poliza_y_cod_abast(texto):
 
 def detectar_contador(texto):
     """Busca un identificador de contador del estilo D09NA077422 u otros alfanuméricos."""
-    if not texto:
+    tf = TextoFactura.de(texto)
+    if not tf:
         return None
     
     # Buscar patrón específico: "Contador: XXXXXXXXX"
-    m = re.search(r'Contador:\s*([A-Z0-9\-]{5,30})', texto)
+    m = _RE_CONTADOR_ETIQUETA.search(tf.original)
     if m:
         return m.group(1)
     
     # Buscar la palabra 'CONTADOR' seguida de un token (mayúsculas)
-    m2 = re.search(r'CONTADOR[:\s]*([A-Z0-9\-]{5,30})', texto.upper())
+    m2 = _RE_CONTADOR.search(tf.upper)
     if m2:
         return m2.group(1)
     
     # fallback: buscar tokens que parecieran número de contador (letras+digitos)
-    m3 = re.search(r'([A-Z]{1,3}[0-9A-Z]{6,20})', texto.upper())
+    m3 = _RE_CONTADOR_TOKEN.search(tf.upper)
     if m3:
         return m3.group(1)
     return None
 
+def _limpiar_comunidad(comunidad):
+    """Elimina 'COM PROP' / 'COMUNIDAD DE PROPIETARIOS' del nombre de una comunidad"""
+    comunidad = _RE_COM_PROP.sub('', comunidad)
+    return _RE_COMUNIDAD_PROPIETARIOS.sub('', comunidad)
+
 def detectar_comunidad_factura(texto, tipo_gasto):
     """Detecta la comunidad según el tipo de factura"""
-    if not texto:
+    tf = TextoFactura.de(texto)
+    if not tf:
         return None
+    texto = tf.original
     
     # Para facturas de agua: buscar después de "Dir. Suministro:"
     if tipo_gasto and tipo_gasto.lower() == 'agua':
-        m_dir_suministro = re.search(r'Dir\.?\s*Suministro[:\s]*([^\n\r]+)', texto, re.IGNORECASE)
+        m_dir_suministro = _RE_COMUNIDAD_AGUA.search(texto)
         if m_dir_suministro:
             comunidad = m_dir_suministro.group(1).strip()
             
             # Tratamiento especial para agua: limpiar más agresivamente
             # Eliminar "COM PROP" y similares
-            comunidad = re.sub(r'COM\s*PROP[^\w]*', '', comunidad, flags=re.IGNORECASE)
-            comunidad = re.sub(r'COMUNIDAD\s+DE\s+PROPIETARIOS[^\w]*', '', comunidad, flags=re.IGNORECASE)
+            comunidad = _limpiar_comunidad(comunidad)
             
             # Para agua: cortar antes de TOLEDO y limpiar ciudades/códigos postales
-            comunidad = re.sub(r',?\s*TOLEDO.*$', '', comunidad, flags=re.IGNORECASE)
-            comunidad = re.sub(r',?\s*\d{5}.*$', '', comunidad)  # Eliminar códigos postales y lo que sigue
+            comunidad = _RE_DIR_TOLEDO.sub('', comunidad)
+            comunidad = _RE_DIR_CP.sub('', comunidad)  # Eliminar códigos postales y lo que sigue
             
             # Limpiar guiones, comas y espacios al final
-            comunidad = re.sub(r'[\s,\-]+$', '', comunidad)
-            comunidad = re.sub(r'\s+', ' ', comunidad).strip()
+            comunidad = _RE_FINAL_COMUNIDAD.sub('', comunidad)
+            comunidad = _RE_ESPACIOS.sub(' ', comunidad).strip()
             
             # Si queda algo válido, devolverlo
             return comunidad if comunidad and len(comunidad) > 3 else None
     
     # Para facturas de electricidad/luz: buscar después de "Nombre/Razón social:"
     elif tipo_gasto and tipo_gasto.lower() in ['electricidad', 'luz']:
-        m_nombre_razon = re.search(r'Nombre[/\s]*Razón\s+social[:\s]*([^\n\r]+)', texto, re.IGNORECASE)
+        m_nombre_razon = _RE_COMUNIDAD_LUZ.search(texto)
         if m_nombre_razon:
             comunidad = m_nombre_razon.group(1).strip()
             # Limpiar y eliminar "COM PROP" y similares
-            comunidad = re.sub(r'COM\s*PROP[^\w]*', '', comunidad, flags=re.IGNORECASE)
-            comunidad = re.sub(r'COMUNIDAD\s+DE\s+PROPIETARIOS[^\w]*', '', comunidad, flags=re.IGNORECASE)
+            comunidad = _limpiar_comunidad(comunidad)
             # Limpiar guiones y comas al final, y espacios múltiples
-            comunidad = re.sub(r'[\s,\-]+$', '', comunidad)
-            comunidad = re.sub(r'\s+', ' ', comunidad).strip()
+            comunidad = _RE_FINAL_COMUNIDAD.sub('', comunidad)
+            comunidad = _RE_ESPACIOS.sub(' ', comunidad).strip()
             return comunidad if comunidad else None
     
     return None
 
-def asignar_cuenta_contable_con_tipos(cups_o_contador, direccion, tipo_gasto):
+def asignar_cuenta_contable_con_tipos(cups_o_contador, direccion, tipo_gasto, mapeo=None):
     """Asigna cuenta contable basada en CUPS/contador, dirección y tipo de gasto"""
+    mapeo = mapeo or MAPEO_ACTUAL
+    indices = mapeo['INDICES_MAPEO']
     
     # 1. Buscar por CUPS/contador primero
-    if cups_o_contador and cups_o_contador in MAPEO_CUENTAS_CONTABLES:
-        entry = MAPEO_CUENTAS_CONTABLES[cups_o_contador]
+    if cups_o_contador and cups_o_contador in mapeo['MAPEO_CUENTAS_CONTABLES']:
+        entry = mapeo['MAPEO_CUENTAS_CONTABLES'][cups_o_contador]
         return entry.get('comunidad', 'No detectada'), entry.get('cuenta', '628')
     
     # 2. Buscar por dirección específica usando el mapeo de direcciones por tipo
     if direccion and tipo_gasto:
         # Buscar coincidencia exacta primero
         clave_direccion = (tipo_gasto, direccion)
-        if clave_direccion in DIRECCIONES_POR_TIPO:
-            entry = DIRECCIONES_POR_TIPO[clave_direccion]
+        if clave_direccion in mapeo['DIRECCIONES_POR_TIPO']:
+            entry = mapeo['DIRECCIONES_POR_TIPO'][clave_direccion]
             return entry.get('comunidad', 'No detectada'), entry.get('cuenta', '628')
         
-        # Buscar coincidencias parciales en direcciones
-        direccion_upper = direccion.upper()
-        for (tipo_map, dir_map), entry in DIRECCIONES_POR_TIPO.items():
-            if tipo_map == tipo_gasto and dir_map.upper() in direccion_upper:
-                return entry.get('comunidad', 'No detectada'), entry.get('cuenta', '628')
+        # Buscar coincidencias parciales en direcciones del mismo tipo
+        indice_tipo = indices['direcciones_parciales'].get(tipo_gasto)
+        entry = indice_tipo.primera_coincidencia(direccion.upper()) if indice_tipo else None
+        if entry is not None:
+            return entry.get('comunidad', 'No detectada'), entry.get('cuenta', '628')
     
     # 3. Buscar por dirección en el mapeo principal (fallback)
     if direccion:
-        direccion_upper = direccion.upper()
-        for entry in MAPEO_CUENTAS_CONTABLES.values():
-            direccion_ref = entry.get('direccion_referencia', '').upper()
-            if direccion_ref and direccion_ref in direccion_upper:
-                return entry.get('comunidad', 'No detectada'), entry.get('cuenta', '628')
+        coincidencia = indices['direcciones_referencia'].primera_coincidencia(direccion.upper())
+        if coincidencia:
+            entry = coincidencia[1]
+            return entry.get('comunidad', 'No detectada'), entry.get('cuenta', '628')
     
     # 4. Fallback por tipo
     if tipo_gasto == 'Agua':
@@ -551,17 +1367,8 @@ def generar_nombre_archivo(fecha, proveedor, importe, numero_factura=None):
 
 def procesar_pdf_texto(file_path):
     """Procesa un PDF y extrae toda la información"""
-    texto = ""
-    
-    # Intentar extraer texto con PyPDF2 si está disponible
-    if PYPDF2_ENABLED:
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    texto += page.extract_text() + "\n"
-        except Exception as e:
-            print(f"Error extrayendo texto PDF: {e}")
+    # Extraer el texto de todas las páginas con PyPDF2 (si está disponible)
+    texto = "".join(f"{pagina}\n" for pagina in iterar_paginas_pdf(file_path, None))
     
     if not texto.strip():
         # Si no se pudo extraer texto, usar datos simulados
@@ -573,15 +1380,16 @@ def procesar_pdf_texto(file_path):
         CONTADOR: Q22EA038022
         """
     
-    # Procesar información
-    tipo_gasto = detectar_tipo_gasto(texto)
-    cups_contador = detectar_cups_o_contador(texto)
-    direccion = detectar_direccion(texto)
-    importe = detectar_importe_total(texto)
-    fecha_factura = detectar_fecha_factura(texto)
-    periodo = detectar_periodo_facturacion(texto)
-    cod_abast, poliza = detectar_poliza_y_cod_abast(texto)
-    contador = detectar_contador(texto)
+    # Procesar información (normalizando el texto una sola vez)
+    texto_factura = TextoFactura(texto)
+    tipo_gasto = detectar_tipo_gasto(texto_factura)
+    cups_contador = detectar_cups_o_contador(texto_factura)
+    direccion = detectar_direccion(texto_factura)
+    importe = detectar_importe_total(texto_factura)
+    fecha_factura = detectar_fecha_factura(texto_factura)
+    periodo = detectar_periodo_facturacion(texto_factura)
+    cod_abast, poliza = detectar_poliza_y_cod_abast(texto_factura)
+    contador = detectar_contador(texto_factura)
     
     # Si no hay CUPS pero sí contador, usar el contador como identificador principal
     # Para mostrar, priorizar contador si es más corto y legible
@@ -596,7 +1404,7 @@ def procesar_pdf_texto(file_path):
         cups_contador = contador
     
     # Detectar comunidad específica según el tipo de factura
-    comunidad_especifica = detectar_comunidad_factura(texto, tipo_gasto)
+    comunidad_especifica = detectar_comunidad_factura(texto_factura, tipo_gasto)
     
     # Asignar cuenta contable (fallback si no se detecta comunidad específica)
     comunidad_fallback, cuenta_contable = asignar_cuenta_contable_con_tipos(cups_contador, direccion, tipo_gasto)
@@ -698,10 +1506,30 @@ CUENTAS_CONTABLES = {
 # MIDDLEWARES Y FUNCIONES AUXILIARES
 # ========================================
 
+# Rutas que fijan su propia política de caché (privada) en lugar de no-store
+ENDPOINTS_CACHE_PRIVADA = {'preview_imagen'}
+
+@app.before_request
+def iniciar_vigilancia_mapeo():
+    """Arranca la vigilancia del mapeo con la primera petición de cada worker.
+
+    No se hace al importar para que el hilo no se quede en el proceso maestro de
+    gunicorn (--preload) ni se arranque en los procesos del pool. Si la aplicación se
+    sirve sin pasar por create_app (por ejemplo "gunicorn app:app"), la arranca aquí.
+    También avisa al hilo de vigilancia de las recargas del mapeo pedidas a otro worker.
+    """
+    if not _APLICACION_PREPARADA:
+        create_app()
+    SERVICIO_MAPEO.iniciar_vigilancia()
+    SERVICIO_MAPEO.comprobar_aviso()
+
 @app.after_request
 def add_security_headers(response):
     """Agregar headers de seguridad para evitar indexación"""
     response.headers['X-Robots-Tag'] = 'noindex, nofollow, noarchive, nosnippet'
+    if request.endpoint in ENDPOINTS_CACHE_PRIVADA and response.status_code in (200, 304):
+        response.vary.add('Cookie')
+        return response
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, private'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
@@ -788,6 +1616,189 @@ def logout():
     flash('Has cerrado sesión correctamente.', 'success')
     return redirect(url_for('login'))
 
+# ========================================
+# ALMACÉN DE FACTURAS
+# ========================================
+
+# Tamaño de página por defecto y máximo de /api/facturas y del dashboard
+FACTURAS_POR_PAGINA = 100
+FACTURAS_POR_PAGINA_MAX = 500
+
+# Orden del dashboard si no se indica otro: las últimas procesadas primero
+ORDEN_DASHBOARD = '-procesamiento'
+# Claves de ordenación admitidas ('-clave' para orden descendente)
+ORDENES_FACTURAS = {
+    'procesamiento': Factura.created_at,
+    'fecha': Factura.fecha,
+    'tipo': Factura.tipo,
+    'comunidad': Factura.comunidad,
+    'cuenta': Factura.cuenta,
+    'nombre': Factura.nombre,
+}
+FILTROS_FACTURAS = ('tipo', 'comunidad', 'cuenta', 'estado')
+CAMPOS_FACTURA = ('id', 'nombre', 'archivo_procesado', 'cups', 'direccion', 'fecha', 'tipo', 'importe',
+                  'estado', 'comunidad', 'cuenta', 'cuenta_contable', 'procesado', 'movimiento_contable',
+                  'aprobacion', 'periodo', 'acciones')
+
+def codificar_cursor(valor, id_factura):
+    """Cursor opaco con el valor de ordenación y el id de la última fila de una página"""
+    if isinstance(valor, (date, datetime)):
+        valor = valor.isoformat()
+    contenido = json.dumps([valor, id_factura], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(contenido).decode('ascii').rstrip('=')
+
+def decodificar_cursor(cursor, columna):
+    """Inverso de codificar_cursor; ValueError si el cursor no es válido"""
+    try:
+        contenido = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valor, id_factura = json.loads(contenido)
+        if valor is not None and columna.type.python_type is datetime:
+            valor = datetime.fromisoformat(valor)
+        elif valor is not None and columna.type.python_type is date:
+            valor = date.fromisoformat(valor)
+    except (ValueError, TypeError):
+        raise ValueError("Cursor no válido")
+    return valor, id_factura
+
+def _condicion_cursor(columna, valor, ultimo_id, descendente):
+    """Filas posteriores a (valor, ultimo_id) en el orden (columna, id).
+
+    SQLite coloca los NULL al principio en orden ascendente y al final en descendente.
+    """
+    if descendente:
+        if valor is None:
+            return db.and_(columna.is_(None), Factura.id < ultimo_id)
+        return db.or_(columna < valor, db.and_(columna == valor, Factura.id < ultimo_id), columna.is_(None))
+    if valor is None:
+        return db.or_(db.and_(columna.is_(None), Factura.id > ultimo_id), columna.isnot(None))
+    return db.or_(columna > valor, db.and_(columna == valor, Factura.id > ultimo_id))
+
+def consultar_facturas(filtros=None, orden='procesamiento', descendente=False, cursor=None,
+                       limite=FACTURAS_POR_PAGINA):
+    """Página de facturas filtradas y ordenadas, con paginación por cursor.
+
+    El cursor guarda el valor de ordenación y el id de la última fila devuelta, así que
+    pedir la página siguiente no recorre las anteriores. Devuelve (facturas, cursor
+    de la página siguiente o None si es la última).
+    """
+    filtros = filtros or {}
+    columna = ORDENES_FACTURAS[orden]
+    consulta = Factura.query
+    for campo in FILTROS_FACTURAS:
+        if filtros.get(campo):
+            consulta = consulta.filter(getattr(Factura, campo).in_(filtros[campo]))
+    if filtros.get('procesado') is not None:
+        consulta = consulta.filter(Factura.procesado == filtros['procesado'])
+    if filtros.get('fecha_desde'):
+        consulta = consulta.filter(Factura.fecha >= filtros['fecha_desde'])
+    if filtros.get('fecha_hasta'):
+        consulta = consulta.filter(Factura.fecha <= filtros['fecha_hasta'])
+    if cursor:
+        valor, ultimo_id = decodificar_cursor(cursor, columna)
+        consulta = consulta.filter(_condicion_cursor(columna, valor, ultimo_id, descendente))
+    if descendente:
+        consulta = consulta.order_by(columna.desc(), Factura.id.desc())
+    else:
+        consulta = consulta.order_by(columna.asc(), Factura.id.asc())
+
+    filas = consulta.limit(limite + 1).all()
+    if len(filas) <= limite:
+        return filas, None
+    filas = filas[:limite]
+    return filas, codificar_cursor(getattr(filas[-1], columna.key), filas[-1].id)
+
+def _parse_fecha_filtro(valor):
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(valor, formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Fecha no válida: {valor}")
+
+def parametros_consulta_facturas(args, orden_defecto='procesamiento'):
+    """Lee filtros, orden, cursor y límite de la query string para consultar_facturas.
+
+    orden_defecto se usa si la query string no trae orden. Lanza ValueError con un
+    mensaje para el usuario si algún parámetro no es válido.
+    """
+    filtros = {campo: args.getlist(campo) for campo in FILTROS_FACTURAS if args.getlist(campo)}
+    procesado = args.get('procesado')
+    if procesado is not None:
+        if procesado.lower() not in ('true', 'false', '1', '0'):
+            raise ValueError(f"Valor de procesado no válido: {procesado}")
+        filtros['procesado'] = procesado.lower() in ('true', '1')
+    for campo in ('fecha_desde', 'fecha_hasta'):
+        if args.get(campo):
+            filtros[campo] = _parse_fecha_filtro(args[campo])
+
+    orden = args.get('orden') or orden_defecto
+    descendente = orden.startswith('-')
+    orden = orden.lstrip('-')
+    if orden not in ORDENES_FACTURAS:
+        raise ValueError(f"Orden no válido: {orden}. Opciones: {', '.join(ORDENES_FACTURAS)}")
+
+    limite = args.get('limite', FACTURAS_POR_PAGINA, type=int)
+    return {
+        'filtros': filtros,
+        'orden': orden,
+        'descendente': descendente,
+        'cursor': args.get('cursor') or None,
+        'limite': min(max(limite, 1), FACTURAS_POR_PAGINA_MAX),
+    }
+
+def buscar_factura(clave):
+    """Factura por id, nombre original o nombre renombrado (None si no existe).
+
+    Cada paso es una búsqueda por clave primaria o por índice, así que el coste no
+    depende del número de facturas guardadas.
+    """
+    factura = db.session.get(Factura, clave)
+    if factura is None:
+        factura = Factura.query.filter_by(nombre=clave).first()
+    if factura is None:
+        factura = Factura.query.filter_by(archivo_procesado=clave).first()
+    return factura
+
+def ruta_pdf_factura(factura):
+    """Ruta del PDF de una factura (None si ya no está).
+
+    Se guardan como <sha256>.pdf; las subidas anteriores conservan su nombre original.
+    """
+    if factura.sha256:
+        ruta = _ruta_upload(f"{factura.sha256}.pdf")
+        if ruta:
+            return ruta
+    return _ruta_upload(factura.nombre)
+
+_RE_CARACTERES_NO_VALIDOS = re.compile(r'[<>:"/\\|?*]')
+
+def nombre_descarga_factura(factura):
+    """Nombre con el que se descarga el PDF: el renombrado (archivo_procesado) con extensión .pdf"""
+    nombre = factura.archivo_procesado or factura.nombre
+    if not nombre.lower().endswith('.pdf'):
+        nombre += '.pdf'
+    # Sin caracteres problemáticos para el sistema de archivos ni espacios múltiples
+    nombre = _RE_CARACTERES_NO_VALIDOS.sub('_', nombre)
+    return _RE_ESPACIOS.sub(' ', nombre)
+
+def iterar_facturas(filtros=None, orden='procesamiento', descendente=False, ids=None):
+    """Recorre todas las facturas que cumplen los filtros, o las de la lista ids en ese orden.
+
+    Se leen por páginas, así que una exportación no carga todas las filas a la vez.
+    """
+    if ids:
+        for inicio in range(0, len(ids), FACTURAS_POR_PAGINA_MAX):
+            bloque = ids[inicio:inicio + FACTURAS_POR_PAGINA_MAX]
+            filas = {fila.id: fila for fila in Factura.query.filter(Factura.id.in_(bloque))}
+            yield from (filas[i] for i in bloque if i in filas)
+        return
+    cursor = None
+    while True:
+        filas, cursor = consultar_facturas(filtros, orden, descendente, cursor, FACTURAS_POR_PAGINA_MAX)
+        yield from filas
+        if cursor is None:
+            return
+
 # ========================================
 # RUTAS PRINCIPALES
 # ========================================
@@ -796,14 +1807,58 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    """Dashboard principal con las facturas"""
-    return render_template('dashboard.html', facturas=FACTURAS_DATA)
+    """Dashboard principal con la primera página de facturas; el resto se carga bajo demanda"""
+    try:
+        parametros = parametros_consulta_facturas(request.args, ORDEN_DASHBOARD)
+    except ValueError as e:
+        print(f"⚠️ Parámetros de dashboard no válidos, usando los de por defecto: {e}")
+        parametros = parametros_consulta_facturas(ImmutableMultiDict(), ORDEN_DASHBOARD)
+    filas, siguiente = consultar_facturas(**parametros)
+    return render_template('dashboard.html', facturas=[f.to_dict() for f in filas], siguiente_cursor=siguiente)
+
+@app.route('/dashboard/filas')
+@login_required
+def dashboard_filas():
+    """Siguiente página de filas del dashboard en HTML (cursor en la cabecera X-Siguiente-Cursor)"""
+    try:
+        parametros = parametros_consulta_facturas(request.args, ORDEN_DASHBOARD)
+        filas, siguiente = consultar_facturas(**parametros)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    respuesta = make_response(render_template('_filas_facturas.html', facturas=[f.to_dict() for f in filas]))
+    if siguiente:
+        respuesta.headers['X-Siguiente-Cursor'] = siguiente
+    return respuesta
 
 @app.route('/api/facturas')
 @login_required
 def api_facturas():
-    """API para obtener las facturas en formato JSON"""
-    return jsonify(FACTURAS_DATA)
+    """API de facturas en JSON, paginada por cursor.
+
+    Parámetros: tipo, comunidad, cuenta, estado (repetibles), procesado, fecha_desde,
+    fecha_hasta, orden ('-' delante para descendente), cursor, limite y campos
+    (lista separada por comas de los campos a devolver).
+    """
+    try:
+        parametros = parametros_consulta_facturas(request.args)
+        campos = [c for c in request.args.get('campos', '').split(',') if c] or list(CAMPOS_FACTURA)
+        desconocidos = [c for c in campos if c not in CAMPOS_FACTURA]
+        if desconocidos:
+            raise ValueError(f"Campos no válidos: {', '.join(desconocidos)}")
+        filas, siguiente = consultar_facturas(**parametros)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    facturas = []
+    for fila in filas:
+        datos = fila.to_dict()
+        facturas.append({c: datos[c] for c in campos})
+    return jsonify({
+        "success": True,
+        "facturas": facturas,
+        "siguiente_cursor": siguiente,
+        "limite": parametros['limite']
+    })
 
 @app.route('/api/cuentas')
 @login_required
@@ -811,22 +1866,1471 @@ def api_cuentas():
     """API para obtener las cuentas contables en formato JSON"""
     return jsonify(CUENTAS_CONTABLES)
 
+@app.route('/api/mapeo')
+@login_required
+def api_mapeo():
+    """Versión, huella, número de entradas, último error y última reasignación del mapeo de este worker"""
+    return jsonify({"success": True, **SERVICIO_MAPEO.estado, "reasignacion": resumen_reasignacion()})
+
+@app.route('/api/mapeo/recargar', methods=['POST'])
+@login_required
+def api_mapeo_recargar():
+    """Vuelve a leer el archivo de mapeo ahora en todos los workers, sin esperar a la vigilancia"""
+    estado = SERVICIO_MAPEO.avisar_recarga()
+    if estado['error']:
+        return jsonify({"success": False, **estado}), 500
+    return jsonify({"success": True, **estado})
+
+@app.route('/api/mapeo/reasignar', methods=['POST'])
+@login_required
+def api_mapeo_reasignar():
+    """Reasigna todas las facturas guardadas con el mapeo actual (sin volver a leer los PDFs)"""
+    resumen = programar_reasignacion().result()
+    if resumen.get('error'):
+        return jsonify({"success": False, **resumen}), 500
+    return jsonify({"success": True, **resumen})
+
 @app.route('/clear_memory', methods=['POST'])
 @login_required
 def clear_memory():
     """Limpiar la memoria de facturas procesadas"""
-    global FACTURAS_DATA
-    FACTURAS_DATA = []
+    Factura.query.delete()
+    db.session.commit()
     return jsonify({'success': True, 'message': 'Memoria limpiada correctamente'})
 
+# ========================================
+# CACHÉ DE EXTRACCIÓN POR CONTENIDO
+# ========================================
+
+# Versión de los extractores: incrementarla al cambiar cualquier detectar_* o la
+# extracción de texto invalida las entradas guardadas con la versión anterior.
+EXTRACTOR_VERSION = 1
+# Tamaño máximo de la caché (texto + campos); 0 la desactiva
+CACHE_EXTRACCION_MAX_BYTES = int(os.environ.get('CACHE_EXTRACCION_MAX_BYTES', 64 * 1024 * 1024))
+
+class CacheExtraccion:
+    """Caché persistente en SQLite del texto extraído y los campos detectados de cada PDF.
+
+    La clave es el SHA-256 del contenido del archivo, así que volver a subir la misma
+    factura (aunque tenga otro nombre) no vuelve a parsear el PDF. Cada entrada guarda
+    la versión de extractores/mapeo con la que se generó; las de otra versión cuentan
+    como fallo. Cuando el total supera max_bytes se eliminan las menos usadas (LRU).
+    """
+
+    def __init__(self, ruta, max_bytes):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.aciertos = 0
+        self.fallos = 0
+        with self._conexion() as con:
+            con.execute("""CREATE TABLE IF NOT EXISTS extraccion (
+                sha256 TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                texto TEXT NOT NULL,
+                campos TEXT NOT NULL,
+                tamano INTEGER NOT NULL,
+                ultimo_acceso REAL NOT NULL)""")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_extraccion_acceso ON extraccion (ultimo_acceso)")
+
+    def _conexion(self):
+        # Una conexión por hilo: sqlite3 no permite compartirlas entre hilos
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def obtener(self, sha256, version):
+        """Devuelve {'texto', 'campos'} si hay una entrada válida para la versión, o None"""
+        con = self._conexion()
+        fila = con.execute("SELECT version, texto, campos FROM extraccion WHERE sha256 = ?", (sha256,)).fetchone()
+        if not fila or fila[0] != version:
+            self.fallos += 1
+            return None
+        with con:
+            con.execute("UPDATE extraccion SET ultimo_acceso = ? WHERE sha256 = ?", (time.time(), sha256))
+        self.aciertos += 1
+        return {'texto': fila[1], 'campos': json.loads(fila[2])}
+
+    def guardar(self, sha256, version, texto, campos):
+        """Guarda (o reemplaza) la entrada de un archivo y aplica el límite de tamaño"""
+        campos_json = json.dumps(campos, ensure_ascii=False)
+        tamano = len(texto.encode('utf-8')) + len(campos_json.encode('utf-8'))
+        if tamano > self.max_bytes:
+            return
+        con = self._conexion()
+        with con:
+            con.execute("INSERT OR REPLACE INTO extraccion VALUES (?, ?, ?, ?, ?, ?)",
+                        (sha256, version, texto, campos_json, tamano, time.time()))
+            self._evictar(con)
+
+    def _evictar(self, con):
+        total = con.execute("SELECT COALESCE(SUM(tamano), 0) FROM extraccion").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        exceso = total - self.max_bytes
+        borrar = []
+        for sha256, tamano in con.execute("SELECT sha256, tamano FROM extraccion ORDER BY ultimo_acceso"):
+            borrar.append((sha256,))
+            exceso -= tamano
+            if exceso <= 0:
+                break
+        con.executemany("DELETE FROM extraccion WHERE sha256 = ?", borrar)
+
+    def estadisticas(self):
+        entradas, total = self._conexion().execute(
+            "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM extraccion").fetchone()
+        return {'entradas': entradas, 'bytes': total, 'max_bytes': self.max_bytes,
+                'aciertos': self.aciertos, 'fallos': self.fallos}
+
+_CACHE_EXTRACCION = None
+_CACHE_EXTRACCION_LOCK = threading.Lock()
+
+def obtener_cache_extraccion():
+    """Caché de extracción del proceso (None si está desactivada), en la carpeta instance"""
+    global _CACHE_EXTRACCION
+    if CACHE_EXTRACCION_MAX_BYTES <= 0:
+        return None
+    with _CACHE_EXTRACCION_LOCK:
+        if _CACHE_EXTRACCION is None:
+            os.makedirs(app.instance_path, exist_ok=True)
+            _CACHE_EXTRACCION = CacheExtraccion(
+                os.path.join(app.instance_path, 'cache_extraccion.db'), CACHE_EXTRACCION_MAX_BYTES)
+    return _CACHE_EXTRACCION
+
+def version_extraccion():
+    """Versión con la que se guardan las entradas: extractores, backend de texto, páginas y mapeo"""
+    return f"{EXTRACTOR_VERSION}:{backend_texto_pdf().nombre}:{PAGINAS_EXTRACCION}:{HUELLA_MAPEO}"
+
+def hash_archivo(filepath):
+    """SHA-256 del contenido de un archivo"""
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+# Entradas que recuerda cada memo por archivo (hashes, número de páginas)
+MEMO_ARCHIVOS_MAX = int(os.environ.get('MEMO_ARCHIVOS_MAX', 4096))
+
+class MemoLRU:
+    """Diccionario acotado para los memos por archivo: al superar 'maximo' entradas
+    descarta las usadas hace más tiempo, así no crece con cada archivo visto por el worker"""
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            valor = self._datos.get(clave)
+            if valor is not None:
+                self._datos.move_to_end(clave)
+            return valor
+
+    def __setitem__(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def __len__(self):
+        return len(self._datos)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+_HASHES_ARCHIVOS = MemoLRU(MEMO_ARCHIVOS_MAX)
+
+def _clave_hash_archivo(filepath):
+    info = os.stat(filepath)
+    return (filepath, info.st_size, info.st_mtime_ns)
+
+def hash_archivo_memo(filepath):
+    """hash_archivo recordado por (ruta, tamaño, fecha de modificación)"""
+    clave = _clave_hash_archivo(filepath)
+    sha256 = _HASHES_ARCHIVOS.get(clave)
+    if sha256 is None:
+        sha256 = hash_archivo(filepath)
+        _HASHES_ARCHIVOS[clave] = sha256
+    return sha256
+
+def recordar_hash_archivo(filepath, sha256):
+    """Anota el hash de un archivo ya calculado (al recibirlo) para no volver a leerlo"""
+    _HASHES_ARCHIVOS[_clave_hash_archivo(filepath)] = sha256
+
+# ========================================
+# BACKENDS DE EXTRACCIÓN DE TEXTO
+# ========================================
+
+class BackendTextoPDF:
+    """Interfaz de los extractores de texto de PDF.
+
+    paginas() genera el texto de cada página de forma perezosa, para que quien lo
+    consume pueda dejar de leer en cuanto tenga lo que necesita.
+    """
+    nombre = None
+
+    def disponible(self):
+        return True
+
+    def paginas(self, filepath, max_paginas=None, info=None):
+        """Genera el texto de las páginas 1..max_paginas (None = todas).
+
+        Si se pasa el diccionario info, se anota en info['num_paginas'] el total de
+        páginas del documento en cuanto se conoce.
+        """
+        raise NotImplementedError
+
+    def texto_pagina(self, filepath, pagina):
+        """Texto de una sola página (numeradas desde 1); cadena vacía si no existe"""
+        for numero, texto in enumerate(self.paginas(filepath, pagina), start=1):
+            if numero == pagina:
+                return texto
+        return ""
+
+class BackendPyPDF2(BackendTextoPDF):
+    """PyPDF2 (Python puro). Es el backend por defecto"""
+    nombre = 'pypdf2'
+
+    def disponible(self):
+        return dependencia_opcional('pypdf2') is not None
+
+    def paginas(self, filepath, max_paginas=None, info=None):
+        # PyPDF2 solo analiza una página cuando se accede a ella
+        with open(filepath, 'rb') as pdf_file:
+            pdf_reader = dependencia_opcional('pypdf2').PdfReader(pdf_file)
+            total = len(pdf_reader.pages)
+            if info is not None:
+                info['num_paginas'] = total
+            for page_num in range(total if max_paginas is None else min(max_paginas, total)):
+                yield pdf_reader.pages[page_num].extract_text() or ""
+
+    def texto_pagina(self, filepath, pagina):
+        with open(filepath, 'rb') as pdf_file:
+            pdf_reader = dependencia_opcional('pypdf2').PdfReader(pdf_file)
+            if pagina > len(pdf_reader.pages):
+                return ""
+            return pdf_reader.pages[pagina - 1].extract_text() or ""
+
+class BackendPdftotext(BackendTextoPDF):
+    """pdftotext de poppler (el paquete que ya se instala para las vistas previas).
+
+    Las páginas se piden en bloques crecientes (1, 2, 3-4, 5-8...) para no lanzar un
+    proceso por página y poder dejar de leer igual que con PyPDF2.
+    """
+    nombre = 'pdftotext'
+
+    def disponible(self):
+        return bool(capacidades()['poppler'].get('pdftotext'))
+
+    def _extraer(self, filepath, primera, ultima):
+        resultado = subprocess.run(
+            [capacidades()['poppler']['pdftotext'], '-enc', 'UTF-8', '-f', str(primera), '-l', str(ultima), filepath, '-'],
+            capture_output=True, timeout=60)
+        if resultado.returncode != 0:
+            # Entre otros casos, cuando la primera página pedida no existe
+            return []
+        # pdftotext termina cada página con un salto de página
+        return resultado.stdout.decode('utf-8', errors='replace').split('\f')[:-1]
+
+    def paginas(self, filepath, max_paginas=None, info=None):
+        primera = 1
+        while max_paginas is None or primera <= max_paginas:
+            ultima = primera + max(primera - 1, 1) - 1
+            if max_paginas is not None:
+                ultima = min(ultima, max_paginas)
+            textos = self._extraer(filepath, primera, ultima)
+            if len(textos) < ultima - primera + 1:
+                # El documento se ha acabado antes del bloque pedido
+                if info is not None:
+                    info['num_paginas'] = primera - 1 + len(textos)
+                yield from textos
+                return
+            yield from textos
+            primera = ultima + 1
+
+    def texto_pagina(self, filepath, pagina):
+        textos = self._extraer(filepath, pagina, pagina)
+        return textos[0] if textos else ""
+
+BACKENDS_TEXTO_PDF = {backend.nombre: backend for backend in (BackendPyPDF2(), BackendPdftotext())}
+# Backend de extracción de texto: pypdf2 (por defecto) o pdftotext
+PDF_TEXTO_BACKEND = os.environ.get('PDF_TEXTO_BACKEND', 'pypdf2')
+
+def backend_texto_pdf():
+    """Backend configurado en PDF_TEXTO_BACKEND, o PyPDF2 si no existe o no está disponible"""
+    backend = BACKENDS_TEXTO_PDF.get(PDF_TEXTO_BACKEND)
+    if backend is None or not backend.disponible():
+        return BACKENDS_TEXTO_PDF['pypdf2']
+    return backend
+
+# ========================================
+# PIPELINE DE PROCESAMIENTO DE FACTURAS
+# ========================================
+
+# Número de procesos del pool (por defecto, uno por núcleo disponible)
+PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', os.cpu_count() or 1))
+# A partir de cuántos archivos merece la pena repartir el trabajo entre procesos
+PIPELINE_MIN_ARCHIVOS = int(os.environ.get('PIPELINE_MIN_ARCHIVOS', 4))
+# Máximo de páginas que se leen de cada PDF para detectar los campos; la lectura se
+# detiene antes si los campos críticos ya están resueltos
+PAGINAS_EXTRACCION = int(os.environ.get('PAGINAS_EXTRACCION', 2))
+
+_PROCESS_POOL = None
+# Huella del mapeo con el que se crearon los procesos del pool
+_HUELLA_POOL = None
+# Varios trabajos de carga comparten el pool: crearlo o sustituirlo va con este lock
+_LOCK_POOL = threading.Lock()
+# Los procesos del pool no se crean con fork: el worker de gunicorn tiene hilos (gthread,
+# trabajos, vigilancia) y un hijo copiado a mitad de un lock se quedaría bloqueado.
+# Con forkserver (o spawn donde no existe) arrancan de un proceso limpio que importa app.
+METODO_INICIO_POOL = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+def _iniciar_proceso_pool(config):
+    """Inicializador de los procesos del pool: instala el mapeo del proceso que los crea"""
+    establecer_mapeo(config)
+
+def _contexto_pool():
+    """Contexto de multiprocessing con el que se crean los procesos del pool"""
+    contexto = multiprocessing.get_context(METODO_INICIO_POOL)
+    if METODO_INICIO_POOL == 'forkserver' and __name__ != '__main__':
+        # El servidor importa app una vez y cada proceso del pool parte de esa copia
+        contexto.set_forkserver_preload([__name__])
+    return contexto
+
+def _obtener_pool():
+    """Devuelve el pool de procesos del pipeline, creándolo la primera vez.
+
+    Los procesos reciben el mapeo que había al crearlos: si desde entonces se ha
+    recargado, el pool se sustituye por uno nuevo (los lotes en curso terminan en el
+    anterior).
+    """
+    global _PROCESS_POOL, _HUELLA_POOL
+    with _LOCK_POOL:
+        if _PROCESS_POOL is not None and _HUELLA_POOL != MAPEO_ACTUAL['HUELLA_MAPEO']:
+            print("🔄 Mapeo recargado: se renuevan los procesos del pool")
+            _PROCESS_POOL.shutdown(wait=False)
+            _PROCESS_POOL = None
+        if _PROCESS_POOL is None:
+            config = MAPEO_ACTUAL
+            _PROCESS_POOL = ProcessPoolExecutor(max_workers=PIPELINE_WORKERS, mp_context=_contexto_pool(),
+                                                initializer=_iniciar_proceso_pool,
+                                                initargs=(dict(config),))
+            _HUELLA_POOL = config['HUELLA_MAPEO']
+            print(f"⚙️ Pool de procesamiento iniciado con {PIPELINE_WORKERS} procesos")
+        return _PROCESS_POOL
+
+def _reiniciar_pool(pool=None):
+    """Descarta el pool actual (por ejemplo si un proceso hijo ha muerto).
+
+    Con pool, solo si sigue siendo el actual: otro trabajo puede haberlo sustituido ya.
+    No cancela nada: los lotes de otros trabajos que aún usen el pool terminan en él.
+    """
+    global _PROCESS_POOL
+    with _LOCK_POOL:
+        if _PROCESS_POOL is not None and (pool is None or pool is _PROCESS_POOL):
+            _PROCESS_POOL.shutdown(wait=False)
+            _PROCESS_POOL = None
+
+def iterar_paginas_pdf(filepath, max_paginas=PAGINAS_EXTRACCION, info=None):
+    """Genera el texto de cada página del PDF a medida que se lee (None = todas).
+
+    Usa el backend de texto configurado; dejar de consumir el generador evita leer el
+    resto del documento. info recibe el número de páginas si el backend lo conoce.
+    """
+    backend = backend_texto_pdf()
+    if not backend.disponible():
+        return
+    try:
+        yield from backend.paginas(filepath, max_paginas, info)
+    except Exception as e:
+        print(f"Error al extraer texto del PDF ({backend.nombre}): {str(e)}")
+
+def extraer_texto_pdf(filepath, max_paginas=PAGINAS_EXTRACCION):
+    """Extrae el texto de las primeras páginas de un PDF (cadena vacía si no es posible)"""
+    return "".join(iterar_paginas_pdf(filepath, max_paginas))
+
+def detectar_campos_factura(pdf_text, filename, mapeo=None):
+    """Motor de extracción: normaliza el texto una vez y ejecuta todos los extractores.
+
+    Devuelve un dict con todos los campos detectados; los resultados son idénticos a los
+    de los extractores anteriores (ver benchmarks/bench_extraccion.py).
+    """
+    mapeo = mapeo or MAPEO_ACTUAL
+    texto = TextoFactura.de(pdf_text)
+    tipo = detectar_tipo_gasto(texto, filename)
+    cod_abast, poliza = detectar_poliza_y_cod_abast(texto)
+    return {
+        'tipo': tipo,
+        'cups': detectar_cups_o_contador(texto, mapeo),
+        'direccion': detectar_direccion(texto, mapeo),
+        'importe': detectar_importe_total(texto),
+        'periodo': detectar_periodo_facturacion(texto),
+        'fecha_factura': detectar_fecha_factura(texto),
+        'cod_abast': cod_abast,
+        'poliza': poliza,
+        'contador': detectar_contador(texto),
+        'comunidad_especifica': detectar_comunidad_factura(texto, tipo),
+    }
+
+def resolver_poliza_cod_abast(poliza, cod_abast, mapeo=None):
+    """Busca en el mapeo la entrada que contiene la póliza o el Cód. Abast. detectados.
+
+    Usa el índice inverso de valores (coincidencia exacta de token). Si varias entradas
+    contienen alguno de los dos valores, gana la que aparece antes en el mapeo, igual
+    que en el recorrido secuencial; si además apuntan a comunidades o cuentas distintas
+    se registra un aviso con las candidatas.
+    Devuelve (clave, entrada, claves_candidatas) o (None, None, []).
+    """
+    mapeo = mapeo or MAPEO_ACTUAL
+    indice = mapeo['INDICES_MAPEO']['valores']
+    encontrados = []
+    if poliza:
+        encontrados += indice.get(poliza.upper(), [])
+    if cod_abast:
+        encontrados += indice.get(str(cod_abast).upper(), [])
+    if not encontrados:
+        return None, None, []
+
+    encontrados = sorted(set(encontrados))
+    candidatos = [clave for _, clave in encontrados]
+    clave = candidatos[0]
+    entradas = mapeo['MAPEO_CUENTAS_CONTABLES']
+    info = entradas.get(clave) or {}
+    destinos = {((entradas.get(c) or {}).get('comunidad'),
+                 (entradas.get(c) or {}).get('cuenta')) for c in candidatos}
+    if len(destinos) > 1:
+        print(f"⚠️ Póliza {poliza} / Cód.Abast. {cod_abast} coincide con {len(candidatos)} entradas "
+              f"({', '.join(candidatos)}); se usa la primera del mapeo: {clave}")
+    return clave, info, candidatos
+
+def asignar_comunidad_cuenta(campos, mapeo=None):
+    """Aplica la cadena de prioridad de asignación sobre los campos detectados.
+
+    Prioridad: 1 Comunidad específica, 2 Dirección, 3 Póliza/Cód Abast., 4 Contador,
+    5 Asignación por tipo. Devuelve dict con comunidad, cuenta y origen de la asignación.
+    Toda la cadena usa la misma configuración de mapeo (por defecto MAPEO_ACTUAL).
+    """
+    mapeo = mapeo or MAPEO_ACTUAL
+    tipo = campos.get('tipo')
+    direccion = campos.get('direccion')
+    poliza = campos.get('poliza')
+    cod_abast = campos.get('cod_abast')
+    contador = campos.get('contador')
+
+    # 1) Comunidad específica según tipo de factura
+    if campos.get('comunidad_especifica'):
+        return {'comunidad': campos['comunidad_especifica'], 'cuenta': None, 'origen': 'comunidad'}
+
+    # 2) Intentar por dirección (normalizando, con el índice por tipo)
+    if direccion:
+        datos = mapeo['INDICES_MAPEO']['direcciones_normalizadas'].get(tipo, {}).get(_normalize_dir_key(direccion))
+        if datos and datos.get('comunidad'):
+            return {'comunidad': datos.get('comunidad'), 'cuenta': datos.get('cuenta'), 'origen': 'direccion'}
+
+    # 3) Intentar por póliza o código de abastecimiento en mappings secretos
+    if poliza or cod_abast:
+        clave, info, candidatos = resolver_poliza_cod_abast(poliza, cod_abast, mapeo)
+        if info and info.get('comunidad'):
+            return {'comunidad': info.get('comunidad'), 'cuenta': info.get('cuenta'), 'origen': 'poliza',
+                    'candidatos': candidatos}
+
+    # 4) Intentar por contador
+    if contador and contador in mapeo['MAPEO_CUENTAS_CONTABLES']:
+        info = mapeo['MAPEO_CUENTAS_CONTABLES'][contador]
+        if info.get('comunidad'):
+            return {'comunidad': info.get('comunidad'), 'cuenta': info.get('cuenta'), 'origen': 'contador'}
+
+    # 5) Fallback a asignaciones por tipo si aún no asignado
+    comunidad, cuenta = asignar_cuenta_contable_con_tipos(campos.get('cups'), direccion, tipo, mapeo)
+    return {'comunidad': comunidad, 'cuenta': cuenta, 'origen': 'tipo'}
+
+def construir_factura(filename, campos, asignacion, fecha_defecto=None):
+    """Construye el registro de factura que se muestra en el dashboard.
+
+    fecha_defecto (dd/mm/aaaa) se usa si la factura no trae fecha; por defecto, hoy.
+    """
+    tipo = campos.get('tipo')
+    cups = campos.get('cups')
+    direccion = campos.get('direccion')
+    importe_val = campos.get('importe')
+    periodo = campos.get('periodo')
+    fecha_factura = campos.get('fecha_factura')
+    cod_abast = campos.get('cod_abast')
+    poliza = campos.get('poliza')
+    contador = campos.get('contador')
+    comunidad_asig = asignacion.get('comunidad')
+
+    # Normalizar valores para guardar
+    comunidad = comunidad_asig or 'COMUNIDAD GENERAL'
+    numero = asignacion.get('cuenta') or '62900000'
+    # Estado/importe: si detectamos importe, formatearlo (usar coma decimal)
+    if importe_val is not None:
+        # forzar dos decimales y usar coma
+        estado_val = f"{importe_val:.2f}"
+        estado = f"{estado_val.replace('.', ',')}"
+        importe_formateado = f"{estado_val.replace('.', ',')} EUR"
+    else:
+        estado_val = None
+        estado = "N/A"
+        importe_formateado = "N/A"
+
+    # Construir chosen_location para el nombre renombrado
+    chosen_location = None
+    if direccion:
+        chosen_location = direccion
+    elif poliza or cod_abast:
+        chosen_location = f"Póliza {poliza}" if poliza else f"Cód.Abast. {cod_abast}"
+    elif contador:
+        chosen_location = f"Contador {contador}"
+
+    # Generar nombre renombrado con formato: Agua Direccion XX 08-04-2024 11,10EUR
+    fecha_defecto = fecha_defecto or datetime.now().strftime("%d/%m/%Y")
+    fecha_para_nombre = fecha_factura or fecha_defecto
+    # Reemplazar barras por guiones para compatibilidad con sistemas de archivos
+    fecha_para_nombre = fecha_para_nombre.replace("/", "-")
+
+    direccion_para_nombre = chosen_location or comunidad or "Sin Direccion"
+    importe_para_nombre = f"{estado_val.replace('.', ',')}EUR" if estado_val else "0EUR"
+
+    nombre_renombrado = f"{tipo} {direccion_para_nombre} {fecha_para_nombre} {importe_para_nombre}"
+
+    # Determinar estado de validación
+    datos_criticos = [tipo, importe_val, comunidad_asig]
+    datos_opcionales = [direccion, fecha_factura, periodo]
+
+    criticos_completos = sum(1 for d in datos_criticos if d)
+    opcionales_completos = sum(1 for d in datos_opcionales if d)
+
+    if criticos_completos == len(datos_criticos) and opcionales_completos >= 2:
+        estado_validacion = "success"  # Verde
+    elif criticos_completos == len(datos_criticos):
+        estado_validacion = "warning"  # Amarillo
+    else:
+        estado_validacion = "danger"   # Rojo
+
+    # Construir texto simple para copia al portapapeles: "Agua DIRECCION XX Periodo Facturacion de ABR-MAY 2024 13,57€"
+    texto_copia = []
+    if tipo:
+        texto_copia.append(tipo)
+    if chosen_location:
+        texto_copia.append(chosen_location.upper())
+    if periodo:
+        texto_copia.append(f"Periodo Facturacion de {periodo}")
+    if estado_val:
+        texto_copia.append(f"{estado_val.replace('.', ',')}EUR")
+
+    titulo_final = ' '.join([p for p in texto_copia if p])
+
+    return {
+        "id": filename,
+        "nombre": filename,
+        "archivo_procesado": nombre_renombrado,
+        "cups": contador or cups or 'No detectado',  # Priorizar contador sobre CUPS
+        "direccion": direccion,
+        "fecha": fecha_factura or fecha_defecto,
+        "tipo": tipo,
+        "importe": importe_formateado,
+        "estado": estado_validacion,
+        "comunidad": comunidad,
+        "cuenta": numero,
+        "cuenta_contable": numero,
+        "procesado": False,  # Campo para controlar si está procesado
+        "movimiento_contable": titulo_final or f"Gasto {tipo} - {comunidad} - Importe: {estado} - Periodo: {periodo or 'N/D'}",
+        "aprobacion": "Águila Avilés, Reconocimiento (15 días) - Fecha límite: hoy",
+        "periodo": periodo,
+        "acciones": "ver"
+    }
+
+def campos_criticos_resueltos(campos, texto, mapeo=None):
+    """True si ya hay tipo, importe y una comunidad asignada por algo más que el tipo.
+
+    El importe solo cuenta como resuelto si sale de una línea TOTAL: las alternativas
+    (el mayor importe en euros, el primer número con decimales) pueden cambiar al
+    leer más páginas.
+    """
+    return bool(campos.get('tipo') and importe_total_explicito(texto) is not None
+                and asignar_comunidad_cuenta(campos, mapeo)['origen'] != 'tipo')
+
+def analizar_factura(filepath, filename):
+    """Extrae el texto y detecta los campos de un PDF ya guardado.
+
+    Las páginas se leen una a una y, tras las páginas 1, 2, 4, 8..., se detectan los
+    campos sobre el texto acumulado; en cuanto los campos críticos están resueltos se
+    deja de leer (como máximo PAGINAS_EXTRACCION páginas). Comprobar solo en potencias
+    de dos mantiene lineal el coste de detección aunque haya que leer todo el límite.
+    Se ejecuta tanto en el proceso web como en los procesos del pool, por lo que debe
+    ser una función de módulo y devolver solo datos serializables.
+    """
+    inicio = time.perf_counter()
+    # Una sola configuración de mapeo para todas las detecciones de esta factura
+    mapeo = MAPEO_ACTUAL
+    deteccion = 0.0
+    partes = []
+    campos = None
+    info = {}
+    paginas = iterar_paginas_pdf(filepath, info=info)
+    for pagina in paginas:
+        partes.append(pagina)
+        if len(partes) & (len(partes) - 1):
+            continue
+        t0 = time.perf_counter()
+        texto = TextoFactura("".join(partes))
+        campos = detectar_campos_factura(texto, filename, mapeo)
+        resueltos = campos_criticos_resueltos(campos, texto, mapeo)
+        deteccion += time.perf_counter() - t0
+        if resueltos:
+            paginas.close()
+            break
+    else:
+        # Sin resolver: detectar sobre todo lo leído si la última comprobación no lo incluía
+        if campos is None or len(partes) & (len(partes) - 1):
+            t0 = time.perf_counter()
+            campos = detectar_campos_factura("".join(partes), filename, mapeo)
+            deteccion += time.perf_counter() - t0
+    extraccion = time.perf_counter() - inicio - deteccion
+
+    pdf_text = "".join(partes)
+    return {
+        'texto': pdf_text,
+        'campos': campos,
+        'paginas': partes,
+        'num_paginas': info.get('num_paginas'),
+        'tiempos': {
+            'extraccion_ms': round(extraccion * 1000, 2),
+            'deteccion_ms': round(deteccion * 1000, 2),
+            'paginas_leidas': len(partes),
+        }
+    }
+
+def _resultado_desde_cache(entrada, filename):
+    """Reconstruye el resultado de analizar_factura a partir de una entrada de la caché"""
+    inicio = time.perf_counter()
+    campos = entrada['campos']
+    # El tipo de gasto también mira el nombre del archivo, que puede ser otro
+    if detectar_tipo_gasto(entrada['texto'], filename) != campos.get('tipo'):
+        campos = detectar_campos_factura(entrada['texto'], filename)
+    return {
+        'texto': entrada['texto'],
+        'campos': campos,
+        'cache': True,
+        'tiempos': {
+            'extraccion_ms': 0.0,
+            'deteccion_ms': round((time.perf_counter() - inicio) * 1000, 2),
+        }
+    }
+
+def _analizar_factura_en_pool(args):
+    """Adaptador para ProcessPoolExecutor.map (recibe una tupla filepath, filename)"""
+    return analizar_factura(*args)
+
+def _usar_pool(num_archivos, modo):
+    """Decide si un lote se procesa con el pool de procesos"""
+    if modo == 'auto':
+        return PIPELINE_WORKERS > 1 and num_archivos >= PIPELINE_MIN_ARCHIVOS
+    return modo == 'pipeline'
+
+def _completar_factura(filename, resultado):
+    """Asigna comunidad/cuenta a un resultado de análisis y devuelve (factura, tiempos)"""
+    inicio = time.perf_counter()
+    asignacion = asignar_comunidad_cuenta(resultado['campos'])
+    factura = construir_factura(filename, resultado['campos'], asignacion)
+    t = dict(resultado['tiempos'])
+    t['asignacion_ms'] = round((time.perf_counter() - inicio) * 1000, 2)
+    t['total_ms'] = round(t['extraccion_ms'] + t['deteccion_ms'] + t['asignacion_ms'], 2)
+    t['cache'] = resultado.get('cache', False)
+    return factura, {'archivo': filename, **t}
+
+def _analizar_lote(archivos, usar_pool):
+    """Genera el resultado de analizar_factura para cada archivo, en orden.
+
+    Si el pool de procesos se cae a mitad de lote, el resto se procesa en secuencia.
+    """
+    siguiente = 0
+    if usar_pool and archivos:
+        pool = _obtener_pool()
+        try:
+            for resultado in pool.map(_analizar_factura_en_pool, archivos):
+                yield resultado
+                siguiente += 1
+        except BrokenProcessPool as e:
+            print(f"❌ Pool de procesamiento caído, procesando en secuencia: {e}")
+            _reiniciar_pool(pool)
+    for filepath, filename in archivos[siguiente:]:
+        yield analizar_factura(filepath, filename)
+
+def iterar_procesamiento(archivos, usar_pool):
+    """Generador que produce (factura, tiempos, documento) por archivo, en el orden de entrada.
+
+    Los archivos cuyo contenido ya está en la caché de extracción no se vuelven a
+    parsear. El resto se analiza en secuencia o, en modo pipeline, repartido entre un
+    pool de procesos; cada resultado se entrega en cuanto están listos él y todos los
+    anteriores. documento son los metadatos del PDF obtenidos en esa misma lectura
+    (ver registrar_documento_pdf) y los campos detectados; en los aciertos de caché
+    no lleva las páginas ni su número.
+    """
+    cache = obtener_cache_extraccion()
+    version = version_extraccion()
+    hashes = [hash_archivo_memo(filepath) for filepath, _ in archivos]
+    en_cache = [cache.obtener(h, version) if cache else None for h in hashes]
+    pendientes = [archivo for archivo, entrada in zip(archivos, en_cache) if entrada is None]
+    analizados = _analizar_lote(pendientes, usar_pool)
+
+    for (filepath, filename), sha256, entrada in zip(archivos, hashes, en_cache):
+        if entrada is not None:
+            resultado = _resultado_desde_cache(entrada, filename)
+        else:
+            resultado = next(analizados)
+            if cache:
+                cache.guardar(sha256, version, resultado['texto'], resultado['campos'])
+        documento = {
+            'sha256': sha256,
+            'tamano': os.path.getsize(filepath),
+            'num_paginas': resultado.get('num_paginas'),
+            'paginas': resultado.get('paginas'),
+            'campos': resultado['campos'],
+        }
+        yield (*_completar_factura(filename, resultado), documento)
+
+def procesar_archivos(archivos, modo='auto'):
+    """Procesa una lista de (filepath, filename) y devuelve (facturas, tiempos, modo_usado)"""
+    usar_pool = _usar_pool(len(archivos), modo)
+    facturas = []
+    tiempos = []
+    for factura, t, _ in iterar_procesamiento(archivos, usar_pool):
+        facturas.append(factura)
+        tiempos.append(t)
+    return facturas, tiempos, 'pipeline' if usar_pool else 'secuencial'
+
+# ========================================
+# VISTAS PREVIAS DE PDF
+# ========================================
+
+# Resolución y calidad JPEG de las vistas previas
+PREVIEW_DPI = 150
+PREVIEW_CALIDAD = 85
+# Espacio máximo en disco de las páginas renderizadas; 0 desactiva la caché
+CACHE_PREVIEWS_MAX_BYTES = int(os.environ.get('CACHE_PREVIEWS_MAX_BYTES', 256 * 1024 * 1024))
+# Páginas que se renderizan juntas cuando se pide una que no está en caché
+PREVIEW_PAGINAS_LOTE = int(os.environ.get('PREVIEW_PAGINAS_LOTE', 4))
+# Procesos pdftoppm en paralelo al renderizar un rango de páginas
+PREVIEW_HILOS = int(os.environ.get('PREVIEW_HILOS', min(4, os.cpu_count() or 1)))
+# Segundos que el navegador puede reutilizar una página renderizada sin revalidarla
+PREVIEW_MAX_AGE = int(os.environ.get('PREVIEW_MAX_AGE', 24 * 3600))
+# Renderizar la página 1 de cada factura al subirla, para que la primera vista previa sea inmediata
+PRERENDER_PREVIEWS = os.environ.get('PRERENDER_PREVIEWS', 'true').lower() == 'true'
+# Segundos máximos para renderizar una página (o esperar a que otra petición lo haga);
+# si se superan, la vista previa usa el texto extraído
+TIMEOUT_PREVIEW = int(os.environ.get('TIMEOUT_PREVIEW', 30))
+
+class CacheVistasPrevias:
+    """Caché en disco de páginas de PDF ya renderizadas (JPEG o WebP).
+
+    Cada página se guarda en un archivo cuyo nombre incluye el SHA-256 del PDF, la
+    página, los dpi, la calidad y el formato, así que la comparten todos los workers y un PDF
+    modificado nunca reutiliza imágenes antiguas. La fecha de modificación de cada
+    archivo hace de marca de último uso para descartar las menos usadas (LRU) cuando se
+    supera max_bytes.
+    """
+
+    def __init__(self, directorio, max_bytes):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+        self._total = sum(e.stat().st_size for e in os.scandir(directorio) if e.is_file())
+
+    def _ruta(self, sha256, pagina, dpi, calidad, formato):
+        return os.path.join(self.directorio, f"{sha256}_{pagina}_{dpi}_{calidad}.{formato}")
+
+    def obtener(self, sha256, pagina, dpi, calidad, formato='jpeg'):
+        """Bytes de la imagen de la página si está en caché, o None"""
+        ruta = self._ruta(sha256, pagina, dpi, calidad, formato)
+        try:
+            with open(ruta, 'rb') as f:
+                datos = f.read()
+            os.utime(ruta)
+            return datos
+        except FileNotFoundError:
+            return None
+
+    def guardar(self, sha256, pagina, dpi, calidad, datos, formato='jpeg'):
+        ruta = self._ruta(sha256, pagina, dpi, calidad, formato)
+        # Escribir en un temporal y renombrar: otro worker nunca ve una imagen a medias
+        temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+        with open(temporal, 'wb') as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+        with self._lock:
+            self._total += len(datos)
+            if self._total > self.max_bytes:
+                self._evictar()
+
+    def _evictar(self):
+        # Recalcular desde el disco: otros workers también escriben en el directorio
+        archivos = sorted((e.stat().st_mtime, e.stat().st_size, e.path)
+                          for e in os.scandir(self.directorio) if e.is_file() and not e.name.endswith('.tmp'))
+        self._total = sum(tamano for _, tamano, _ in archivos)
+        for _, tamano, ruta in archivos:
+            if self._total <= self.max_bytes:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            self._total -= tamano
+
+_CACHE_PREVIEWS = None
+_CACHE_PREVIEWS_LOCK = threading.Lock()
+_NUM_PAGINAS = MemoLRU(MEMO_ARCHIVOS_MAX)
+
+def obtener_cache_previews():
+    """Caché de vistas previas del proceso (None si está desactivada), en la carpeta instance"""
+    global _CACHE_PREVIEWS
+    if CACHE_PREVIEWS_MAX_BYTES <= 0:
+        return None
+    with _CACHE_PREVIEWS_LOCK:
+        if _CACHE_PREVIEWS is None:
+            _CACHE_PREVIEWS = CacheVistasPrevias(os.path.join(app.instance_path, 'previews'), CACHE_PREVIEWS_MAX_BYTES)
+    return _CACHE_PREVIEWS
+
+def _leer_num_paginas(filepath):
+    """Número de páginas del PDF según PyPDF2 (1 si no se puede leer)"""
+    PyPDF2 = dependencia_opcional('pypdf2')
+    if PyPDF2 is not None:
+        try:
+            with open(filepath, 'rb') as pdf_file:
+                return len(PyPDF2.PdfReader(pdf_file).pages)
+        except Exception as e:
+            print(f"Error al obtener páginas con PyPDF2: {e}")
+    return 1
+
+def registrar_documento_pdf(filepath, documento):
+    """Guarda los metadatos de un PDF (ver iterar_procesamiento) y devuelve la fila.
+
+    Un PDF nuevo se confirma al momento: si otro trabajo ha registrado el mismo PDF a la
+    vez, el IntegrityError solo deshace esta fila y se usa la suya. Si ya estaba
+    registrado solo se amplían (en la sesión) los textos guardados cuando esta lectura
+    ha llegado a más páginas. El número de páginas se lee del PDF únicamente si el
+    análisis no lo obtuvo (aciertos de caché o backends que no lo conocen).
+    """
+    textos = documento.get('paginas') or []
+    fila = db.session.get(DocumentoPDF, documento['sha256'])
+    if fila is None:
+        fila = DocumentoPDF(
+            sha256=documento['sha256'],
+            tamano=documento['tamano'],
+            num_paginas=documento.get('num_paginas') or _leer_num_paginas(filepath),
+            textos=json.dumps(textos),
+        )
+        db.session.add(fila)
+        try:
+            db.session.commit()
+            return fila
+        except IntegrityError:
+            db.session.rollback()
+            fila = db.session.get(DocumentoPDF, documento['sha256'])
+    if len(textos) > len(json.loads(fila.textos or '[]')):
+        fila.textos = json.dumps(textos)
+    return fila
+
+def documento_pdf(filepath):
+    """Metadatos guardados del PDF; se registran ahora si el archivo es anterior a ellos"""
+    sha256 = hash_archivo_memo(filepath)
+    fila = db.session.get(DocumentoPDF, sha256)
+    if fila is None:
+        fila = registrar_documento_pdf(filepath, {'sha256': sha256, 'tamano': os.path.getsize(filepath)})
+        db.session.commit()
+    return fila
+
+def contar_paginas_pdf(filepath):
+    """Número de páginas del PDF, de sus metadatos guardados y recordado en el proceso"""
+    sha256 = hash_archivo_memo(filepath)
+    num_paginas = _NUM_PAGINAS.get(sha256)
+    if num_paginas is None:
+        num_paginas = _NUM_PAGINAS[sha256] = documento_pdf(filepath).num_paginas
+    return num_paginas
+
+def ruta_poppler():
+    """Carpeta de poppler para pdf2image según el registro de capacidades (None si está en el PATH).
+
+    Lanza una excepción si poppler no está disponible.
+    """
+    poppler = capacidades()['poppler']
+    if not poppler['disponible']:
+        raise Exception("Poppler no está disponible en el sistema")
+    return poppler['ruta']
+
+# Formatos de imagen de las vistas previas: (formato de PIL, tipo MIME)
+FORMATOS_PREVIEW = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+def renderizar_paginas(filepath, primera, ultima, dpi=PREVIEW_DPI, calidad=PREVIEW_CALIDAD, formato='jpeg'):
+    """Renderiza las páginas primera..ultima del PDF y devuelve {página: bytes de la imagen}.
+
+    Todo el rango se rasteriza de una vez: pdf2image lo reparte entre PREVIEW_HILOS
+    llamadas a pdftoppm en paralelo, en lugar de lanzar una por página.
+    """
+    images = dependencia_opcional('pdf2image').convert_from_path(
+        filepath,
+        first_page=primera,
+        last_page=ultima,
+        dpi=dpi,
+        poppler_path=ruta_poppler(),
+        timeout=TIMEOUT_PREVIEW + 5 * (ultima - primera),
+        thread_count=min(PREVIEW_HILOS, ultima - primera + 1)
+    )
+
+    if not images:
+        raise Exception("No se pudo convertir la página del PDF")
+
+    paginas = {}
+    for numero, imagen in enumerate(images, start=primera):
+        img_io = BytesIO()
+        imagen.save(img_io, FORMATOS_PREVIEW[formato][0], quality=calidad)
+        paginas[numero] = img_io.getvalue()
+    return paginas
+
+# Locks repartidos por hash: un número fijo, en lugar de uno por PDF que nunca se libera.
+# Dos PDFs distintos que caen en el mismo solo se renderizan uno detrás de otro
+_LOCKS_RENDER = [threading.Lock() for _ in range(64)]
+
+def _lock_render(sha256, formato):
+    # Evita que dos peticiones (p. ej. dos precargas) rendericen a la vez el mismo PDF
+    return _LOCKS_RENDER[hash((sha256, formato)) % len(_LOCKS_RENDER)]
+
+def rellenar_cache_previews(filepath, primera, ultima, dpi=PREVIEW_DPI, calidad=PREVIEW_CALIDAD, formato='jpeg'):
+    """Renderiza en una sola pasada las páginas del rango que aún no están en la caché.
+
+    Devuelve {página: bytes} con las páginas renderizadas ahora (vacío si ya estaban todas).
+    """
+    cache = obtener_cache_previews()
+    sha256 = hash_archivo_memo(filepath)
+    lock = _lock_render(sha256, formato)
+    if not lock.acquire(timeout=TIMEOUT_PREVIEW):
+        raise Exception(f"Otro renderizado del PDF tarda más de {TIMEOUT_PREVIEW} s")
+    try:
+        pendientes = [p for p in range(primera, ultima + 1)
+                      if cache is None or cache.obtener(sha256, p, dpi, calidad, formato) is None]
+        if not pendientes:
+            return {}
+        inicio = time.perf_counter()
+        paginas = renderizar_paginas(filepath, pendientes[0], pendientes[-1], dpi, calidad, formato)
+        if cache is not None:
+            for numero, datos in paginas.items():
+                cache.guardar(sha256, numero, dpi, calidad, datos, formato)
+    finally:
+        lock.release()
+    print(f"🖼️ Páginas {pendientes[0]}-{pendientes[-1]} de {os.path.basename(filepath)} renderizadas en "
+          f"{(time.perf_counter() - inicio) * 1000:.0f} ms")
+    return paginas
+
+def vista_previa(filepath, page, dpi=PREVIEW_DPI, calidad=PREVIEW_CALIDAD, formato='jpeg'):
+    """Imagen de una página del PDF, desde la caché en disco o renderizándola y guardándola.
+
+    Si no está en caché se renderizan también las PREVIEW_PAGINAS_LOTE - 1 siguientes,
+    que son las que el visor pedirá a continuación.
+    """
+    cache = obtener_cache_previews()
+    if cache is None:
+        return renderizar_paginas(filepath, page, page, dpi, calidad, formato)[page]
+    sha256 = hash_archivo_memo(filepath)
+    datos = cache.obtener(sha256, page, dpi, calidad, formato)
+    if datos is None:
+        ultima = min(page + PREVIEW_PAGINAS_LOTE - 1, contar_paginas_pdf(filepath))
+        paginas = rellenar_cache_previews(filepath, page, max(ultima, page), dpi, calidad, formato)
+        datos = paginas.get(page) or cache.obtener(sha256, page, dpi, calidad, formato)
+        if datos is None:
+            raise Exception("No se pudo convertir la página del PDF")
+    return datos
+
+def imagen_texto_pdf(filepath, filename, page, total_pages):
+    """Imagen JPEG con el texto extraído de la página, para cuando no se puede renderizar"""
+    from PIL import Image, ImageDraw, ImageFont
+    img = Image.new('RGB', (800, 1000), color='white')
+    draw = ImageDraw.Draw(img)
+    
+    # Intentar cargar fuente, si no usar default
+    try:
+        font_title = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf", 24)
+        font_text = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", 16)
+    except:
+        try:
+            font_title = ImageFont.load_default()
+            font_text = ImageFont.load_default()
+        except:
+            font_title = font_text = None
+    
+    # Título
+    draw.text((50, 50), f"Vista previa - {filename}", fill='black', font=font_title)
+    draw.text((50, 80), f"Página {page} de {total_pages}", fill='gray', font=font_text)
+    
+    # Mostrar el texto guardado al procesar el PDF o, si no se llegó a leer esa página, extraerlo
+    y_pos = 120
+    backend = backend_texto_pdf()
+    if page <= total_pages:
+        try:
+            extracted_text = documento_pdf(filepath).texto_pagina(page)
+            if extracted_text is None and backend.disponible():
+                extracted_text = backend.texto_pagina(filepath, page)
+            if extracted_text:
+                lines = extracted_text.split('\n')[:25]  # Primeras 25 líneas
+                for line in lines:
+                    if y_pos > 950:  # No exceder el límite
+                        break
+                    # Truncar líneas muy largas
+                    line = line[:80] + '...' if len(line) > 80 else line
+                    draw.text((50, y_pos), line, fill='black', font=font_text)
+                    y_pos += 25
+        except Exception as text_error:
+            draw.text((50, y_pos), f"Error al extraer texto: {str(text_error)}", fill='red', font=font_text)
+    
+    img_io = BytesIO()
+    img.save(img_io, 'JPEG', quality=PREVIEW_CALIDAD)
+    return img_io.getvalue()
+
+# Imágenes SVG de reserva cuando no hay pdf2image o falla todo lo demás
+SVG_SIN_PDF2IMAGE = base64.b64decode("PHN2ZyB3aWR0aD0iODAwIiBoZWlnaHQ9IjEwMDAiIHZpZXdCb3g9IjAgMCA4MDAgMTAwMCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj4KPHJlY3Qgd2lkdGg9IjgwMCIgaGVpZ2h0PSIxMDAwIiBmaWxsPSIjRjNGNEY2Ii8+Cjx0ZXh0IHg9IjQwMCIgeT0iNTAwIiBmaWxsPSIjMzc0MTUxIiB0ZXh0LWFuY2hvcj0ibWlkZGxlIiBmb250LWZhbWlseT0ic2Fucy1zZXJpZiIgZm9udC1zaXplPSIyMCI+VmlzdGEgcHJldmlhIG5vIGRpc3BvbmlibGU8L3RleHQ+Cjx0ZXh0IHg9IjQwMCIgeT0iNTQwIiBmaWxsPSIjNjM3Mzg1IiB0ZXh0LWFuY2hvcj0ibWlkZGxlIiBmb250LWZhbWlseT0ic2Fucy1zZXJpZiIgZm9udC1zaXplPSIxNCI+SW5zdGFsZSBwZGYyaW1hZ2UgcGFyYSB2ZXIgUERGczwvdGV4dD4KPC9zdmc+")
+SVG_ERROR_PREVIEW = base64.b64decode("PHN2ZyB3aWR0aD0iODAwIiBoZWlnaHQ9IjEwMDAiIHZpZXdCb3g9IjAgMCA4MDAgMTAwMCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj4KPHJlY3Qgd2lkdGg9IjgwMCIgaGVpZ2h0PSIxMDAwIiBmaWxsPSIjRjNGNEY2Ii8+Cjx0ZXh0IHg9IjQwMCIgeT0iNDgwIiBmaWxsPSIjMzc0MTUxIiB0ZXh0LWFuY2hvcj0ibWlkZGxlIiBmb250LWZhbWlseT0ic2Fucy1zZXJpZiIgZm9udC1zaXplPSIyMCI+RXJyb3IgZW4gdmlzdGEgcHJldmlhPC90ZXh0Pgo8dGV4dCB4PSI0MDAiIHk9IjUyMCIgZmlsbD0iIzYzNzM4NSIgdGV4dC1hbmNob3I9Im1pZGRsZSIgZm9udC1mYW1pbHk9InNhbnMtc2VyaWYiIGZvbnQtc2l6ZT0iMTQiPlBvcHBsZXIgbm8gZGlzcG9uaWJsZTwvdGV4dD4KPHR5eHQgeD0iNDAwIiB5PSI1NjAiIGZpbGw9IiM2MzczODUiIHRleHQtYW5jaG9yPSJtaWRkbGUiIGZvbnQtZmFtaWx5PSJzYW5zLXNlcmlmIiBmb250LXNpemU9IjE0Ij5Vc2UgZWwgZW5sYWNlIGRlIGRlc2NhcmdhPC90ZXh0Pgo8L3N2Zz4K")
+
+def imagen_vista_previa(filepath, filename, page, total_pages, formato='jpeg'):
+    """Imagen de la página para la vista previa, con las alternativas de siempre.
+
+    Devuelve (datos, tipo MIME, limitada, mensaje): la página renderizada con poppler;
+    si no se puede, una imagen con el texto extraído; y como último recurso un SVG.
+    """
+    if not capacidades()['pdf2image']:
+        return SVG_SIN_PDF2IMAGE, 'image/svg+xml', True, "Para ver la vista previa del PDF, instala: pip install pdf2image"
+    if formato == 'webp' and not capacidades()['webp']:
+        formato = 'jpeg'
+    try:
+        return vista_previa(filepath, page, formato=formato), FORMATOS_PREVIEW[formato][1], False, None
+    except Exception as e:
+        print(f"Error con pdf2image: {str(e)}")
+        error = e
+
+    # Fallback: generar imagen con texto extraído
+    if capacidades()['pil']:
+        try:
+            return (imagen_texto_pdf(filepath, filename, page, total_pages), 'image/jpeg', True,
+                    f"Vista previa de texto (pdf2image falló: {str(error)})")
+        except Exception as pil_error:
+            print(f"Error con PIL fallback: {str(pil_error)}")
+
+    # Último fallback: SVG simple
+    return SVG_ERROR_PREVIEW, 'image/svg+xml', True, f"Error con poppler: {str(error)}"
+
+def resultado_esperado_vista_previa(formato='jpeg'):
+    """(limitada, tipo MIME) que devolverá imagen_vista_previa si nada falla, sin renderizar"""
+    if capacidades()['pdf2image'] and capacidades()['poppler']['disponible']:
+        if formato == 'webp' and not capacidades()['webp']:
+            formato = 'jpeg'
+        return False, FORMATOS_PREVIEW[formato][1]
+    if capacidades()['pdf2image'] and capacidades()['pil']:
+        return True, 'image/jpeg'
+    return True, 'image/svg+xml'
+
+def etag_vista_previa(filepath, page, limitada, mimetype):
+    """ETag de la imagen de una página: contenido del PDF y parámetros de renderizado"""
+    variante = 'texto' if limitada else f"{PREVIEW_DPI}-{PREVIEW_CALIDAD}"
+    return f"{hash_archivo_memo(filepath)[:32]}-{page}-{variante}-{mimetype.split('/')[1]}"
+
+_EJECUTOR_PREVIEWS = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prerender')
+
+def _prerenderizar(filepaths):
+    # vista_previa consulta los metadatos del PDF en la base de datos
+    with app.app_context():
+        for filepath in filepaths:
+            try:
+                vista_previa(filepath, 1)
+            except Exception as e:
+                print(f"⚠️ No se pudo pre-renderizar {os.path.basename(filepath)}: {e}")
+
+def programar_prerenderizado(filepaths):
+    """Encola el renderizado de la página 1 de cada archivo sin retrasar el procesamiento"""
+    if (PRERENDER_PREVIEWS and capacidades()['pdf2image'] and capacidades()['poppler']['disponible']
+            and obtener_cache_previews() is not None):
+        _EJECUTOR_PREVIEWS.submit(_prerenderizar, list(filepaths))
+
+# ========================================
+# TRABAJOS DE CARGA EN SEGUNDO PLANO
+# ========================================
+
+# Lotes que se procesan a la vez; el resto espera en cola
+TRABAJOS_MAX_PARALELOS = int(os.environ.get('TRABAJOS_MAX_PARALELOS', 2))
+# Tiempo que se conservan los trabajos terminados para poder consultarlos
+TRABAJOS_RETENCION_SEGUNDOS = int(os.environ.get('TRABAJOS_RETENCION_SEGUNDOS', 3600))
+# Tiempo sin avances tras el que un trabajo sin terminar se da por abandonado
+TRABAJOS_CADUCIDAD_SEGUNDOS = int(os.environ.get('TRABAJOS_CADUCIDAD_SEGUNDOS', 600))
+
+_EJECUTOR_TRABAJOS = ThreadPoolExecutor(max_workers=TRABAJOS_MAX_PARALELOS, thread_name_prefix='trabajo-carga')
+# Trabajos en cola o en curso en este proceso: cada avance renueva el latido de todos
+_TRABAJOS_LOCALES = set()
+
+def _purgar_trabajos():
+    """Elimina los trabajos terminados que superan el tiempo de retención"""
+    limite = time.time() - TRABAJOS_RETENCION_SEGUNDOS
+    TrabajoCarga.query.filter(TrabajoCarga.terminado < limite).delete()
+    db.session.commit()
+
+def recuperar_trabajos_abandonados():
+    """Da por fallidos los trabajos sin terminar que llevan TRABAJOS_CADUCIDAD_SEGUNDOS sin avanzar.
+
+    Son los de un worker que se detuvo sin acabarlos (reinicio, caída o recarga que superó
+    el graceful_timeout): nadie los va a terminar y su progreso se quedaría a medias para
+    siempre. Las facturas que llegaron a guardarse se conservan.
+    """
+    ahora = time.time()
+    abandonados = (TrabajoCarga.query
+                   .filter(TrabajoCarga.estado.in_(('en_cola', 'procesando')),
+                           db.func.coalesce(TrabajoCarga.actualizado, TrabajoCarga.creado)
+                           < ahora - TRABAJOS_CADUCIDAD_SEGUNDOS)
+                   .update({'estado': 'error', 'terminado': ahora,
+                            'error': "El proceso que atendía la carga se detuvo; vuelve a subir los archivos pendientes"},
+                           synchronize_session=False))
+    db.session.commit()
+    if abandonados:
+        print(f"⚠️ {abandonados} trabajos de carga abandonados marcados como error")
+    return abandonados
+
+def trabajo_abandonado(trabajo):
+    """True si el trabajo sigue sin terminar pero lleva demasiado tiempo sin avanzar"""
+    return (trabajo.estado in ('en_cola', 'procesando')
+            and (trabajo.actualizado or trabajo.creado) < time.time() - TRABAJOS_CADUCIDAD_SEGUNDOS)
+
+def _latido_trabajos():
+    """Renueva la marca de avance de los trabajos en cola o en curso de este proceso"""
+    TrabajoCarga.query.filter(TrabajoCarga.id.in_(list(_TRABAJOS_LOCALES))).update(
+        {'actualizado': time.time()}, synchronize_session=False)
+
+def crear_trabajo(archivos, modo='auto'):
+    """Registra un trabajo de carga, lo encola y devuelve su id"""
+    _purgar_trabajos()
+    recuperar_trabajos_abandonados()
+    job_id = uuid.uuid4().hex
+    ahora = time.time()
+    db.session.add(TrabajoCarga(
+        id=job_id,
+        estado='en_cola',
+        modo='pipeline' if _usar_pool(len(archivos), modo) else 'secuencial',
+        total=len(archivos),
+        procesadas=0,
+        creado=ahora,
+        actualizado=ahora
+    ))
+    db.session.commit()
+    _TRABAJOS_LOCALES.add(job_id)
+    _EJECUTOR_TRABAJOS.submit(_ejecutar_trabajo, job_id, archivos)
+    return job_id
+
+def detener_trabajos():
+    """Apagado ordenado del worker: espera a que terminen los trabajos en cola y en curso
+    de este proceso y después cierra el pool de procesos, sin cancelar nada"""
+    _EJECUTOR_TRABAJOS.shutdown(wait=True)
+    _reiniciar_pool()
+
+def _ejecutar_trabajo(job_id, archivos):
+    """Procesa los archivos de un trabajo guardando cada factura según termina"""
+    with app.app_context():
+        trabajo = db.session.get(TrabajoCarga, job_id)
+        trabajo.estado = 'procesando'
+        trabajo.iniciado = trabajo.actualizado = time.time()
+        db.session.commit()
+        try:
+            resultados = iterar_procesamiento(archivos, trabajo.modo == 'pipeline')
+            for posicion, ((filepath, _), (factura, t, documento)) in enumerate(zip(archivos, resultados)):
+                registrar_documento_pdf(filepath, documento)
+                # Cada archivo subido es una factura propia, aunque repita nombre o contenido
+                # (el PDF y sus metadatos sí se comparten, por sha256)
+                factura['id'] = uuid.uuid4().hex
+                db.session.add(Factura.desde_dict(factura, job_id, posicion, t, documento['sha256'],
+                                                  documento['campos']))
+                trabajo.procesadas = posicion + 1
+                _latido_trabajos()
+                db.session.commit()
+            trabajo.estado = 'completado'
+            programar_prerenderizado(filepath for filepath, _ in archivos)
+        except Exception as e:
+            print(f"❌ Error en el trabajo de carga {job_id}: {e}")
+            db.session.rollback()
+            trabajo.estado = 'error'
+            trabajo.error = str(e)
+        finally:
+            trabajo.terminado = time.time()
+            db.session.commit()
+            _TRABAJOS_LOCALES.discard(job_id)
+
+def estado_trabajo(trabajo, desde=0):
+    """Representación JSON del progreso de un trabajo (facturas a partir de 'desde')"""
+    filas = (Factura.query
+             .filter(Factura.trabajo_id == trabajo.id, Factura.posicion >= desde)
+             .order_by(Factura.posicion)
+             .limit(max(trabajo.procesadas - desde, 0))
+             .all())
+    fin = trabajo.terminado or time.time()
+    return {
+        'success': True,
+        'job_id': trabajo.id,
+        'estado': trabajo.estado,
+        'modo': trabajo.modo,
+        'total': trabajo.total,
+        'procesadas': trabajo.procesadas,
+        'progreso': round(100 * trabajo.procesadas / trabajo.total) if trabajo.total else 100,
+        'facturas': [f.to_dict() for f in filas],
+        'tiempos': [json.loads(f.tiempos) for f in filas if f.tiempos],
+        'siguiente': desde + len(filas),
+        'error': trabajo.error,
+        'duracion_ms': round((fin - trabajo.creado) * 1000, 2),
+    }
+
+# ========================================
+# REASIGNACIÓN TRAS CAMBIOS DEL MAPEO
+# ========================================
+
+# Columnas de Factura que dependen de la comunidad/cuenta asignadas
+COLUMNAS_ASIGNACION = ('comunidad', 'cuenta', 'estado', 'archivo_procesado', 'movimiento_contable')
+# Facturas que se actualizan por transacción
+REASIGNACION_LOTE = 500
+
+# Un solo hilo: dos recargas seguidas se reasignan una detrás de otra
+_EJECUTOR_REASIGNACION = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reasignacion')
+# Resumen de la última reasignación de este worker (se muestra en /api/mapeo)
+ULTIMA_REASIGNACION = {}
+
+def campos_guardados(fila, mapeo=None):
+    """Campos detectados de una factura guardada, sin volver a leer el PDF.
+
+    Las facturas procesadas antes de guardar los campos los obtienen del texto que se
+    guardó con su documento (DocumentoPDF); si tampoco está, devuelve None.
+    """
+    if fila.campos:
+        return json.loads(fila.campos)
+    documento = db.session.get(DocumentoPDF, fila.sha256) if fila.sha256 else None
+    texto = "".join(json.loads(documento.textos or '[]')) if documento else ''
+    if not texto:
+        return None
+    return detectar_campos_factura(texto, fila.nombre, mapeo)
+
+def reasignar_factura(fila, campos, mapeo=None):
+    """Vuelve a pasar la cadena de asignación sobre los campos; True si cambia la fila"""
+    asignacion = asignar_comunidad_cuenta(campos, mapeo)
+    # Sin fecha en la factura se mantiene la del procesamiento, no la de hoy
+    fecha = fila.fecha.strftime('%d/%m/%Y') if fila.fecha else None
+    nueva = construir_factura(fila.nombre, campos, asignacion, fecha)
+    cambiada = False
+    for columna in COLUMNAS_ASIGNACION:
+        if getattr(fila, columna) != nueva[columna]:
+            setattr(fila, columna, nueva[columna])
+            cambiada = True
+    return cambiada
+
+def reasignar_facturas(cambios=None):
+    """Reasigna comunidad y cuenta de las facturas guardadas con el mapeo actual.
+
+    Solo se ejecuta la cadena de asignación sobre los campos guardados, sin leer los
+    PDFs. Con cambios (ver cambios_mapeo) solo se tocan las facturas a las que afecta
+    alguna entrada cambiada; sin ellos, todas. Devuelve un resumen de lo hecho.
+    """
+    inicio = time.perf_counter()
+    # Todas las facturas del recorrido se reasignan con la misma configuración
+    mapeo = MAPEO_ACTUAL
+    resumen = {'version': VERSION_MAPEO, 'revisadas': 0, 'afectadas': 0, 'actualizadas': 0, 'sin_campos': 0}
+    # Primera pasada, solo con id y campos: las candidatas (y las que aún no tienen campos)
+    candidatas = []
+    for id_factura, campos in db.session.query(Factura.id, Factura.campos).yield_per(1000):
+        resumen['revisadas'] += 1
+        if cambios is None or campos is None or campos_afectados(json.loads(campos), cambios):
+            candidatas.append(id_factura)
+
+    for i in range(0, len(candidatas), REASIGNACION_LOTE):
+        lote = candidatas[i:i + REASIGNACION_LOTE]
+        for fila in Factura.query.filter(Factura.id.in_(lote)):
+            campos = campos_guardados(fila, mapeo)
+            if campos is None:
+                resumen['sin_campos'] += 1
+                continue
+            if fila.campos is None:
+                fila.campos = json.dumps(campos, ensure_ascii=False)
+            if cambios is not None and not campos_afectados(campos, cambios):
+                continue
+            resumen['afectadas'] += 1
+            resumen['actualizadas'] += reasignar_factura(fila, campos, mapeo)
+        db.session.commit()
+
+    resumen['duracion_ms'] = round((time.perf_counter() - inicio) * 1000, 2)
+    resumen['terminada'] = datetime.now().isoformat(timespec='seconds')
+    return resumen
+
+def reclamar_reasignacion(clave):
+    """True si este worker es el que reasigna las facturas para la versión del mapeo 'clave'.
+
+    La fila de cada versión solo se puede insertar una vez: el resto de workers, que han
+    detectado el mismo cambio, reciben un IntegrityError y la dejan en manos del primero.
+    """
+    db.session.add(ReasignacionMapeo(clave=clave, worker=os.getpid(), iniciada=time.time()))
+    try:
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+def resumen_reasignacion():
+    """Última reasignación de este worker o, si la hizo otro, el resumen que guardó"""
+    resumen = dict(ULTIMA_REASIGNACION)
+    if resumen.get('clave') and 'actualizadas' not in resumen:
+        fila = db.session.get(ReasignacionMapeo, resumen['clave'])
+        if fila is not None and fila.resumen:
+            resumen.update(json.loads(fila.resumen), worker=fila.worker)
+    return resumen
+
+def _ejecutar_reasignacion(cambios, clave=None):
+    """Ejecuta reasignar_facturas en el hilo de reasignación y guarda el resumen.
+
+    Con clave (las automáticas, tras recargar el mapeo) solo la ejecuta un worker.
+    """
+    with app.app_context():
+        if clave is not None and not reclamar_reasignacion(clave):
+            print(f"🔁 Reasignación del mapeo v{VERSION_MAPEO}: la hace otro worker")
+            ULTIMA_REASIGNACION.clear()
+            ULTIMA_REASIGNACION.update({'version': VERSION_MAPEO, 'clave': clave})
+            return dict(ULTIMA_REASIGNACION)
+        try:
+            resumen = reasignar_facturas(cambios)
+            print(f"🔁 Reasignación (mapeo v{resumen['version']}): {resumen['actualizadas']} de "
+                  f"{resumen['afectadas']} facturas afectadas actualizadas en {resumen['duracion_ms']:.0f} ms "
+                  f"({resumen['revisadas']} revisadas)")
+        except Exception as e:
+            print(f"❌ Error reasignando facturas: {e}")
+            db.session.rollback()
+            resumen = {'version': VERSION_MAPEO, 'error': str(e)}
+        if clave is not None:
+            resumen['clave'] = clave
+            ReasignacionMapeo.query.filter_by(clave=clave).update(
+                {'terminada': time.time(), 'resumen': json.dumps(resumen)}, synchronize_session=False)
+            db.session.commit()
+        ULTIMA_REASIGNACION.clear()
+        ULTIMA_REASIGNACION.update(resumen)
+    return resumen
+
+def programar_reasignacion(cambios=None, clave=None):
+    """Encola la reasignación de las facturas guardadas (todas si no hay cambios).
+
+    clave identifica la versión del mapeo que la provoca; con ella solo la ejecuta un worker.
+    """
+    return _EJECUTOR_REASIGNACION.submit(_ejecutar_reasignacion, cambios, clave)
+
 # ========================================
 # RUTAS DE UPLOAD
 # ========================================
 
+# Tamaño de los bloques al copiar a disco un archivo que no llegó por ArchivoSubido
+TAMANO_BLOQUE_SUBIDA = 64 * 1024
+# Segundos máximos para recibir los archivos de una subida, desde que empieza la petición
+TIMEOUT_UPLOAD = int(os.environ.get('TIMEOUT_UPLOAD', 300))
+
+class ArchivoSubido:
+    """Destino de un archivo del formulario multipart mientras se recibe.
+
+    Werkzeug le va pasando los bloques de la petición: se escriben directamente en un
+    temporal de la carpeta de uploads y a la vez se calculan el SHA-256 y el tamaño,
+    sin guardar el archivo entero en memoria ni volver a leerlo después. Si no se llega
+    a guardar, el temporal se borra al cerrar la petición. Si se pasa limite (un instante
+    de time.monotonic) y se sigue recibiendo después, se corta la subida con un 408.
+    """
+
+    def __init__(self, carpeta, limite=None):
+        os.makedirs(carpeta, exist_ok=True)
+        self._archivo = tempfile.NamedTemporaryFile(dir=carpeta, prefix='.subida-', suffix='.part', delete=False)
+        self._ruta_temporal = self._archivo.name
+        self._sha = hashlib.sha256()
+        self._limite = limite
+        self.tamano = 0
+
+    def write(self, datos):
+        if self._limite is not None and time.monotonic() > self._limite:
+            # El parser aún no ha entregado el archivo a la petición: nadie más lo cerraría
+            self.close()
+            raise RequestTimeout(f"La subida superó el tiempo máximo ({TIMEOUT_UPLOAD} s)")
+        self._sha.update(datos)
+        self.tamano += len(datos)
+        return self._archivo.write(datos)
+
+    def __getattr__(self, nombre):
+        # seek, read... los usa Werkzeug (y FileStorage) sobre el archivo temporal
+        return getattr(self._archivo, nombre)
+
+    @property
+    def sha256(self):
+        return self._sha.hexdigest()
+
+    def guardar(self, carpeta):
+        """Mueve el archivo a <carpeta>/<sha256>.pdf y devuelve (ruta, sha256).
+
+        Si ya había un archivo con ese contenido se conserva y se descarta el temporal.
+        """
+        sha256 = self.sha256
+        destino = os.path.join(carpeta, f"{sha256}.pdf")
+        self._archivo.close()
+        if os.path.exists(destino):
+            os.remove(self._ruta_temporal)
+        else:
+            os.replace(self._ruta_temporal, destino)
+        self._ruta_temporal = None
+        recordar_hash_archivo(destino, sha256)
+        return destino, sha256
+
+    def close(self):
+        self._archivo.close()
+        if self._ruta_temporal:
+            try:
+                os.remove(self._ruta_temporal)
+            except FileNotFoundError:
+                pass
+            self._ruta_temporal = None
+
+class PeticionFacturas(Request):
+    """Petición que, en /upload, recibe los archivos en ArchivoSubido en lugar de en memoria"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inicio = time.monotonic()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == 'upload_file':
+            return ArchivoSubido(app.config['UPLOAD_FOLDER'], self.inicio + TIMEOUT_UPLOAD)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+app.request_class = PeticionFacturas
+
+def guardar_archivo_subido(file):
+    """Guarda un archivo de la petición con su SHA-256 como nombre y devuelve (ruta, sha256).
+
+    El nombre por contenido evita que dos facturas con el mismo nombre se pisen.
+    """
+    subido = file.stream
+    if not isinstance(subido, ArchivoSubido):
+        subido = ArchivoSubido(app.config['UPLOAD_FOLDER'])
+        shutil.copyfileobj(file.stream, subido, TAMANO_BLOQUE_SUBIDA)
+    return subido.guardar(app.config['UPLOAD_FOLDER'])
+
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
-    """Procesa la carga de uno o varios archivos"""
+    """Guarda los archivos subidos y encola su procesamiento; devuelve el id del trabajo"""
+    try:
+        request.files
+    except RequestTimeout as e:
+        return jsonify({"success": False, "error": e.description}), 408
     if 'file' not in request.files:
         return jsonify({"success": False, "error": "No se envió ningún archivo"}), 400
     
@@ -838,185 +3342,42 @@ def upload_file():
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
         os.makedirs(app.config['UPLOAD_FOLDER'])
 
-    # Eliminar facturas anteriores al subir nuevas (según requisito)
-    FACTURAS_DATA.clear()
-    processed_files = []
-    
     # Leer opciones de formulario: asumimos que si no vienen, el archivo es una factura
     pdf_optimizado = request.form.get('pdf_optimizado', 'on') == 'on'
     # por defecto tratamos como factura si el campo no viene
     pdf_factura = request.form.get('pdf_factura', 'on') == 'on'
+    # Modo de procesamiento: auto (pool si el lote es grande), pipeline o secuencial
+    modo = request.form.get('modo', 'auto')
+    if modo not in ('auto', 'pipeline', 'secuencial'):
+        return jsonify({"success": False, "error": f"Modo de procesamiento no válido: {modo}"}), 400
 
+    # Los archivos ya están en disco (ArchivoSubido); solo queda darles su nombre definitivo
+    archivos = []
     for file in files:
-        # Guardar el archivo
-        filename = file.filename
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        # Analizar el nombre del archivo para determinar tipo
-        filename_lower = filename.lower()
-
-        # Extraer texto del PDF para análisis si PyPDF2 está disponible
-        pdf_text = ""
-        if PYPDF2_ENABLED:
-            try:
-                with open(filepath, 'rb') as pdf_file:
-                    pdf_reader = PyPDF2.PdfReader(pdf_file)
-                    for page_num in range(min(2, len(pdf_reader.pages))):  # Solo las primeras 2 páginas
-                        pdf_text += pdf_reader.pages[page_num].extract_text() or ""
-            except Exception as e:
-                print(f"Error al extraer texto del PDF: {str(e)}")
-
-        # Determinar campos usando extractores reutilizables
-        tipo = detectar_tipo_gasto(pdf_text, filename)
-        cups = detectar_cups_o_contador(pdf_text)
-        direccion = detectar_direccion(pdf_text)
-        importe_val = detectar_importe_total(pdf_text)
-        periodo = detectar_periodo_facturacion(pdf_text)
-        fecha_factura = detectar_fecha_factura(pdf_text)  # Nueva detección de fecha
-
-        # Detectar póliza y código de abastecimiento y contador
-        cod_abast, poliza = detectar_poliza_y_cod_abast(pdf_text)
-        contador = detectar_contador(pdf_text)
-
-        # LOGICA DE PRIORIDAD DE ASIGNACION (1 Comunidad específica, 2 Dirección, 3 Póliza/Cód Abast., 4 Contador, 5 Periodo)
-        comunidad_asig = None
-        cuenta_asig = None
-
-        # 1) Intentar detectar comunidad específica según tipo de factura
-        comunidad_especifica = detectar_comunidad_factura(pdf_text, tipo)
-        if comunidad_especifica:
-            comunidad_asig = comunidad_especifica
-
-        # 2) Intentar por dirección (normalizando)
-        if not comunidad_asig and direccion:
-            # Normalizar y buscar en mapas por coincidencia cercana
-            dkey = _normalize_dir_key(direccion)
-            for (t, d), datos in DIRECCIONES_POR_TIPO.items():
-                if t == tipo and _normalize_dir_key(d) == dkey:
-                    comunidad_asig = datos.get('comunidad')
-                    cuenta_asig = datos.get('cuenta')
-                    break
+        filepath, _ = guardar_archivo_subido(file)
+        archivos.append((filepath, file.filename))
 
-        # 3) Intentar por póliza o código de abastecimiento en mappings secretos
-        if not comunidad_asig and (poliza or cod_abast):
-            # buscar en MAPEO_CUENTAS_CONTABLES por campos internos
-            for k, v in MAPEO_CUENTAS_CONTABLES.items():
-                info = v or {}
-                # revisar si poliza o cod_abast aparecen en cualquiera de los valores
-                textvals = ' '.join([str(x).upper() for x in info.values() if x])
-                if poliza and poliza.upper() in textvals:
-                    comunidad_asig = info.get('comunidad')
-                    cuenta_asig = info.get('cuenta')
-                    break
-                if cod_abast and str(cod_abast) in textvals:
-                    comunidad_asig = info.get('comunidad')
-                    cuenta_asig = info.get('cuenta')
-                    break
-
-        # 4) Intentar por contador
-        if not comunidad_asig and contador:
-            if contador in MAPEO_CUENTAS_CONTABLES:
-                info = MAPEO_CUENTAS_CONTABLES[contador]
-                comunidad_asig = info.get('comunidad')
-                cuenta_asig = info.get('cuenta')
-
-        # 5) Fallback a asignaciones por tipo si aún no asignado
-        if not comunidad_asig:
-            comunidad_asig, cuenta_asig = asignar_cuenta_contable_con_tipos(cups, direccion, tipo)
-
-        # Normalizar valores para guardar
-        comunidad = comunidad_asig or 'COMUNIDAD GENERAL'
-        numero = cuenta_asig or '62900000'
-        # Estado/importe: si detectamos importe, formatearlo (usar coma decimal)
-        if importe_val is not None:
-            # forzar dos decimales y usar coma
-            estado_val = f"{importe_val:.2f}"
-            estado = f"{estado_val.replace('.', ',')}"
-            importe_formateado = f"{estado_val.replace('.', ',')} EUR"
-        else:
-            estado_val = None
-            estado = "N/A"
-            importe_formateado = "N/A"
-
-        # Construir chosen_location para el nombre renombrado
-        chosen_location = None
-        if direccion:
-            chosen_location = direccion
-        elif poliza or cod_abast:
-            chosen_location = f"Póliza {poliza}" if poliza else f"Cód.Abast. {cod_abast}"
-        elif contador:
-            chosen_location = f"Contador {contador}"
-
-        # Generar nombre renombrado con formato: Agua Direccion XX 08-04-2024 11,10EUR
-        fecha_para_nombre = fecha_factura or datetime.now().strftime("%d/%m/%Y")
-        # Reemplazar barras por guiones para compatibilidad con sistemas de archivos
-        fecha_para_nombre = fecha_para_nombre.replace("/", "-")
-
-        direccion_para_nombre = chosen_location or comunidad or "Sin Direccion"
-        importe_para_nombre = f"{estado_val.replace('.', ',')}EUR" if estado_val else "0EUR"
-        
-        nombre_renombrado = f"{tipo} {direccion_para_nombre} {fecha_para_nombre} {importe_para_nombre}"
-
-        # Determinar estado de validación
-        datos_criticos = [tipo, importe_val, comunidad_asig]
-        datos_opcionales = [direccion, fecha_factura, periodo]
-        
-        criticos_completos = sum(1 for d in datos_criticos if d)
-        opcionales_completos = sum(1 for d in datos_opcionales if d)
-        
-        if criticos_completos == len(datos_criticos) and opcionales_completos >= 2:
-            estado_validacion = "success"  # Verde
-        elif criticos_completos == len(datos_criticos):
-            estado_validacion = "warning"  # Amarillo
-        else:
-            estado_validacion = "danger"   # Rojo
-
-        # Construir texto simple para copia al portapapeles: "Agua DIRECCION XX Periodo Facturacion de ABR-MAY 2024 13,57€"
-        texto_copia = []
-        if tipo:
-            texto_copia.append(tipo)
-        if chosen_location:
-            texto_copia.append(chosen_location.upper())
-        if periodo:
-            texto_copia.append(f"Periodo Facturacion de {periodo}")
-        if estado_val:
-            texto_copia.append(f"{estado_val.replace('.', ',')}EUR")
-        
-        titulo_final = ' '.join([p for p in texto_copia if p])
-
-        nueva_factura = {
-            "id": filename,
-            "nombre": filename,
-            "archivo_procesado": nombre_renombrado,
-            "cups": contador or cups or 'No detectado',  # Priorizar contador sobre CUPS
-            "direccion": direccion,
-            "fecha": fecha_factura or datetime.now().strftime("%d/%m/%Y"),
-            "tipo": tipo,
-            "importe": importe_formateado,
-            "estado": estado_validacion,
-            "comunidad": comunidad,
-            "cuenta": numero,
-            "cuenta_contable": numero,
-            "procesado": False,  # Campo para controlar si está procesado
-            "movimiento_contable": titulo_final or f"Gasto {tipo} - {comunidad} - Importe: {estado} - Periodo: {periodo or 'N/D'}",
-            "aprobacion": "Águila Avilés, Reconocimiento (15 días) - Fecha límite: hoy",
-            "acciones": "ver"
-        }
-
-        # Agregamos la nueva factura a nuestra lista (en memoria)
-        FACTURAS_DATA.append(nueva_factura)
-        processed_files.append(nueva_factura)
-
-    # Simulamos una pequeña demora para dar sensación de procesamiento
-    import time
-    time.sleep(1)
+    job_id = crear_trabajo(archivos, modo)
     
     return jsonify({
         "success": True, 
-        "facturas": processed_files,
-        "total_procesadas": len(processed_files)
-    })
+        "job_id": job_id,
+        "total": len(archivos),
+        "estado_url": url_for('api_trabajo', job_id=job_id)
+    }), 202
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def api_trabajo(job_id):
+    """Progreso de un trabajo de carga; 'desde' devuelve solo las facturas nuevas"""
+    trabajo = db.session.get(TrabajoCarga, job_id)
+    if not trabajo:
+        return jsonify({"success": False, "error": "Trabajo no encontrado"}), 404
+    if trabajo_abandonado(trabajo):
+        recuperar_trabajos_abandonados()
+        db.session.refresh(trabajo)
+    desde = max(request.args.get('desde', 0, type=int), 0)
+    return jsonify(estado_trabajo(trabajo, desde))
 
 # ========================================
 # RUTAS DE ACCIONES
@@ -1027,10 +3388,10 @@ def upload_file():
 def copiar_movimiento(id_factura):
     """Devuelve solo el concepto para copiar al portapapeles"""
     # Buscar la factura correspondiente
-    factura = next((f for f in FACTURAS_DATA if f["id"] == id_factura), None)
+    factura = buscar_factura(id_factura)
     if factura:
         # Solo devolver el concepto/movimiento contable
-        concepto = factura.get('movimiento_contable') or ''
+        concepto = factura.movimiento_contable or ''
         return jsonify({"success": True, "concepto": concepto})
     return jsonify({"success": False, "error": "Factura no encontrada"}), 404
 
@@ -1040,248 +3401,95 @@ def toggle_procesado(id_factura):
     """Marcar/desmarcar factura como procesada"""
     try:
         # Buscar la factura por ID
-        for f in FACTURAS_DATA:
-            if str(f.get('id')) == str(id_factura):
-                f['processed'] = not f.get('processed', False)
-                return jsonify({
-                    'success': True,
-                    'processed': f['processed'],
-                    'message': 'Estado actualizado correctamente'
-                })
+        factura = buscar_factura(id_factura)
+        if factura:
+            factura.procesado = not factura.procesado
+            db.session.commit()
+            return jsonify({
+                'success': True,
+                'procesado': factura.procesado,
+                'processed': factura.procesado,
+                'message': 'Estado actualizado correctamente'
+            })
         
         return jsonify({'error': 'Factura no encontrada'}), 404
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Error al actualizar estado: {str(e)}'}), 500
 
 @app.route('/diagnostico')
 @login_required
 def diagnostico():
-    """Diagnóstico del sistema para verificar dependencias"""
-    import shutil
-    import subprocess
+    """Diagnóstico del sistema para verificar dependencias.
+
+    Devuelve el registro de capacidades detectado en la primera consulta; con ?actualizar=1
+    vuelve a comprobar poppler (por ejemplo, después de instalarlo).
+    """
+    if request.args.get('actualizar', '').lower() in ('1', 'true'):
+        detectar_capacidades()
+    poppler = capacidades()['poppler']
     
     diagnostico_info = {
-        "pypdf2": PYPDF2_ENABLED,
-        "pil": PIL_ENABLED,
-        "pdf2image": PDF_PREVIEW_ENABLED,
-        "poppler_en_path": bool(shutil.which('pdftoppm')),
-        "poppler_version": None,
-        "rutas_poppler": []
+        "pypdf2": capacidades()['pypdf2'],
+        "pil": capacidades()['pil'],
+        "pdf2image": capacidades()['pdf2image'],
+        "poppler_disponible": poppler['disponible'],
+        "poppler_en_path": poppler['en_path'],
+        "poppler_version": poppler['version'],
+        "rutas_poppler": poppler['rutas'],
+        "poppler_detectado": poppler['detectado'],
+        "pdftotext": bool(poppler.get('pdftotext')),
+        "backend_texto": backend_texto_pdf().nombre
     }
-    
-    # Verificar versión de poppler
-    if shutil.which('pdftoppm'):
-        try:
-            result = subprocess.run(['pdftoppm', '-v'], capture_output=True, text=True, timeout=5)
-            diagnostico_info["poppler_version"] = result.stderr.strip() if result.stderr else result.stdout.strip()
-        except Exception as e:
-            diagnostico_info["poppler_error"] = str(e)
-    
-    # Buscar poppler en rutas comunes
-    common_paths = ['/usr/bin/pdftoppm', '/usr/local/bin/pdftoppm', '/bin/pdftoppm']
-    for path in common_paths:
-        if os.path.exists(path):
-            diagnostico_info["rutas_poppler"].append(path)
+    if poppler['error']:
+        diagnostico_info["poppler_error"] = poppler['error']
     
     return jsonify(diagnostico_info)
 
+def _ruta_upload(filename):
+    """Ruta de un archivo subido, o None si no existe o queda fuera de la carpeta de uploads"""
+    carpeta = os.path.realpath(app.config['UPLOAD_FOLDER'])
+    filepath = os.path.realpath(os.path.join(carpeta, filename))
+    if os.path.commonpath([carpeta, filepath]) != carpeta or not os.path.isfile(filepath):
+        return None
+    return filepath
+
+def _pdf_vista_previa(clave):
+    """(ruta, nombre) del PDF que pide el visor, por factura (id o nombre) o por archivo subido"""
+    factura = buscar_factura(clave)
+    if factura is not None:
+        ruta = ruta_pdf_factura(factura)
+        if ruta:
+            return ruta, factura.nombre
+    return _ruta_upload(clave), clave
+
 @app.route('/pdf_preview/<path:filename>')
 @login_required
 def pdf_preview(filename):
-    """Genera y devuelve una vista previa de una página de un archivo PDF"""
+    """Vista previa de una página en JSON con la imagen en base64 (clientes antiguos).
+
+    El dashboard usa /preview/info y /preview/imagen, que envían la imagen en binario
+    y se pueden cachear en el navegador.
+    """
     try:
         page = request.args.get('page', 1, type=int)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filepath, nombre = _pdf_vista_previa(filename)
         
-        if not os.path.exists(filepath):
+        if not filepath:
             return jsonify({"success": False, "error": "Archivo no encontrado"}), 404
         
-        # Obtener número total de páginas de forma más robusta
-        total_pages = 1
-        if PYPDF2_ENABLED:
-            try:
-                with open(filepath, 'rb') as pdf_file:
-                    pdf_reader = PyPDF2.PdfReader(pdf_file)
-                    total_pages = len(pdf_reader.pages)
-            except Exception as e:
-                print(f"Error al obtener páginas con PyPDF2: {e}")
-        
-        # Si no hay pdf2image, devolver placeholder
-        if not PDF_PREVIEW_ENABLED:
-            return jsonify({
-                "success": True, 
-                "imageData": "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iODAwIiBoZWlnaHQ9IjEwMDAiIHZpZXdCb3g9IjAgMCA4MDAgMTAwMCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj4KPHJlY3Qgd2lkdGg9IjgwMCIgaGVpZ2h0PSIxMDAwIiBmaWxsPSIjRjNGNEY2Ii8+Cjx0ZXh0IHg9IjQwMCIgeT0iNTAwIiBmaWxsPSIjMzc0MTUxIiB0ZXh0LWFuY2hvcj0ibWlkZGxlIiBmb250LWZhbWlseT0ic2Fucy1zZXJpZiIgZm9udC1zaXplPSIyMCI+VmlzdGEgcHJldmlhIG5vIGRpc3BvbmlibGU8L3RleHQ+Cjx0ZXh0IHg9IjQwMCIgeT0iNTQwIiBmaWxsPSIjNjM3Mzg1IiB0ZXh0LWFuY2hvcj0ibWlkZGxlIiBmb250LWZhbWlseT0ic2Fucy1zZXJpZiIgZm9udC1zaXplPSIxNCI+SW5zdGFsZSBwZGYyaW1hZ2UgcGFyYSB2ZXIgUERGczwvdGV4dD4KPC9zdmc+",
-                "currentPage": 1,
-                "totalPages": total_pages,
-                "limitedPreview": True,
-                "message": "Para ver la vista previa del PDF, instala: pip install pdf2image"
-            })
-        
-        # Intentar convertir con pdf2image con configuración específica
-        try:
-            # Detectar y configurar poppler automáticamente
-            import subprocess
-            import shutil
-            
-            poppler_path = None
-            poppler_working = False
-            
-            # Verificar si pdftoppm está disponible en PATH
-            if shutil.which('pdftoppm'):
-                print("✅ Poppler encontrado en PATH")
-                try:
-                    # Verificar que funciona
-                    result = subprocess.run(['pdftoppm', '-v'], 
-                                          capture_output=True, text=True, timeout=5)
-                    if result.returncode == 0:
-                        poppler_working = True
-                        print("✅ Poppler verificado y funcionando")
-                except Exception as e:
-                    print(f"❌ Error al verificar poppler: {e}")
-            
-            if not poppler_working:
-                print("⚠️ Poppler no funciona en PATH, buscando alternativas...")
-                # Intentar rutas comunes en contenedores Linux
-                common_paths = [
-                    '/usr/bin',
-                    '/usr/local/bin',
-                    '/bin',
-                    '/opt/poppler/bin'
-                ]
-                for path in common_paths:
-                    pdftoppm_path = os.path.join(path, 'pdftoppm')
-                    if os.path.exists(pdftoppm_path):
-                        try:
-                            result = subprocess.run([pdftoppm_path, '-v'], 
-                                                  capture_output=True, text=True, timeout=5)
-                            if result.returncode == 0:
-                                poppler_path = path
-                                poppler_working = True
-                                print(f"✅ Poppler encontrado y verificado en: {poppler_path}")
-                                break
-                        except Exception as e:
-                            print(f"❌ Error al verificar poppler en {path}: {e}")
-            
-            if not poppler_working:
-                # Intentar instalación automática
-                print("🔧 Intentando instalar poppler automáticamente...")
-                try:
-                    subprocess.run(['apt-get', 'update'], check=True, timeout=30)
-                    subprocess.run(['apt-get', 'install', '-y', 'poppler-utils'], 
-                                 check=True, timeout=60)
-                    
-                    # Verificar de nuevo
-                    if shutil.which('pdftoppm'):
-                        poppler_working = True
-                        print("✅ Poppler instalado y configurado")
-                except Exception as e:
-                    print(f"❌ Error al instalar poppler: {e}")
-            
-            # Si aún no funciona, intentar último fallback
-            if not poppler_working:
-                print("❌ Poppler no disponible - usando fallback")
-                raise Exception("Poppler no está disponible en el sistema")
-            
-            images = convert_from_path(
-                filepath, 
-                first_page=page, 
-                last_page=page, 
-                dpi=150,
-                poppler_path=poppler_path,
-                timeout=30,
-                thread_count=1  # Usar solo un thread para evitar problemas
-            )
-            
-            if not images:
-                raise Exception("No se pudo convertir la página del PDF")
-            
-            # Convertir a base64
-            img_io = BytesIO()
-            images[0].save(img_io, 'JPEG', quality=85)
-            img_io.seek(0)
-            
-            encoded = base64.b64encode(img_io.getvalue()).decode('utf-8')
-            
-            return jsonify({
-                "success": True, 
-                "imageData": f"data:image/jpeg;base64,{encoded}",
-                "currentPage": page,
-                "totalPages": total_pages
-            })
-            
-        except Exception as e:
-            print(f"Error con pdf2image: {str(e)}")
-            
-            # Fallback: generar imagen con texto extraído
-            if PIL_ENABLED:
-                try:
-                    img = Image.new('RGB', (800, 1000), color='white')
-                    draw = ImageDraw.Draw(img)
-                    
-                    # Intentar cargar fuente, si no usar default
-                    try:
-                        font_title = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf", 24)
-                        font_text = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", 16)
-                    except:
-                        try:
-                            font_title = ImageFont.load_default()
-                            font_text = ImageFont.load_default()
-                        except:
-                            font_title = font_text = None
-                    
-                    # Título
-                    draw.text((50, 50), f"Vista previa - {filename}", fill='black', font=font_title)
-                    draw.text((50, 80), f"Página {page} de {total_pages}", fill='gray', font=font_text)
-                    
-                    # Extraer y mostrar texto si es posible
-                    y_pos = 120
-                    if PYPDF2_ENABLED and page <= total_pages:
-                        try:
-                            with open(filepath, 'rb') as pdf_file:
-                                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                                if len(pdf_reader.pages) >= page:
-                                    extracted_text = pdf_reader.pages[page-1].extract_text()
-                                    if extracted_text:
-                                        lines = extracted_text.split('\n')[:25]  # Primeras 25 líneas
-                                        for line in lines:
-                                            if y_pos > 950:  # No exceder el límite
-                                                break
-                                            # Truncar líneas muy largas
-                                            line = line[:80] + '...' if len(line) > 80 else line
-                                            draw.text((50, y_pos), line, fill='black', font=font_text)
-                                            y_pos += 25
-                        except Exception as text_error:
-                            draw.text((50, y_pos), f"Error al extraer texto: {str(text_error)}", fill='red', font=font_text)
-                    
-                    # Guardar imagen
-                    img_io = BytesIO()
-                    img.save(img_io, 'JPEG', quality=85)
-                    img_io.seek(0)
-                    
-                    encoded = base64.b64encode(img_io.getvalue()).decode('utf-8')
-                    
-                    return jsonify({
-                        "success": True, 
-                        "imageData": f"data:image/jpeg;base64,{encoded}",
-                        "currentPage": page,
-                        "totalPages": total_pages,
-                        "limitedPreview": True,
-                        "message": f"Vista previa de texto (pdf2image falló: {str(e)})"
-                    })
-                    
-                except Exception as pil_error:
-                    print(f"Error con PIL fallback: {str(pil_error)}")
-            
-            # Último fallback: SVG simple
-            return jsonify({
-                "success": True, 
-                "imageData": "data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iODAwIiBoZWlnaHQ9IjEwMDAiIHZpZXdCb3g9IjAgMCA4MDAgMTAwMCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj4KPHJlY3Qgd2lkdGg9IjgwMCIgaGVpZ2h0PSIxMDAwIiBmaWxsPSIjRjNGNEY2Ii8+Cjx0ZXh0IHg9IjQwMCIgeT0iNDgwIiBmaWxsPSIjMzc0MTUxIiB0ZXh0LWFuY2hvcj0ibWlkZGxlIiBmb250LWZhbWlseT0ic2Fucy1zZXJpZiIgZm9udC1zaXplPSIyMCI+RXJyb3IgZW4gdmlzdGEgcHJldmlhPC90ZXh0Pgo8dGV4dCB4PSI0MDAiIHk9IjUyMCIgZmlsbD0iIzYzNzM4NSIgdGV4dC1hbmNob3I9Im1pZGRsZSIgZm9udC1mYW1pbHk9InNhbnMtc2VyaWYiIGZvbnQtc2l6ZT0iMTQiPlBvcHBsZXIgbm8gZGlzcG9uaWJsZTwvdGV4dD4KPHR5eHQgeD0iNDAwIiB5PSI1NjAiIGZpbGw9IiM2MzczODUiIHRleHQtYW5jaG9yPSJtaWRkbGUiIGZvbnQtZmFtaWx5PSJzYW5zLXNlcmlmIiBmb250LXNpemU9IjE0Ij5Vc2UgZWwgZW5sYWNlIGRlIGRlc2NhcmdhPC90ZXh0Pgo8L3N2Zz4K",
-                "currentPage": page,
-                "totalPages": total_pages,
-                "limitedPreview": True,
-                "message": f"Error con poppler: {str(e)}"
-            })
+        total_pages = contar_paginas_pdf(filepath)
+        datos, mimetype, limitada, mensaje = imagen_vista_previa(filepath, nombre, page, total_pages)
+        respuesta = {
+            "success": True, 
+            "imageData": f"data:{mimetype};base64,{base64.b64encode(datos).decode('utf-8')}",
+            "currentPage": page if capacidades()['pdf2image'] else 1,
+            "totalPages": total_pages
+        }
+        if limitada:
+            respuesta.update(limitedPreview=True, message=mensaje)
+        return jsonify(respuesta)
         
     except Exception as e:
         print(f"Error general en pdf_preview: {str(e)}")
@@ -1290,6 +3498,93 @@ def pdf_preview(filename):
             "error": f"Error al cargar la vista previa: {str(e)}"
         }), 500
 
+@app.route('/preview/info/<path:filename>')
+@login_required
+def preview_info(filename):
+    """Metadatos de la vista previa: número de páginas y si la imagen será limitada"""
+    filepath, _ = _pdf_vista_previa(filename)
+    if not filepath:
+        return jsonify({"success": False, "error": "Archivo no encontrado"}), 404
+    limitada = not (capacidades()['pdf2image'] and capacidades()['poppler']['disponible'])
+    return jsonify({
+        "success": True,
+        "totalPages": contar_paginas_pdf(filepath),
+        "limitedPreview": limitada,
+        "formatos": ['jpeg', 'webp'] if capacidades()['webp'] else ['jpeg']
+    })
+
+@app.route('/preview/lote/<path:filename>', methods=['POST'])
+@login_required
+def preview_lote(filename):
+    """Renderiza de una vez un rango de páginas (por defecto, todo el documento) en la caché"""
+    formato = request.args.get('formato', 'jpeg')
+    if formato not in FORMATOS_PREVIEW:
+        return jsonify({"success": False, "error": f"Formato no válido: {formato}"}), 400
+    if formato == 'webp' and not capacidades()['webp']:
+        formato = 'jpeg'
+    filepath, _ = _pdf_vista_previa(filename)
+    if not filepath:
+        return jsonify({"success": False, "error": "Archivo no encontrado"}), 404
+    if not (capacidades()['pdf2image'] and capacidades()['poppler']['disponible']):
+        return jsonify({"success": False, "error": "Poppler no está disponible en el sistema"}), 503
+
+    total_pages = contar_paginas_pdf(filepath)
+    desde = max(request.args.get('desde', 1, type=int), 1)
+    hasta = min(request.args.get('hasta', total_pages, type=int), total_pages)
+    if desde > hasta:
+        return jsonify({"success": False, "error": f"Rango de páginas no válido (1-{total_pages})"}), 400
+
+    inicio = time.perf_counter()
+    try:
+        renderizadas = rellenar_cache_previews(filepath, desde, hasta, formato=formato)
+    except Exception as e:
+        print(f"Error al renderizar el lote: {e}")
+        return jsonify({"success": False, "error": f"Error al renderizar: {str(e)}"}), 500
+    return jsonify({
+        "success": True,
+        "totalPages": total_pages,
+        "desde": desde,
+        "hasta": hasta,
+        "renderizadas": sorted(renderizadas),
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2)
+    })
+
+@app.route('/preview/imagen/<path:filename>')
+@login_required
+def preview_imagen(filename):
+    """Imagen de una página en binario, con ETag/Last-Modified y caché privada del navegador"""
+    page = request.args.get('page', 1, type=int)
+    formato = request.args.get('formato', 'jpeg')
+    if formato not in FORMATOS_PREVIEW:
+        return jsonify({"success": False, "error": f"Formato no válido: {formato}"}), 400
+    filepath, nombre = _pdf_vista_previa(filename)
+    if not filepath:
+        return jsonify({"success": False, "error": "Archivo no encontrado"}), 404
+
+    total_pages = contar_paginas_pdf(filepath)
+    if page < 1 or page > total_pages:
+        return jsonify({"success": False, "error": f"Página fuera de rango (1-{total_pages})"}), 404
+
+    # Si el navegador ya tiene la imagen que se generaría, se responde 304 sin renderizarla
+    limitada, mimetype = resultado_esperado_vista_previa(formato)
+    etag = etag_vista_previa(filepath, page, limitada, mimetype)
+    if request.if_none_match.contains_weak(etag):
+        respuesta = make_response('', 304)
+    else:
+        datos, mimetype, limitada, mensaje = imagen_vista_previa(filepath, nombre, page, total_pages, formato)
+        respuesta = make_response(datos)
+        respuesta.mimetype = mimetype
+        etag = etag_vista_previa(filepath, page, limitada, mimetype)
+    respuesta.set_etag(etag)
+    respuesta.last_modified = int(os.path.getmtime(filepath))
+    if limitada:
+        # Se puede revalidar, pero no reutilizar sin preguntar: al instalar poppler cambia la imagen
+        respuesta.headers['Cache-Control'] = 'private, no-cache'
+        respuesta.headers['X-Vista-Previa-Limitada'] = '1'
+    else:
+        respuesta.headers['Cache-Control'] = f'private, max-age={PREVIEW_MAX_AGE}'
+    return respuesta.make_conditional(request)
+
 # ========================================
 # RUTAS DE DESCARGA
 # ========================================
@@ -1299,40 +3594,29 @@ def pdf_preview(filename):
 def descargar_html(nombre_factura):
     """Descarga el archivo original con el nombre renombrado o original"""
     from urllib.parse import unquote
-    import re
     
     # Decodificar la URL para manejar caracteres especiales
     nombre_decodificado = unquote(nombre_factura)
     
     # Buscar la factura por su nombre renombrado o nombre original
-    factura = next((f for f in FACTURAS_DATA if 
-                   f.get("archivo_procesado") == nombre_decodificado or 
-                   f.get("nombre") == nombre_decodificado), None)
-    if not factura:
+    fila = buscar_factura(nombre_decodificado)
+    if not fila:
         return f"Factura no encontrada: {nombre_decodificado}", 404
+    factura = fila.to_dict()
     
     # Obtener el archivo original
     archivo_original = factura.get("nombre")
     if not archivo_original:
         return "Archivo original no encontrado", 404
     
-    # Construir la ruta del archivo original
-    ruta_original = os.path.join(app.config['UPLOAD_FOLDER'], archivo_original)
-    if not os.path.exists(ruta_original):
+    # Ruta del archivo original (guardado por contenido o, si es anterior, por nombre)
+    ruta_original = ruta_pdf_factura(fila)
+    if not ruta_original:
         return f"Archivo original no encontrado: {archivo_original}", 404
     
     try:
         # Usar el nombre renombrado como nombre de descarga
-        nombre_descarga = factura.get("archivo_procesado", nombre_decodificado)
-        
-        # Asegurar que tenga extensión .pdf
-        if not nombre_descarga.lower().endswith('.pdf'):
-            nombre_descarga += '.pdf'
-        
-        # Limpiar caracteres problemáticos para el sistema de archivos
-        nombre_descarga = re.sub(r'[<>:"/\\|?*]', '_', nombre_descarga)
-        # Limpiar espacios múltiples
-        nombre_descarga = re.sub(r'\s+', ' ', nombre_descarga)
+        nombre_descarga = nombre_descarga_factura(fila)
         
         print(f"Descargando: {archivo_original} como {nombre_descarga}")
         
@@ -1358,6 +3642,272 @@ def descargar_factura(nombre_factura):
     # Si no existe, devolvemos error
     return "Archivo no encontrado", 404
 
+# ========================================
+# EXPORTACIÓN EN BLOQUE
+# ========================================
+
+# Tamaño de los bloques que se leen de cada PDF y se envían comprimidos
+TAMANO_BLOQUE_ZIP = 256 * 1024
+
+class _SalidaZip:
+    """Destino de zipfile sin seek: guarda lo escrito hasta que el generador lo envía"""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+def _nombre_unico(nombre, usados):
+    """nombre, o 'nombre (2).pdf', 'nombre (3).pdf'... si ya está en el ZIP"""
+    base, extension = os.path.splitext(nombre)
+    candidato, n = nombre, 1
+    while candidato.lower() in usados:
+        n += 1
+        candidato = f"{base} ({n}){extension}"
+    usados.add(candidato.lower())
+    return candidato
+
+def generar_zip_facturas(filas):
+    """Genera por partes un ZIP con el PDF de cada factura, con su nombre renombrado.
+
+    zipfile escribe cada entrada con descriptor de datos al final, así que no necesita
+    volver atrás en el archivo: cada bloque comprimido se envía en cuanto está listo y
+    la memoria usada no depende del número ni del tamaño de las facturas.
+    """
+    salida = _SalidaZip()
+    usados = set()
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for fila in filas:
+            ruta = ruta_pdf_factura(fila)
+            if not ruta:
+                print(f"⚠️ Exportación ZIP: no se encuentra el PDF de {fila.nombre}")
+                continue
+            entrada = zipfile.ZipInfo(_nombre_unico(nombre_descarga_factura(fila), usados),
+                                      date_time=time.localtime(os.path.getmtime(ruta))[:6])
+            with open(ruta, 'rb') as origen:
+                yield from _escribir_entrada_zip(zf, salida, entrada,
+                                                 iter(lambda: origen.read(TAMANO_BLOQUE_ZIP), b''))
+    # Directorio central del ZIP
+    yield salida.vaciar()
+
+def _escribir_entrada_zip(zf, salida, entrada, bloques):
+    """Comprime en zf una entrada con los bloques dados y genera lo que ya se puede enviar"""
+    if isinstance(entrada, zipfile.ZipInfo):
+        entrada.compress_type = zipfile.ZIP_DEFLATED
+    with zf.open(entrada, 'w') as destino:
+        for bloque in bloques:
+            destino.write(bloque)
+            datos = salida.vaciar()
+            if datos:
+                yield datos
+    yield salida.vaciar()
+
+def facturas_a_exportar(valores):
+    """Facturas seleccionadas (parámetro ids, repetible) o, sin selección, todas las que
+    cumplen los filtros y el orden de /api/facturas. Lanza ValueError si no son válidos.
+    """
+    ids = valores.getlist('ids')
+    consulta = parametros_consulta_facturas(valores)
+    return iterar_facturas(consulta['filtros'], consulta['orden'], consulta['descendente'], ids=ids)
+
+@app.route('/exportar/zip', methods=['GET', 'POST'])
+@login_required
+def exportar_zip():
+    """Descarga en un ZIP los PDFs de las facturas seleccionadas o filtradas"""
+    try:
+        filas = facturas_a_exportar(request.values)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    nombre_zip = f"facturas_{datetime.now().strftime('%Y%m%d_%H%M')}.zip"
+    return Response(
+        stream_with_context(generar_zip_facturas(filas)),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="{nombre_zip}"',
+            # Que un proxy (nginx) no retenga la respuesta hasta tenerla entera
+            'X-Accel-Buffering': 'no',
+        }
+    )
+
+# Columnas de la exportación de movimientos contables, en orden
+COLUMNAS_MOVIMIENTOS = ('fecha', 'comunidad', 'cuenta_contable', 'descripcion_cuenta', 'importe',
+                        'periodo', 'movimiento_contable', 'archivo', 'id')
+
+def descripcion_cuenta(cuenta):
+    """Descripción de CUENTAS_CONTABLES del prefijo más largo de la cuenta (62900000 -> 629)"""
+    for largo in range(len(cuenta or ''), 0, -1):
+        descripcion = CUENTAS_CONTABLES.get(cuenta[:largo])
+        if descripcion:
+            return descripcion
+    return None
+
+def importe_numerico(importe):
+    """Importe guardado ('1398,35 EUR') como número, o None si no se detectó"""
+    try:
+        return float((importe or '').split()[0].replace(',', '.'))
+    except (IndexError, ValueError):
+        return None
+
+def movimiento_factura(fila):
+    """Datos de una factura para la exportación de movimientos contables"""
+    return {
+        'fecha': fila.fecha,
+        'comunidad': fila.comunidad,
+        'cuenta_contable': fila.cuenta,
+        'descripcion_cuenta': descripcion_cuenta(fila.cuenta),
+        'importe': importe_numerico(fila.importe),
+        'periodo': fila.periodo,
+        'movimiento_contable': fila.movimiento_contable,
+        'archivo': fila.archivo_procesado,
+        'id': fila.id,
+    }
+
+def generar_csv_movimientos(filas):
+    """CSV separado por ';' con fecha DD/MM/AAAA e importe con coma decimal (Excel en español)"""
+    buffer = StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    # El BOM hace que Excel abra el archivo como UTF-8
+    buffer.write('\ufeff')
+    escritor.writerow(COLUMNAS_MOVIMIENTOS)
+    for fila in filas:
+        movimiento = movimiento_factura(fila)
+        if movimiento['fecha']:
+            movimiento['fecha'] = movimiento['fecha'].strftime('%d/%m/%Y')
+        if movimiento['importe'] is not None:
+            movimiento['importe'] = f"{movimiento['importe']:.2f}".replace('.', ',')
+        escritor.writerow([movimiento[columna] for columna in COLUMNAS_MOVIMIENTOS])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def generar_jsonl_movimientos(filas):
+    """Un objeto JSON por línea, con fecha AAAA-MM-DD e importe numérico"""
+    for fila in filas:
+        movimiento = movimiento_factura(fila)
+        if movimiento['fecha']:
+            movimiento['fecha'] = movimiento['fecha'].isoformat()
+        yield (json.dumps(movimiento, ensure_ascii=False) + "\n").encode('utf-8')
+
+# Partes fijas del XLSX (SpreadsheetML mínimo: un libro con una hoja y tres estilos)
+_XLSX_PARTES = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Movimientos" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>'),
+    # Estilos: 0 normal, 1 fecha, 2 importe con dos decimales, 3 cabecera en negrita
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="4"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'),
+}
+# Caracteres de control que no admite XML (pueden venir del texto de los PDFs)
+_RE_XML_NO_VALIDO = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_EPOCA_EXCEL = date(1899, 12, 30)
+
+def _celda_xlsx(valor, estilo=0):
+    if valor is None or valor == '':
+        return '<c/>'
+    if isinstance(valor, date):
+        return f'<c s="1"><v>{(valor - _EPOCA_EXCEL).days}</v></c>'
+    if isinstance(valor, float):
+        return f'<c s="2"><v>{valor!r}</v></c>'
+    texto = escapar_xml(_RE_XML_NO_VALIDO.sub('', str(valor)))
+    estilo = f' s="{estilo}"' if estilo else ''
+    return f'<c t="inlineStr"{estilo}><is><t xml:space="preserve">{texto}</t></is></c>'
+
+def _filas_hoja_xlsx(filas):
+    yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+           '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+           '<row>' + ''.join(_celda_xlsx(columna, 3) for columna in COLUMNAS_MOVIMIENTOS) + '</row>').encode('utf-8')
+    for fila in filas:
+        movimiento = movimiento_factura(fila)
+        yield ('<row>' + ''.join(_celda_xlsx(movimiento[columna]) for columna in COLUMNAS_MOVIMIENTOS)
+               + '</row>').encode('utf-8')
+    yield b'</sheetData></worksheet>'
+
+def generar_xlsx_movimientos(filas):
+    """Libro XLSX escrito a mano (sin dependencias) y comprimido a medida que se genera.
+
+    Las celdas de texto van en línea (inlineStr), así que la hoja se escribe fila a fila
+    sin tabla de cadenas compartidas que obligue a tenerlo todo en memoria.
+    """
+    salida = _SalidaZip()
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for nombre, contenido in _XLSX_PARTES.items():
+            zf.writestr(nombre, contenido)
+        yield salida.vaciar()
+        yield from _escribir_entrada_zip(zf, salida, 'xl/worksheets/sheet1.xml', _filas_hoja_xlsx(filas))
+    yield salida.vaciar()
+
+# Formato: (tipo MIME, extensión, generador)
+FORMATOS_EXPORTACION = {
+    'csv': ('text/csv; charset=utf-8', 'csv', generar_csv_movimientos),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx', generar_xlsx_movimientos),
+    'jsonl': ('application/x-ndjson', 'jsonl', generar_jsonl_movimientos),
+}
+
+@app.route('/exportar/movimientos', methods=['GET', 'POST'])
+@login_required
+def exportar_movimientos():
+    """Movimientos contables de las facturas seleccionadas o filtradas en CSV, XLSX o JSON Lines"""
+    formato = request.values.get('formato', 'csv')
+    if formato not in FORMATOS_EXPORTACION:
+        return jsonify({"success": False, "error": f"Formato no válido: {formato}. Opciones: {', '.join(FORMATOS_EXPORTACION)}"}), 400
+    try:
+        filas = facturas_a_exportar(request.values)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    mimetype, extension, generador = FORMATOS_EXPORTACION[formato]
+    nombre = f"movimientos_{datetime.now().strftime('%Y%m%d_%H%M')}.{extension}"
+    return Response(
+        stream_with_context(generador(filas)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{nombre}"', 'X-Accel-Buffering': 'no'}
+    )
+
 # ========================================
 # FUNCIONES AUXILIARES Y UTILIDADES
 # ========================================
@@ -1384,24 +3934,50 @@ def generar_nombre_archivo(fecha, proveedor, importe, numero_factura=None):
         return f"{fecha}_factura_{random.randint(1000, 9999)}.pdf"
 
 # ========================================
-# INICIALIZACIÓN
+# ARRANQUE DE LA APLICACIÓN
 # ========================================
 
+_APLICACION_PREPARADA = False
+_ARRANQUE_LOCK = threading.Lock()
+
+def create_app():
+    """Prepara la aplicación para servir peticiones y la devuelve.
+
+    Importar el módulo solo define la aplicación y sus rutas; el trabajo de arranque
+    (cargar el mapeo, crear o poner al día la base de datos y la carpeta de subidas) se
+    hace aquí, una sola vez por proceso. Con "gunicorn --preload 'app:create_app()'" se
+    ejecuta en el proceso maestro y los workers heredan el mapeo ya construido. Las
+    librerías opcionales y las capacidades del sistema se cargan en su primer uso.
+    """
+    global _APLICACION_PREPARADA
+    with _ARRANQUE_LOCK:
+        if _APLICACION_PREPARADA:
+            return app
+        inicio = time.perf_counter()
+        cargar_mapeo_inicial()
+        if PDF_TEXTO_BACKEND != 'pypdf2' and backend_texto_pdf().nombre != PDF_TEXTO_BACKEND:
+            print(f"⚠️ Backend de texto '{PDF_TEXTO_BACKEND}' no disponible, se usa PyPDF2")
+        with app.app_context():
+            try:
+                inicializar_base_datos()
+                recuperar_trabajos_abandonados()
+                print("🚀 Base de datos inicializada correctamente")
+            except Exception as e:
+                print(f"❌ Error al inicializar base de datos: {e}")
+            # Los workers que se creen a partir de este proceso abren sus propias conexiones
+            db.engine.dispose()
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        _APLICACION_PREPARADA = True
+        print(f"✅ Aplicación preparada en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+    return app
+
 if __name__ == '__main__':
-    # Crear las tablas de la base de datos
-    with app.app_context():
-        try:
-            db.create_all()
-            create_default_users()
-            print("🚀 Base de datos inicializada correctamente")
-        except Exception as e:
-            print(f"❌ Error al inicializar base de datos: {e}")
-    
+    create_app()
+
     # Asegurarse que existan las carpetas necesarias
     os.makedirs('templates', exist_ok=True)
     os.makedirs('static/css', exist_ok=True)
     os.makedirs('static/js', exist_ok=True)
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
     # Configuración del servidor
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del arranque de la aplicación, en procesos nuevos para medirlo en frío:
+  - importar app.py
+  - create_app (mapeo, base de datos)
+  - primera petición (login) y primera petición autenticada (dashboard)
+  - primer uso de lo que se carga bajo demanda (capacidades del sistema y PyPDF2)
+
+Cada medida es la mediana de varias repeticiones. Con --guardar se añade el resultado
+a benchmarks/historial_arranque.jsonl (con el commit y la versión de Python) para
+seguir su evolución entre versiones; siempre se compara con la última línea guardada.
+
+Uso: python benchmarks/bench_arranque.py [repeticiones] [num_entradas_mapeo] [--guardar]
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+DIRECTORIO_APP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORIAL = os.path.join(DIRECTORIO_APP, 'benchmarks', 'historial_arranque.jsonl')
+
+sys.path.append(DIRECTORIO_APP)
+
+from corpus import generar_mapeo
+
+# Se ejecuta en un proceso nuevo por repetición e imprime los tiempos en JSON
+MEDICION = r"""
+import json, time
+t0 = time.perf_counter()
+import app as facturas_app
+t1 = time.perf_counter()
+facturas_app.create_app()
+t2 = time.perf_counter()
+cliente = facturas_app.app.test_client()
+cliente.get('/login')
+t3 = time.perf_counter()
+cliente.post('/login', data={'username': 'Dani', 'password': 'DefaultDani123!'})
+cliente.get('/')
+t4 = time.perf_counter()
+facturas_app.capacidades()
+t5 = time.perf_counter()
+facturas_app.dependencia_opcional('pypdf2')
+t6 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'create_app_ms': (t2 - t1) * 1000,
+    'primera_peticion_ms': (t3 - t2) * 1000,
+    'login_dashboard_ms': (t4 - t3) * 1000,
+    'capacidades_ms': (t5 - t4) * 1000,
+    'pypdf2_ms': (t6 - t5) * 1000,
+}))
+"""
+
+
+def escribir_json(ruta, mapeo, direcciones):
+    """Mismo formato que mapeo_sensible.json (claves 'tipo,direccion')"""
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump({
+            'mapeo_cuentas_contables': mapeo,
+            'direcciones_por_tipo': {f"{tipo},{direccion}": v for (tipo, direccion), v in direcciones.items()},
+            'codigos_agua_disponibles': [],
+        }, f, ensure_ascii=False)
+
+
+def medir(entorno):
+    resultado = subprocess.run([sys.executable, '-c', MEDICION], cwd=DIRECTORIO_APP, env=entorno,
+                               capture_output=True, text=True, check=True)
+    return json.loads(resultado.stdout.strip().splitlines()[-1])
+
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIRECTORIO_APP,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ultima_medicion():
+    try:
+        with open(HISTORIAL, encoding='utf-8') as f:
+            lineas = [linea for linea in f if linea.strip()]
+        return json.loads(lineas[-1]) if lineas else None
+    except FileNotFoundError:
+        return None
+
+
+def main():
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    repeticiones = int(argumentos[0]) if argumentos else 5
+    n = int(argumentos[1]) if len(argumentos) > 1 else 5000
+    mapeo, direcciones = generar_mapeo(n)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta_json = os.path.join(tmp, 'mapeo.json')
+        escribir_json(ruta_json, mapeo, direcciones)
+        entorno = dict(os.environ,
+                       DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'arranque.db')}",
+                       MAPEO_CONFIG_PATH=ruta_json,
+                       MAPEO_SNAPSHOT_PATH=os.path.join(tmp, 'mapeo.pkl'),
+                       MAPEO_INTERVALO_RECARGA='0')
+        # La primera vez se crean la base de datos, los usuarios y el snapshot del mapeo
+        medir(entorno)
+        mediciones = [medir(entorno) for _ in range(repeticiones)]
+
+    resultado = {clave: round(statistics.median(m[clave] for m in mediciones), 1) for clave in mediciones[0]}
+    anterior = ultima_medicion()
+    print(f"🧪 ARRANQUE - mediana de {repeticiones} procesos, mapeo de {n} entradas")
+    print("=" * 60)
+    for clave, valor in resultado.items():
+        comparacion = ""
+        if anterior and clave in anterior.get('tiempos', {}):
+            comparacion = f" | última guardada ({anterior['commit']}): {anterior['tiempos'][clave]:7.1f} ms"
+        print(f"  {clave:22s} {valor:7.1f} ms{comparacion}")
+
+    if '--guardar' in sys.argv:
+        with open(HISTORIAL, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'fecha': datetime.now().isoformat(timespec='seconds'),
+                'commit': commit_actual(),
+                'python': platform.python_version(),
+                'repeticiones': repeticiones,
+                'entradas_mapeo': n,
+                'tiempos': resultado,
+            }) + "\n")
+        print(f"💾 Guardado en {os.path.relpath(HISTORIAL, DIRECTORIO_APP)}")
+
+
+if __name__ == "__main__":
+    main()
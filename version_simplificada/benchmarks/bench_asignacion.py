@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la asignación por dirección (DIRECCIONES_POR_TIPO) y por póliza/Cód. Abast.
+con los índices del mapeo frente al recorrido lineal, con mapeos de distintos tamaños.
+
+Uso: python benchmarks/bench_asignacion.py [num_entradas ...]
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as facturas_app
+from corpus import generar_mapeo, generar_textos
+
+
+def direccion_exacta_lineal(direcciones, tipo, direccion):
+    dkey = facturas_app._normalize_dir_key(direccion)
+    for (t, d), datos in direcciones.items():
+        if t == tipo and facturas_app._normalize_dir_key(d) == dkey:
+            return datos
+    return None
+
+
+def direccion_parcial_lineal(direcciones, tipo, direccion):
+    direccion_upper = direccion.upper()
+    for (tipo_map, dir_map), entry in direcciones.items():
+        if tipo_map == tipo and dir_map.upper() in direccion_upper:
+            return entry
+    return None
+
+
+def poliza_lineal(mapeo, poliza, cod_abast):
+    for k, v in mapeo.items():
+        textvals = ' '.join([str(x).upper() for x in (v or {}).values() if x])
+        if (poliza and poliza.upper() in textvals) or (cod_abast and str(cod_abast) in textvals):
+            return k
+    return None
+
+
+def medir(funcion, casos):
+    inicio = time.perf_counter()
+    resultados = [funcion(tipo, direccion) for tipo, direccion in casos]
+    return (time.perf_counter() - inicio) / len(casos) * 1e6, resultados
+
+
+def main():
+    tamanos = [int(n) for n in sys.argv[1:]] or [100, 1000, 10000]
+    print("🧪 ASIGNACIÓN POR DIRECCIÓN")
+    print("=" * 60)
+    for n in tamanos:
+        mapeo, direcciones = generar_mapeo(n)
+        indices = facturas_app.construir_indices_mapeo(mapeo, direcciones)
+        casos = []
+        for texto in generar_textos(200, mapeo=mapeo, lineas_relleno=0):
+            campos = facturas_app.detectar_campos_factura(texto, 'factura.pdf')
+            if campos['direccion']:
+                casos.append((campos['tipo'], campos['direccion']))
+
+        def exacta(tipo, direccion):
+            return indices['direcciones_normalizadas'].get(tipo, {}).get(facturas_app._normalize_dir_key(direccion))
+
+        def parcial(tipo, direccion):
+            indice = indices['direcciones_parciales'].get(tipo)
+            return indice.primera_coincidencia(direccion.upper()) if indice else None
+
+        print(f"  {n} entradas, {len(casos)} direcciones:")
+        for nombre, lineal, indexada in (
+                ('exacta ', lambda t, d: direccion_exacta_lineal(direcciones, t, d), exacta),
+                ('parcial', lambda t, d: direccion_parcial_lineal(direcciones, t, d), parcial)):
+            t_lineal, esperado = medir(lineal, casos)
+            t_indice, obtenido = medir(indexada, casos)
+            print(f"    {nombre} - lineal: {t_lineal:9.1f} µs | índice: {t_indice:6.1f} µs "
+                  f"| {'✅' if esperado == obtenido else '❌'} mismos resultados")
+
+        # Póliza / Cód. Abast.: el índice compara tokens completos, el recorrido lineal
+        # buscaba subcadenas (un Cód. Abast. "123" coincidía con la cuenta "6281123")
+        facturas_app.establecer_mapeo(facturas_app.construir_configuracion_mapeo(mapeo, direcciones))
+        casos_poliza = [(v['poliza'], None) for v in list(mapeo.values())[::7]]
+        casos_poliza += [(None, v['cod_abast']) for v in list(mapeo.values())[::11]]
+        t_lineal, esperado = medir(lambda p, c: poliza_lineal(mapeo, p, c), casos_poliza)
+        t_indice, obtenido = medir(lambda p, c: facturas_app.resolver_poliza_cod_abast(p, c)[0], casos_poliza)
+        iguales = sum(1 for a, b in zip(esperado, obtenido) if a == b)
+        print(f"    póliza  - lineal: {t_lineal:9.1f} µs | índice: {t_indice:6.1f} µs "
+              f"| {iguales}/{len(casos_poliza)} iguales (el resto eran coincidencias por subcadena)")
+
+
+if __name__ == "__main__":
+    main()
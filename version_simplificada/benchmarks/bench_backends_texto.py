@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de los backends de extracción de texto de PDF (PyPDF2, pdftotext...).
+
+Para cada backend disponible mide, sobre el mismo corpus sintético:
+  - rendimiento: PDFs por segundo leyendo todas las páginas
+  - memoria: pico de memoria Python (tracemalloc) y, para los backends que lanzan
+    procesos, el máximo de memoria residente de los procesos hijos
+  - precisión: campos detectados sobre el texto extraído frente a los detectados sobre
+    el texto original con el que se generó cada PDF
+
+Uso: python benchmarks/bench_backends_texto.py [num_pdfs] [lineas_relleno]
+"""
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as facturas_app
+from corpus import escribir_corpus_pdf, generar_mapeo, generar_textos
+
+SEMILLA = 42
+
+
+def medir_backend(backend, archivos):
+    """Devuelve (textos, segundos, pico de memoria Python en bytes)"""
+    inicio = time.perf_counter()
+    textos = ["".join(backend.paginas(ruta)) for ruta, _ in archivos]
+    segundos = time.perf_counter() - inicio
+    # tracemalloc ralentiza mucho: la memoria se mide en una segunda pasada
+    tracemalloc.start()
+    for ruta, _ in archivos:
+        "".join(backend.paginas(ruta))
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return textos, segundos, pico
+
+
+def comparar_campos(esperados, obtenidos):
+    """Aciertos por campo y número de documentos con todos los campos iguales"""
+    aciertos = {campo: 0 for campo in esperados[0]}
+    completos = 0
+    for esperado, obtenido in zip(esperados, obtenidos):
+        iguales = [campo for campo in esperado if esperado[campo] == obtenido[campo]]
+        for campo in iguales:
+            aciertos[campo] += 1
+        completos += len(iguales) == len(esperado)
+    return aciertos, completos
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    lineas_relleno = int(sys.argv[2]) if len(sys.argv) > 2 else 80
+    mapeo, direcciones = generar_mapeo()
+    facturas_app.establecer_mapeo(facturas_app.construir_configuracion_mapeo(mapeo, direcciones))
+
+    textos_originales = generar_textos(n, SEMILLA, mapeo, lineas_relleno)
+    with tempfile.TemporaryDirectory() as tmp:
+        archivos = escribir_corpus_pdf(tmp, n=n, semilla=SEMILLA, mapeo=mapeo, lineas_relleno=lineas_relleno)
+        esperados = [facturas_app.detectar_campos_factura(texto, nombre)
+                     for texto, (_, nombre) in zip(textos_originales, archivos)]
+        mb_corpus = sum(os.path.getsize(ruta) for ruta, _ in archivos) / 1e6
+
+        print(f"🧪 BACKENDS DE TEXTO - {n} PDFs ({mb_corpus:.1f} MB), todas las páginas")
+        print("=" * 72)
+        for nombre, backend in facturas_app.BACKENDS_TEXTO_PDF.items():
+            if not backend.disponible():
+                print(f"  {nombre:10s} ⏭️  no disponible en este sistema")
+                continue
+
+            hijos_antes = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            textos, segundos, pico = medir_backend(backend, archivos)
+            hijos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            obtenidos = [facturas_app.detectar_campos_factura(texto, nombre_pdf)
+                         for texto, (_, nombre_pdf) in zip(textos, archivos)]
+            aciertos, completos = comparar_campos(esperados, obtenidos)
+
+            memoria_hijos = f" | hijos: {hijos / 1024:.0f} MB" if hijos > hijos_antes else ""
+            print(f"  {nombre:10s} {n / segundos:8.1f} PDFs/s | {segundos / n * 1000:7.2f} ms/PDF "
+                  f"| memoria Python: {pico / 1e6:6.1f} MB{memoria_hijos}")
+            print(f"  {'':10s} todos los campos iguales: {completos}/{n} ({completos / n:.0%})")
+            fallos = {campo: n - a for campo, a in aciertos.items() if a < n}
+            if fallos:
+                print(f"  {'':10s} campos distintos: " + ", ".join(f"{c} {f}" for c, f in fallos.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la búsqueda de facturas por id, nombre y nombre renombrado (la que hacen
+copiar_movimiento, toggle_procesado y descargar_html) frente al recorrido lineal de la
+antigua lista FACTURAS_DATA, con distintos tamaños de la tabla.
+
+Usa una base de datos temporal. Uso: python benchmarks/bench_busqueda_facturas.py [max_facturas]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+_DIR_TEMPORAL = tempfile.mkdtemp(prefix='bench_facturas_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DIR_TEMPORAL, 'facturas.db')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as facturas_app
+
+CONSULTAS = 2000
+
+
+def generar_facturas(desde, hasta):
+    facturas = []
+    for i in range(desde, hasta):
+        nombre = f"factura_{i:06d}.pdf"
+        facturas.append({
+            'id': nombre,
+            'nombre': nombre,
+            'archivo_procesado': f"Luz CALLE PRUEBA {i} 01-01-2024 {i % 997},{i % 100:02d}EUR",
+            'fecha': '01/01/2024',
+            'tipo': 'Luz',
+            'importe': '10,00 EUR',
+            'estado': 'success',
+            'comunidad': f"CALLE PRUEBA {i % 500}",
+            'cuenta': '62800000',
+            'procesado': False,
+            'movimiento_contable': f"Luz CALLE PRUEBA {i}",
+        })
+    return facturas
+
+
+def buscar_lineal(facturas, clave):
+    return next((f for f in facturas if f['id'] == clave or f['nombre'] == clave
+                 or f['archivo_procesado'] == clave), None)
+
+
+def medir(funcion, claves):
+    inicio = time.perf_counter()
+    for clave in claves:
+        assert funcion(clave) is not None
+    return (time.perf_counter() - inicio) / len(claves) * 1e6
+
+
+def main():
+    maximo = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    tamanos = [t for t in (1000, 10000, maximo) if t <= maximo]
+    rnd = random.Random(3)
+
+    print(f"🧪 BÚSQUEDA DE FACTURAS - {CONSULTAS} consultas por tamaño")
+    print("=" * 72)
+    with facturas_app.app.app_context():
+        facturas_app.db.create_all()
+        facturas = []
+        for tamano in tamanos:
+            nuevas = generar_facturas(len(facturas), tamano)
+            facturas_app.db.session.add_all(facturas_app.Factura.desde_dict(f) for f in nuevas)
+            facturas_app.db.session.commit()
+            facturas.extend(nuevas)
+
+            # Mezcla de claves: id, nombre original y nombre renombrado
+            muestra = [rnd.choice(facturas) for _ in range(CONSULTAS)]
+            claves = [f[rnd.choice(('id', 'nombre', 'archivo_procesado'))] for f in muestra]
+
+            facturas_app.db.session.expunge_all()
+            t_tabla = medir(facturas_app.buscar_factura, claves)
+            t_lineal = medir(lambda c: buscar_lineal(facturas, c), claves[:200])
+            print(f"  {tamano:6d} facturas - lineal: {t_lineal:9.1f} µs | tabla indexada: {t_tabla:6.1f} µs "
+                  f"| {t_lineal / t_tabla:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
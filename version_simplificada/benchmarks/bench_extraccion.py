@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Comprueba el motor de extracción contra el corpus de referencia (golden_extraccion.json)
+y mide el tiempo por documento frente a los extractores anteriores (extractores_base.py,
+una copia del código de antes de precompilar los patrones, que también se comprueba
+contra el corpus).
+
+Uso: python benchmarks/bench_extraccion.py [repeticiones]
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as facturas_app
+import extractores_base
+from corpus import generar_corpus_golden, generar_mapeo
+
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden_extraccion.json')
+
+
+def comprobar_golden(textos):
+    with open(GOLDEN, encoding='utf-8') as f:
+        golden = json.load(f)
+    sha = hashlib.sha256('\x00'.join(textos).encode()).hexdigest()
+    if sha != golden['corpus_sha256']:
+        print("❌ El corpus generado no coincide con el de golden_extraccion.json")
+        return False
+    errores = 0
+    for i, (texto, esperado) in enumerate(zip(textos, golden['esperado'])):
+        filename = f'factura_{i:04d}.pdf'
+        for nombre, obtenido in (('motor', facturas_app.detectar_campos_factura(texto, filename)),
+                                 ('anterior', extractores_base.detectar_campos_factura(texto, filename))):
+            obtenido = dict(obtenido)
+            obtenido['asignacion'] = list(facturas_app.asignar_cuenta_contable_con_tipos(
+                obtenido['cups'], obtenido['direccion'], obtenido['tipo']))
+            if obtenido != esperado:
+                errores += 1
+                diferencias = {k: (esperado.get(k), obtenido.get(k)) for k in esperado if esperado.get(k) != obtenido.get(k)}
+                print(f"  ❌ Documento {i} ({nombre}): {diferencias}")
+    print(f"  {'✅' if not errores else '❌'} {len(textos)} documentos comparados, {errores} diferencias")
+    return errores == 0
+
+
+def medir(funcion, textos, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for i, texto in enumerate(textos):
+            funcion(texto, f'factura_{i:04d}.pdf')
+    return (time.perf_counter() - inicio) / (repeticiones * len(textos)) * 1e6
+
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    mapeo, direcciones = generar_mapeo()
+    facturas_app.establecer_mapeo(facturas_app.construir_configuracion_mapeo(mapeo, direcciones))
+    extractores_base.MAPEO_CUENTAS_CONTABLES = facturas_app.MAPEO_CUENTAS_CONTABLES
+    textos = generar_corpus_golden()
+
+    print("🧪 MOTOR DE EXTRACCIÓN")
+    print("=" * 60)
+    correcto = comprobar_golden(textos)
+
+    t_anterior = medir(extractores_base.detectar_campos_factura, textos, repeticiones)
+    t_motor = medir(facturas_app.detectar_campos_factura, textos, repeticiones)
+    print(f"  Extractores anteriores: {t_anterior:.1f} µs/documento")
+    print(f"  Motor (una normalización): {t_motor:.1f} µs/documento")
+    print(f"  Speedup: {t_anterior / t_motor:.2f}x")
+    sys.exit(0 if correcto else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del índice Aho-Corasick del mapeo frente al recorrido lineal de claves y
+direcciones de referencia (pasos 4 de detectar_cups_o_contador y 3 de detectar_direccion).
+
+Uso: python benchmarks/bench_indice_mapeo.py [num_entradas]
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as facturas_app
+from corpus import generar_mapeo, generar_textos
+
+
+def clave_lineal(mapeo, texto):
+    for k in mapeo.keys():
+        if k.upper() in texto.upper():
+            return k
+    return None
+
+
+def direccion_lineal(mapeo, texto):
+    for v in mapeo.values():
+        dirref = v.get('direccion_referencia', '')
+        if dirref and dirref.upper() in texto.upper():
+            return dirref
+    return None
+
+
+def medir(funcion, textos):
+    inicio = time.perf_counter()
+    resultados = [funcion(t) for t in textos]
+    return (time.perf_counter() - inicio) / len(textos) * 1000, resultados
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    mapeo, direcciones = generar_mapeo(n)
+    textos = generar_textos(100, mapeo=mapeo, lineas_relleno=40)
+
+    print(f"🧪 ÍNDICE DE MAPEO - {n} entradas, {len(textos)} facturas")
+    print("=" * 60)
+    inicio = time.perf_counter()
+    indices = facturas_app.construir_indices_mapeo(mapeo, direcciones)
+    print(f"  Construcción de índices: {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+    t_lineal, esperado = medir(lambda t: clave_lineal(mapeo, t), textos)
+    t_indice, obtenido = medir(lambda t: indices['claves'].primera_coincidencia(t.upper()), textos)
+    print(f"  Claves      - lineal: {t_lineal:8.2f} ms/factura | índice: {t_indice:6.3f} ms/factura "
+          f"| {t_lineal / t_indice:6.0f}x | {'✅' if esperado == obtenido else '❌'} mismos resultados")
+
+    t_lineal, esperado = medir(lambda t: direccion_lineal(mapeo, t), textos)
+    t_indice, obtenido = medir(
+        lambda t: (indices['direcciones_referencia'].primera_coincidencia(t.upper()) or (None,))[0], textos)
+    print(f"  Direcciones - lineal: {t_lineal:8.2f} ms/factura | índice: {t_indice:6.3f} ms/factura "
+          f"| {t_lineal / t_indice:6.0f}x | {'✅' if esperado == obtenido else '❌'} mismos resultados")
+
+
+if __name__ == "__main__":
+    main()
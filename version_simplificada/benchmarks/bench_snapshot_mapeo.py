@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del arranque del mapeo: leer el JSON y construir los índices frente a cargar
+el snapshot precompilado (MAPEO_SNAPSHOT_PATH).
+
+Uso: python benchmarks/bench_snapshot_mapeo.py [num_entradas]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as facturas_app
+from corpus import generar_mapeo, generar_textos
+
+
+def escribir_json(ruta, mapeo, direcciones):
+    """Mismo formato que mapeo_sensible.json (claves 'tipo,direccion')"""
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump({
+            'mapeo_cuentas_contables': mapeo,
+            'direcciones_por_tipo': {f"{tipo},{direccion}": v for (tipo, direccion), v in direcciones.items()},
+            'codigos_agua_disponibles': [],
+        }, f, ensure_ascii=False)
+
+
+def medir_carga(ruta_json, ruta_snapshot):
+    inicio = time.perf_counter()
+    config = facturas_app.leer_mapeo_json(ruta_json, ruta_snapshot)
+    return (time.perf_counter() - inicio) * 1000, config
+
+
+def asignaciones(config, campos):
+    facturas_app.establecer_mapeo(config)
+    return [facturas_app.asignar_comunidad_cuenta(c) for c in campos]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    mapeo, direcciones = generar_mapeo(n)
+    textos = generar_textos(200, mapeo=mapeo, lineas_relleno=5)
+    campos = [facturas_app.detectar_campos_factura(t, 'factura.pdf') for t in textos]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta_json = os.path.join(tmp, 'mapeo.json')
+        ruta_snapshot = os.path.join(tmp, 'mapeo.pkl')
+        escribir_json(ruta_json, mapeo, direcciones)
+
+        print(f"🧪 SNAPSHOT DEL MAPEO - {n} entradas")
+        print("=" * 60)
+        t_json, config_json = medir_carga(ruta_json, ruta_snapshot)
+        t_snapshot, config_snapshot = medir_carga(ruta_json, ruta_snapshot)
+        print(f"  JSON + índices (y guardar snapshot): {t_json:8.1f} ms "
+              f"({os.path.getsize(ruta_json) / 1e6:.1f} MB de JSON)")
+        print(f"  Snapshot:                            {t_snapshot:8.1f} ms "
+              f"({os.path.getsize(ruta_snapshot) / 1e6:.1f} MB) | {t_json / t_snapshot:.1f}x")
+
+        iguales = (config_json['HUELLA_MAPEO'] == config_snapshot['HUELLA_MAPEO']
+                   and asignaciones(config_json, campos) == asignaciones(config_snapshot, campos))
+        print(f"  {'✅' if iguales else '❌'} mismas asignaciones con ambas configuraciones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Corpus sintético de facturas para benchmarks y comprobaciones de regresión.
+
+Genera textos de factura deterministas (misma semilla -> mismo corpus) y PDFs
+de texto mínimos sin depender de librerías externas.
+"""
+import os
+import random
+
+CALLES = ['RONDA BUENAVISTA', 'AVDA EUROPA', 'CALLE ALFARES', 'PASEO ROSA', 'CALLE TORNERIAS',
+          'AVDA BARBER', 'CALLE RETAMAR', 'PLAZA MAYOR', 'CALLE REYES CATOLICOS', 'AVDA PURISIMA']
+MESES = ['ENE', 'FEB', 'MAR', 'ABR', 'MAY', 'JUN', 'JUL', 'AGO', 'SEP', 'OCT', 'NOV', 'DIC']
+RELLENO = [
+    'Consulte las condiciones generales de su contrato en la web del comercializador.',
+    'El importe de esta factura se cargará en la cuenta bancaria indicada en el contrato.',
+    'Puede presentar reclamaciones ante el servicio de atención al cliente.',
+    'Información sobre el origen del suministro y su impacto ambiental.',
+    'Impuestos aplicables y alquiler de equipos de medida.',
+    'Los datos de consumo se han obtenido mediante lectura real del contador.',
+]
+
+
+def _importe(rnd):
+    entero = rnd.randint(5, 2400)
+    decimales = rnd.randint(0, 99)
+    if entero >= 1000:
+        return f"{entero // 1000}.{entero % 1000:03d},{decimales:02d}"
+    return f"{entero},{decimales:02d}"
+
+
+def _fecha(rnd):
+    return f"{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/{rnd.randint(2023, 2025)}"
+
+
+def generar_mapeo(n=50, semilla=7):
+    """Genera un mapeo sintético con el mismo formato que mapeo_sensible.json"""
+    rnd = random.Random(semilla)
+    mapeo = {}
+    direcciones = {}
+    for i in range(n):
+        calle = CALLES[i % len(CALLES)]
+        numero = 1 + i // len(CALLES)
+        direccion = f"{calle} {numero}"
+        cuenta = f"628{1000 + i}"
+        comunidad = f"{calle.split(' ', 1)[-1]} {numero}"
+        if i % 2 == 0:
+            clave = f"ES0021{rnd.randint(10**13, 10**14 - 1)}AB"
+        else:
+            clave = f"{rnd.choice('DQ')}{rnd.randint(10, 99)}NA{rnd.randint(100000, 999999)}"
+        mapeo[clave] = {
+            'comunidad': comunidad,
+            'cuenta': cuenta,
+            'direccion_referencia': direccion,
+            'poliza': str(rnd.randint(10000, 99999)),
+            'cod_abast': str(rnd.randint(100, 999)),
+        }
+        tipo = 'Luz' if i % 2 == 0 else 'Agua'
+        direcciones[(tipo, direccion)] = {'comunidad': comunidad, 'cuenta': cuenta}
+    return mapeo, direcciones
+
+
+def generar_texto_factura(rnd, mapeo=None, lineas_relleno=40):
+    """Devuelve el texto de una factura sintética de luz, agua o limpieza"""
+    entradas = list((mapeo or {}).items())
+    clave, entrada = rnd.choice(entradas) if entradas and rnd.random() < 0.7 else (None, None)
+    calle = entrada['direccion_referencia'] if entrada else f"{rnd.choice(CALLES)} {rnd.randint(1, 40)}"
+    tipo = rnd.choice(['luz', 'agua', 'limpieza'])
+    mes = rnd.randrange(len(MESES))
+    lineas = []
+    if tipo == 'luz':
+        lineas += [
+            'IBERDROLA CLIENTES S.A.U. - Factura de electricidad',
+            f"Fecha emisión: {_fecha(rnd)}",
+            f"CUPS: {clave if clave and clave.startswith('ES') else 'ES0021' + str(rnd.randint(10**13, 10**14 - 1)) + 'DB'}",
+            f"Dirección de suministro: {calle}, TOLEDO, Toledo, 45005",
+            f"Nombre/Razón social: COM PROP {calle}",
+            f"Periodo de Medida: {_fecha(rnd)} - {_fecha(rnd)}",
+        ]
+    elif tipo == 'agua':
+        lineas += [
+            'AQUALIA - Gestión integral del agua',
+            f"Fecha factura: {_fecha(rnd)}",
+            f"Dir. Suministro: COM PROP {calle} - TOLEDO 45004",
+            f"C. Abast: {entrada['cod_abast'] if entrada else rnd.randint(100, 999)}",
+            f"{rnd.choice(['Póliza', 'POLIZA', 'P. '])}: {entrada['poliza'] if entrada else rnd.randint(10000, 99999)}",
+            f"Contador: {clave if clave and not clave.startswith('ES') else 'D09NA' + str(rnd.randint(100000, 999999))}",
+            f"Periodo Facturado: {MESES[mes]}-{MESES[(mes + 1) % 12]} 2024",
+        ]
+    else:
+        lineas += [
+            'LIMPIEZAS DEL TAJO S.L. - Servicio de mantenimiento',
+            f"Fecha: {_fecha(rnd)}",
+            f"Referencia: {rnd.randint(10**8, 10**9)}",
+            f"{calle} TOLEDO",
+        ]
+    for _ in range(lineas_relleno):
+        lineas.append(rnd.choice(RELLENO) + f" {rnd.randint(1, 999)},{rnd.randint(10, 99)} €")
+    lineas.append(f"TOTAL: {_importe(rnd)} €")
+    return "\n".join(lineas)
+
+
+def generar_textos(n=200, semilla=42, mapeo=None, lineas_relleno=40):
+    """Genera n textos de factura deterministas"""
+    rnd = random.Random(semilla)
+    return [generar_texto_factura(rnd, mapeo, lineas_relleno) for _ in range(n)]
+
+
+def _escapar_pdf(linea):
+    datos = linea.encode('cp1252', errors='replace')
+    return datos.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def generar_pdf(texto, lineas_por_pagina=45):
+    """Construye un PDF de texto mínimo (Helvetica, WinAnsiEncoding) y devuelve sus bytes"""
+    lineas = texto.split('\n')
+    paginas = [lineas[i:i + lineas_por_pagina] for i in range(0, len(lineas), lineas_por_pagina)] or [[]]
+    objetos = []
+
+    def agregar(contenido):
+        objetos.append(contenido)
+        return len(objetos)
+
+    catalogo = agregar(None)
+    raiz_paginas = agregar(None)
+    fuente = agregar(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    hijos = []
+    for pagina in paginas:
+        flujo = b"BT /F1 9 Tf 40 800 Td 12 TL\n"
+        flujo += b"".join(b"(" + _escapar_pdf(l) + b") '\n" for l in pagina)
+        flujo += b"ET"
+        contenido = agregar(b"<< /Length %d >>\nstream\n" % len(flujo) + flujo + b"\nendstream")
+        hijos.append(agregar(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (raiz_paginas, fuente, contenido)))
+    objetos[catalogo - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % raiz_paginas
+    objetos[raiz_paginas - 1] = (b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % h for h in hijos)
+                                 + b"] /Count %d >>" % len(hijos))
+
+    salida = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, obj in enumerate(objetos, 1):
+        offsets.append(len(salida))
+        salida += b"%d 0 obj\n" % num + obj + b"\nendobj\n"
+    inicio_xref = len(salida)
+    salida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    salida += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    salida += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, catalogo, inicio_xref)
+    return bytes(salida)
+
+
+def escribir_corpus_pdf(directorio, n=100, semilla=42, mapeo=None, lineas_relleno=80):
+    """Escribe n PDFs sintéticos en el directorio y devuelve la lista de (ruta, nombre)"""
+    os.makedirs(directorio, exist_ok=True)
+    archivos = []
+    for i, texto in enumerate(generar_textos(n, semilla, mapeo, lineas_relleno)):
+        nombre = f"factura_{i:04d}.pdf"
+        ruta = os.path.join(directorio, nombre)
+        with open(ruta, 'wb') as f:
+            f.write(generar_pdf(texto))
+        archivos.append((ruta, nombre))
+    return archivos
+
+
+# Casos escritos a mano que el generador no cubre (texto vacío, minúsculas, formatos raros)
+CASOS_ESPECIALES = [
+    "",
+    """
+    DATOS DEL TITULAR DEL CONTRATO
+    CUPS: ES0021000007566411DB
+    Potencia contratada: 1,5 15,0 kW
+    Dirección de suministro: BUENAVISTA 22 1 BAJ O A, TOLEDO, Toledo, 45005
+
+    DIRECCIÓN POSTAL DE ENVÍO
+    Nombre/Razón social: COPROPIETARIOS RONDA BUENAVISTA 22
+    """,
+    "recibo agua\ndir suministro: calle mayor 3 / toledo\ncod abast. 12\npoliza 0099\ntotal a facturar 1.234,56",
+    "Factura nº 123 de fecha 01-02-2024\nContador: D09NA077422\nimporte 45.10\nDIC 2024 - ENE 2025",
+    "Servicio de limpieza y mantenimiento\nReferencia: AB12345678\nAVDA. EUROPA 12 bajo, TOLEDO\n99,99 € 1.099,00 €",
+    "Electricidad\nContrato: XYZ98765432\nPERIODO DE MEDIDA: 01/01/2024 - 31/01/2024\nCL. REAL 5",
+]
+
+
+def generar_corpus_golden(n=200, semilla=42):
+    """Textos del corpus de referencia: casos especiales + n facturas sintéticas"""
+    mapeo, _ = generar_mapeo()
+    return CASOS_ESPECIALES + generar_textos(n, semilla, mapeo, lineas_relleno=10)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Copia de los extractores detectar_* tal como estaban antes de precompilar los patrones
+y normalizar el texto una sola vez (cada llamada compila o busca en la caché de `re`
+sus expresiones y pasa el texto a mayúsculas por su cuenta).
+
+Solo sirve de referencia para bench_extraccion.py: sus resultados son los que recoge
+golden_extraccion.json, así que el benchmark compara el motor actual con el código
+anterior y no consigo mismo. No modificar.
+"""
+import re
+
+# Lo asigna el benchmark: el mismo mapeo que se instala en la aplicación
+MAPEO_CUENTAS_CONTABLES = {}
+
+
+def detectar_tipo_gasto(texto, filename=None):
+    t = (texto or '')
+    if filename:
+        t += ' ' + filename
+    t = t.lower()
+    if any(x in t for x in ['aqualia', 'agua']):
+        return 'Agua'
+    if any(x in t for x in ['electric', 'eléctr', 'eléctrico', 'energ', 'luz']):
+        return 'Luz'
+    if any(x in t for x in ['limpi', 'manten']):
+        return 'Limpieza'
+    return 'Otros'
+
+
+def detectar_cups_o_contador(texto):
+    """Detecta CUPS o contador en el texto"""
+    if not texto:
+        return None
+    
+    # 1. Buscar CUPS estándar (ES + 16-20 caracteres)
+    m = re.search(r'(ES[0-9A-Z]{16,20})', texto, re.IGNORECASE)
+    if m:
+        return m.group(1).upper()
+    
+    # 2. Buscar códigos numéricos específicos de facturas
+    # Patrones para códigos de 10 dígitos como 0039889075, 0016633368, etc.
+    m_codigo = re.search(r'\b(0\d{9})\b', texto)
+    if m_codigo:
+        return m_codigo.group(1)
+    
+    # 3. Buscar códigos sin cero inicial pero de 9-10 dígitos
+    m_codigo2 = re.search(r'\b(\d{9,10})\b', texto)
+    if m_codigo2:
+        codigo = m_codigo2.group(1)
+        # Verificar si está en nuestro mapeo
+        if codigo in MAPEO_CUENTAS_CONTABLES:
+            return codigo
+    
+    # 4. Buscar claves específicas en los mappings secretos
+    for k in MAPEO_CUENTAS_CONTABLES.keys():
+        if k.upper() in texto.upper():
+            return k
+    
+    # 5. Buscar en patrones específicos de facturas de luz
+    # Buscar después de "CUPS:" o "Código CUPS:"
+    m_cups = re.search(r'CUPS[:\s]*([A-Z0-9]{10,20})', texto.upper())
+    if m_cups:
+        return m_cups.group(1)
+    
+    # 6. Buscar números de contrato o referencia
+    m_contrato = re.search(r'(?:CONTRATO|REFERENCIA)[:\s]*([A-Z0-9]{8,15})', texto.upper())
+    if m_contrato:
+        return m_contrato.group(1)
+    
+    return None
+
+
+def detectar_direccion(texto):
+    if not texto:
+        return None
+    
+    # 1. Buscar "Dirección de suministro:" (para facturas de luz)
+    m_dir_suministro = re.search(r'Direcci[óo]n\s+de\s+suministro[:\s]*([^,\n\r]+)', texto, re.IGNORECASE)
+    if m_dir_suministro:
+        direccion = m_dir_suministro.group(1).strip()
+        # Limpiar la dirección
+        direccion = re.sub(r'\s+', ' ', direccion)
+        # Remover ciudad y código postal del final
+        direccion = re.sub(r',?\s*TOLEDO.*$', '', direccion, flags=re.IGNORECASE)
+        direccion = re.sub(r',?\s*\d{5}.*$', '', direccion)
+        # Arreglar espacios raros como "BAJ O A" -> "BAJO A"
+        direccion = re.sub(r'BAJ\s+O\s+A', 'BAJO A', direccion, flags=re.IGNORECASE)
+        direccion = re.sub(r'BAJ\s+O\s+B', 'BAJO B', direccion, flags=re.IGNORECASE)
+        direccion = re.sub(r'BAJ\s+O', 'BAJO', direccion, flags=re.IGNORECASE)
+        return direccion.strip()
+    
+    # 2. Buscar "Dir. Suministro:" (formato corto)
+    m_suministro = re.search(r'Dir\.?\s*Suministro[:\s]*([^,\-/\n\r]+)', texto, re.IGNORECASE)
+    if m_suministro:
+        direccion = m_suministro.group(1).strip()
+        # Limpiar la dirección y quitar espacios extra
+        direccion = re.sub(r'\s+', ' ', direccion)
+        return direccion
+    
+    # 3. Buscar direcciones genéricas en mappings primero
+    for v in MAPEO_CUENTAS_CONTABLES.values():
+        dirref = v.get('direccion_referencia', '')
+        if dirref and dirref.upper() in texto.upper():
+            return dirref
+    
+    # Buscar patrones genéricos de direcciones
+    m_avda = re.search(r'AVDA\.?\s*[A-Z]+\s*\d+[^,\-/\n\r]*', texto, re.IGNORECASE)
+    if m_avda:
+        direccion = m_avda.group(0).strip()
+        # Quitar caracteres al final que puedan ser problemáticos
+        direccion = re.sub(r'[,\-/\s]+$', '', direccion)
+        return direccion
+    
+    # Buscar variantes genéricas
+    tex = texto.upper()
+    # Buscar cualquier patrón de calle + número
+    m = re.search(r'[A-Z]+\s*\d+[^,\-/\n\r]*', tex)
+    if m:
+        direccion = m.group(0).strip()
+        direccion = re.sub(r'[,\-/\s]+$', '', direccion)
+        return direccion
+    
+    # fallback genérico
+    m2 = re.search(r'CL(?:ALE )?\.?\s*[A-Z0-9\s]+\d+[^,\-/\n\r]*', tex)
+    if m2:
+        direccion = m2.group(0).strip()
+        direccion = re.sub(r'[,\-/\s]+$', '', direccion)
+        return direccion
+    return None
+
+
+def detectar_importe_total(texto):
+    if not texto:
+        return None
+
+    def parse_numero(s):
+        s = s.strip()
+        # si tiene punto y coma europeos: punto = miles, coma = decimales
+        if ',' in s and '.' in s:
+            s = s.replace('.', '').replace(',', '.')
+        elif ',' in s and not '.' in s:
+            s = s.replace(',', '.')
+        try:
+            return float(s)
+        except Exception:
+            return None
+
+    texto_u = texto.upper()
+    patrones = [
+        r'TOTAL[:\s]*([0-9]{1,3}(?:[\.,]\d{3})*[\.,]\d{2})',
+        r'TOTAL A FACTURAR[:\s]*([0-9]{1,3}(?:[\.,]\d{3})*[\.,]\d{2})'
+    ]
+    for patron in patrones:
+        m = re.search(patron, texto_u)
+        if m:
+            val = parse_numero(m.group(1))
+            if val:
+                return val
+    
+    matches = re.findall(r'([0-9]{1,3}(?:[\.,]\d{3})*[\.,]\d{2})\s*€', texto)
+    vals = [parse_numero(s) for s in matches if parse_numero(s) is not None]
+    if vals:
+        return max(vals)
+    
+    m2 = re.search(r'(\d+[\.,]\d{2})', texto)
+    if m2:
+        val = parse_numero(m2.group(1))
+        if val:
+            return val
+    return None
+
+
+def detectar_fecha_factura(texto):
+    """Detecta la fecha de emisión de la factura del PDF"""
+    if not texto:
+        return None
+    
+    # Buscar "Fecha emisión:", "Fecha factura:", etc.
+    patrones_fecha = [
+        r'FECHA\s*(?:DE\s*)?(?:EMISI[OÓ]N|FACTURA)[:\s]*(\d{1,2}[\/\-.]\d{1,2}[\/\-.]\d{2,4})',
+        r'(?:EMITIDO|EMISIÓN)[:\s]*(\d{1,2}[\/\-.]\d{1,2}[\/\-.]\d{2,4})',
+        r'FACTURA\s*(?:N[º°]?[:\s]*\d+\s*)?(?:DE\s*)?FECHA[:\s]*(\d{1,2}[\/\-.]\d{1,2}[\/\-.]\d{2,4})',
+        r'(\d{1,2}[\/\-.]\d{1,2}[\/\-.]\d{4})'
+    ]
+    
+    texto_u = texto.upper()
+    for patron in patrones_fecha:
+        m = re.search(patron, texto_u)
+        if m:
+            return m.group(1)
+    
+    return None
+
+
+def detectar_periodo_facturacion(texto):
+    if not texto:
+        return None
+    texto_u = texto.upper()
+    
+    # 1. Buscar "Periodo de Medida:" específico para facturas de luz
+    m_medida = re.search(r'PERIODO\s*DE\s*MEDIDA\s*:\s*(.*?)(?:\n|$)', texto_u)
+    if m_medida:
+        periodo_texto = m_medida.group(1).strip()
+        # Limpiar texto extra pero mantener fechas completas
+        periodo_limpio = re.sub(r'\s+', ' ', periodo_texto)
+        return periodo_limpio
+    
+    # 2. Buscar "Periodo Facturado:" seguido del periodo
+    m_facturado = re.search(r'PERIODO\s*FACTURADO[:\s]*((?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)[^0-9]*\d{4}(?:\s*[-–—]\s*(?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)[^0-9]*\d{4})?)', texto_u)
+    if m_facturado:
+        return m_facturado.group(1)
+    
+    # 3. Buscar formatos como "FEB-MAR 2024" o "DIC 2024 - ENE 2025"
+    m_meses = re.search(r'((?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)\s*(?:[-–—]\s*)?(?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)?\s*\d{4}(?:\s*[-–—]\s*(?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)?\s*\d{4})?)', texto_u)
+    if m_meses:
+        return m_meses.group(1)
+    
+    return None
+
+
+def detectar_poliza_y_cod_abast(texto):
+    """Busca Cód. Abast. y Póliza en el texto. Devuelve (cod_abast, poliza) o (None, None)."""
+    if not texto:
+        return (None, None)
+    texto_u = texto.upper()
+    cod = None
+    pol = None
+    m_cod = re.search(r'C\.?\s*ABAST[:\.]?\s*(\d{1,6})', texto_u)
+    if not m_cod:
+        m_cod = re.search(r'COD\s*ABAST[:\.]?\s*(\d{1,6})', texto_u)
+    if m_cod:
+        cod = m_cod.group(1)
+
+    m_pol = re.search(r'P\.?OLI?Z?A?[:\.]?\s*(\d{1,10})', texto_u)
+    if not m_pol:
+        m_pol = re.search(r'POLIZA[:\.]?\s*(\d{1,10})', texto_u)
+    if m_pol:
+        pol = m_pol.group(1)
+
+    return (cod, pol)
+
+
+def detectar_contador(texto):
+    """Busca un identificador de contador del estilo D09NA077422 u otros alfanuméricos."""
+    if not texto:
+        return None
+    
+    # Buscar patrón específico: "Contador: XXXXXXXXX"
+    m = re.search(r'Contador:\s*([A-Z0-9\-]{5,30})', texto)
+    if m:
+        return m.group(1)
+    
+    # Buscar la palabra 'CONTADOR' seguida de un token (mayúsculas)
+    m2 = re.search(r'CONTADOR[:\s]*([A-Z0-9\-]{5,30})', texto.upper())
+    if m2:
+        return m2.group(1)
+    
+    # fallback: buscar tokens que parecieran número de contador (letras+digitos)
+    m3 = re.search(r'([A-Z]{1,3}[0-9A-Z]{6,20})', texto.upper())
+    if m3:
+        return m3.group(1)
+    return None
+
+
+def detectar_comunidad_factura(texto, tipo_gasto):
+    """Detecta la comunidad según el tipo de factura"""
+    if not texto:
+        return None
+    
+    # Para facturas de agua: buscar después de "Dir. Suministro:"
+    if tipo_gasto and tipo_gasto.lower() == 'agua':
+        m_dir_suministro = re.search(r'Dir\.?\s*Suministro[:\s]*([^\n\r]+)', texto, re.IGNORECASE)
+        if m_dir_suministro:
+            comunidad = m_dir_suministro.group(1).strip()
+            
+            # Tratamiento especial para agua: limpiar más agresivamente
+            # Eliminar "COM PROP" y similares
+            comunidad = re.sub(r'COM\s*PROP[^\w]*', '', comunidad, flags=re.IGNORECASE)
+            comunidad = re.sub(r'COMUNIDAD\s+DE\s+PROPIETARIOS[^\w]*', '', comunidad, flags=re.IGNORECASE)
+            
+            # Para agua: cortar antes de TOLEDO y limpiar ciudades/códigos postales
+            comunidad = re.sub(r',?\s*TOLEDO.*$', '', comunidad, flags=re.IGNORECASE)
+            comunidad = re.sub(r',?\s*\d{5}.*$', '', comunidad)  # Eliminar códigos postales y lo que sigue
+            
+            # Limpiar guiones, comas y espacios al final
+            comunidad = re.sub(r'[\s,\-]+$', '', comunidad)
+            comunidad = re.sub(r'\s+', ' ', comunidad).strip()
+            
+            # Si queda algo válido, devolverlo
+            return comunidad if comunidad and len(comunidad) > 3 else None
+    
+    # Para facturas de electricidad/luz: buscar después de "Nombre/Razón social:"
+    elif tipo_gasto and tipo_gasto.lower() in ['electricidad', 'luz']:
+        m_nombre_razon = re.search(r'Nombre[/\s]*Razón\s+social[:\s]*([^\n\r]+)', texto, re.IGNORECASE)
+        if m_nombre_razon:
+            comunidad = m_nombre_razon.group(1).strip()
+            # Limpiar y eliminar "COM PROP" y similares
+            comunidad = re.sub(r'COM\s*PROP[^\w]*', '', comunidad, flags=re.IGNORECASE)
+            comunidad = re.sub(r'COMUNIDAD\s+DE\s+PROPIETARIOS[^\w]*', '', comunidad, flags=re.IGNORECASE)
+            # Limpiar guiones y comas al final, y espacios múltiples
+            comunidad = re.sub(r'[\s,\-]+$', '', comunidad)
+            comunidad = re.sub(r'\s+', ' ', comunidad).strip()
+            return comunidad if comunidad else None
+    
+    return None
+
+
+def detectar_campos_factura(pdf_text, filename):
+    """Ejecuta todos los extractores sobre el texto y devuelve los campos detectados"""
+    tipo = detectar_tipo_gasto(pdf_text, filename)
+    cod_abast, poliza = detectar_poliza_y_cod_abast(pdf_text)
+    return {
+        'tipo': tipo,
+        'cups': detectar_cups_o_contador(pdf_text),
+        'direccion': detectar_direccion(pdf_text),
+        'importe': detectar_importe_total(pdf_text),
+        'periodo': detectar_periodo_facturacion(pdf_text),
+        'fecha_factura': detectar_fecha_factura(pdf_text),
+        'cod_abast': cod_abast,
+        'poliza': poliza,
+        'contador': detectar_contador(pdf_text),
+        'comunidad_especifica': detectar_comunidad_factura(pdf_text, tipo),
+    }
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga con tráfico mixto contra una instancia en marcha (gunicorn o Flask).
+
+Varios clientes concurrentes, cada uno con su sesión, repiten durante unos segundos
+peticiones elegidas al azar según los pesos: dashboard (GET /), vista previa
+(GET /preview/imagen/<id> de una factura subida al empezar) y subida (POST /upload de
+un PDF sintético nuevo). Muestra peticiones por segundo, latencias p50/p95/máx y
+errores por tipo, para comparar clases de worker y configuraciones.
+
+Solo usa la biblioteca estándar. Usuario y contraseña: CARGA_USUARIO / CARGA_PASSWORD
+(por defecto los de desarrollo).
+
+Uso: python benchmarks/prueba_carga.py [url] [segundos] [clientes] [dashboard=70,preview=20,upload=10]
+Ej.: gunicorn -c gunicorn.conf.py & python benchmarks/prueba_carga.py http://127.0.0.1:5000 30 8
+"""
+import http.cookiejar
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import generar_pdf, generar_textos
+
+USUARIO = os.environ.get('CARGA_USUARIO', 'Dani')
+PASSWORD = os.environ.get('CARGA_PASSWORD', 'DefaultDani123!')
+PESOS_POR_DEFECTO = 'dashboard=70,preview=20,upload=10'
+
+
+class Cliente:
+    """Sesión HTTP con sus cookies (una por cliente, como un navegador)"""
+
+    def __init__(self, base):
+        self.base = base.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def pedir(self, metodo, ruta, datos=None, cabeceras=None):
+        """Devuelve (estado, cuerpo); los errores HTTP también se devuelven, no se lanzan"""
+        peticion = urllib.request.Request(self.base + ruta, data=datos, method=metodo, headers=cabeceras or {})
+        try:
+            with self.opener.open(peticion, timeout=120) as respuesta:
+                return respuesta.status, respuesta.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def login(self):
+        datos = urllib.parse.urlencode({'username': USUARIO, 'password': PASSWORD}).encode()
+        estado, _ = self.pedir('POST', '/login', datos, {'Content-Type': 'application/x-www-form-urlencoded'})
+        if estado != 200:
+            raise RuntimeError(f"No se pudo iniciar sesión como {USUARIO} (HTTP {estado})")
+
+    def subir(self, nombre, pdf):
+        """POST /upload con un archivo en multipart/form-data; devuelve (estado, json)"""
+        frontera = uuid.uuid4().hex
+        cuerpo = (f"--{frontera}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{nombre}\"\r\n"
+                  f"Content-Type: application/pdf\r\n\r\n").encode() + pdf + f"\r\n--{frontera}--\r\n".encode()
+        estado, respuesta = self.pedir('POST', '/upload', cuerpo,
+                                       {'Content-Type': f'multipart/form-data; boundary={frontera}'})
+        return estado, json.loads(respuesta or b'{}') if estado in (202, 400, 408) else {}
+
+
+def preparar_factura(cliente, pdf):
+    """Sube una factura, espera a que se procese y devuelve su id para las vistas previas"""
+    estado, datos = cliente.subir('carga_preview.pdf', pdf)
+    if estado != 202:
+        raise RuntimeError(f"La subida inicial falló (HTTP {estado})")
+    for _ in range(300):
+        _, cuerpo = cliente.pedir('GET', datos['estado_url'])
+        trabajo = json.loads(cuerpo)
+        if trabajo['estado'] == 'completado':
+            return trabajo['facturas'][0]['id']
+        if trabajo['estado'] == 'error':
+            raise RuntimeError(f"El procesamiento inicial falló: {trabajo['error']}")
+        time.sleep(0.1)
+    raise RuntimeError("La factura inicial no se procesó a tiempo")
+
+
+def parsear_pesos(texto):
+    pesos = {}
+    for parte in texto.split(','):
+        tipo, peso = parte.split('=')
+        pesos[tipo.strip()] = int(peso)
+    return pesos
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def main():
+    base = sys.argv[1] if len(sys.argv) > 1 else 'http://127.0.0.1:5000'
+    segundos = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    num_clientes = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    pesos = parsear_pesos(sys.argv[4] if len(sys.argv) > 4 else PESOS_POR_DEFECTO)
+
+    # PDFs distintos para cada subida, para que no los sirva la caché de extracción
+    semilla = int(time.time())
+    pdfs = [generar_pdf(t) for t in generar_textos(200, semilla=semilla, lineas_relleno=20)]
+    clientes = [Cliente(base) for _ in range(num_clientes)]
+    for cliente in clientes:
+        cliente.login()
+    id_preview = urllib.parse.quote(preparar_factura(clientes[0], pdfs[0]))
+
+    peticiones = {
+        'dashboard': lambda c, i: c.pedir('GET', '/')[0],
+        'preview': lambda c, i: c.pedir('GET', f'/preview/imagen/{id_preview}?page=1')[0],
+        'upload': lambda c, i: c.subir(f'carga_{i}.pdf', pdfs[1 + i % (len(pdfs) - 1)])[0],
+    }
+    esperados = {'dashboard': 200, 'preview': 200, 'upload': 202}
+    tipos = [t for t in pesos if t in peticiones and pesos[t] > 0]
+    resultados = {t: [] for t in tipos}
+    errores = {t: 0 for t in tipos}
+    ultimos_errores = {}
+    contador = iter(range(10 ** 9))
+    lock = threading.Lock()
+    fin = time.perf_counter() + segundos
+
+    def trabajar(cliente, rnd):
+        while time.perf_counter() < fin:
+            tipo = rnd.choices(tipos, weights=[pesos[t] for t in tipos])[0]
+            with lock:
+                i = next(contador)
+            inicio = time.perf_counter()
+            try:
+                estado = peticiones[tipo](cliente, i)
+                error = None if estado == esperados[tipo] else f"HTTP {estado}"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            duracion = time.perf_counter() - inicio
+            with lock:
+                resultados[tipo].append(duracion)
+                if error:
+                    errores[tipo] += 1
+                    ultimos_errores[tipo] = error
+
+    hilos = [threading.Thread(target=trabajar, args=(c, random.Random(n))) for n, c in enumerate(clientes)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    total_segundos = time.perf_counter() - inicio
+
+    total = sum(len(v) for v in resultados.values())
+    print(f"🧪 CARGA MIXTA - {base}, {num_clientes} clientes, {total_segundos:.0f} s "
+          f"({', '.join(f'{t} {pesos[t]}' for t in tipos)})")
+    print("=" * 78)
+    for tipo in tipos:
+        tiempos = resultados[tipo]
+        if not tiempos:
+            print(f"  {tipo:10s} sin peticiones")
+            continue
+        print(f"  {tipo:10s} {len(tiempos):6d} pet. | {len(tiempos) / total_segundos:7.1f} pet/s "
+              f"| p50 {statistics.median(tiempos) * 1000:7.0f} ms | p95 {percentil(tiempos, 0.95) * 1000:7.0f} ms "
+              f"| máx {max(tiempos) * 1000:7.0f} ms | errores {errores[tipo]}")
+    print(f"  {'total':10s} {total:6d} pet. | {total / total_segundos:7.1f} pet/s")
+    for tipo, error in ultimos_errores.items():
+        print(f"  ⚠️ último error de {tipo}: {error}")
+
+
+if __name__ == "__main__":
+    main()
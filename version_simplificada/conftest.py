@@ -0,0 +1,118 @@
+"""
+Configuración común de las pruebas con pytest (python -m pytest).
+
+Cada sesión trabaja en una carpeta temporal: base de datos, mapeo, snapshot, aviso
+de recarga, subidas e instance. Las variables de entorno se fijan antes de importar
+app, que las lee al cargarse.
+"""
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pytest
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRECTORIO)
+sys.path.insert(0, os.path.join(DIRECTORIO, 'benchmarks'))
+
+TEMPORAL = tempfile.mkdtemp(prefix='pruebas-facturas-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(TEMPORAL, 'facturas.db')}",
+    'MAPEO_CONFIG_PATH': os.path.join(TEMPORAL, 'mapeo_sensible.json'),
+    'MAPEO_SNAPSHOT_PATH': os.path.join(TEMPORAL, 'mapeo_snapshot.pkl'),
+    'MAPEO_AVISO_RECARGA_PATH': os.path.join(TEMPORAL, 'mapeo_recarga'),
+    # Sin vigilancia periódica: las recargas de las pruebas son explícitas
+    'MAPEO_INTERVALO_RECARGA': '0',
+    # Sin caché de extracción, para que cada subida pase por el análisis
+    'CACHE_EXTRACCION_MAX_BYTES': '0',
+    'PIPELINE_WORKERS': '2',
+    'PRERENDER_PREVIEWS': 'false',
+})
+
+from corpus import generar_mapeo, generar_pdf, generar_textos  # noqa: E402
+import app as facturas_app  # noqa: E402
+
+# Los scripts de comprobación del mapeo real necesitan secret_mappings.py, que no se versiona
+if importlib.util.find_spec('secret_mappings') is None:
+    collect_ignore = ['test_buenavista.py', 'test_nueva_factura.py']
+
+USUARIO = 'Dani'
+PASSWORD = 'DefaultDani123!'
+
+
+def escribir_mapeo(mapeo, direcciones, ruta=None):
+    """Escribe un mapeo con el formato de mapeo_sensible.json (de forma atómica)"""
+    ruta = ruta or os.environ['MAPEO_CONFIG_PATH']
+    datos = {
+        'mapeo_cuentas_contables': mapeo,
+        'direcciones_por_tipo': {f"{tipo},{direccion}": v for (tipo, direccion), v in direcciones.items()},
+        'codigos_agua_disponibles': [],
+    }
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def pdfs_factura(n=3, semilla=42, mapeo=None):
+    """Lista de (archivo, nombre) con PDFs sintéticos para subir con el cliente de pruebas"""
+    textos = generar_textos(n, semilla=semilla, mapeo=mapeo, lineas_relleno=10)
+    return [(io.BytesIO(generar_pdf(texto)), f'factura_{semilla}_{i}.pdf') for i, texto in enumerate(textos)]
+
+
+@pytest.fixture(scope='session')
+def aplicacion():
+    """El módulo app preparado con create_app sobre la carpeta temporal"""
+    mapeo, direcciones = generar_mapeo(20)
+    escribir_mapeo(mapeo, direcciones)
+    facturas_app.app.instance_path = os.path.join(TEMPORAL, 'instance')
+    facturas_app.app.config['TESTING'] = True
+    facturas_app.app.config['UPLOAD_FOLDER'] = os.path.join(TEMPORAL, 'uploads')
+    facturas_app.create_app()
+    yield facturas_app
+    facturas_app.detener_trabajos()
+    shutil.rmtree(TEMPORAL, ignore_errors=True)
+
+
+@pytest.fixture
+def bd(aplicacion):
+    """Base de datos sin facturas, trabajos ni documentos, dentro de un contexto de aplicación"""
+    with aplicacion.app.app_context():
+        for modelo in (aplicacion.Factura, aplicacion.TrabajoCarga, aplicacion.DocumentoPDF,
+                       aplicacion.ReasignacionMapeo):
+            modelo.query.delete()
+        aplicacion.db.session.commit()
+        yield aplicacion.db
+
+
+@pytest.fixture
+def cliente(aplicacion, bd):
+    """Cliente de pruebas de Flask con la sesión iniciada"""
+    cliente = aplicacion.app.test_client()
+    respuesta = cliente.post('/login', data={'username': USUARIO, 'password': PASSWORD})
+    assert respuesta.status_code == 302
+    return cliente
+
+
+def esperar_trabajo(cliente, estado_url, limite=60):
+    """Consulta el trabajo de carga hasta que termina y devuelve su último estado"""
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        estado = cliente.get(estado_url).get_json()
+        if estado['estado'] in ('completado', 'error'):
+            return estado
+        time.sleep(0.05)
+    raise AssertionError(f"El trabajo no terminó en {limite} s: {estado}")
+
+
+def subir_facturas(cliente, archivos, modo='auto'):
+    """Sube los archivos, espera a que termine el trabajo y devuelve su estado final"""
+    respuesta = cliente.post('/upload', data={'file': archivos, 'modo': modo},
+                             content_type='multipart/form-data')
+    assert respuesta.status_code == 202, respuesta.get_json()
+    return esperar_trabajo(cliente, respuesta.get_json()['estado_url'])
@@ -0,0 +1,91 @@
+"""
+Configuración de gunicorn para producción: gunicorn -c gunicorn.conf.py
+
+La aplicación se carga una vez en el proceso maestro (create_app: mapeo, base de
+datos) y los workers la heredan al crearse. Todo se ajusta con variables de entorno:
+
+- GUNICORN_WORKER_CLASS: sync, gthread (por defecto; "threaded" también vale) o gevent
+- GUNICORN_WORKERS / GUNICORN_THREADS / GUNICORN_WORKER_CONNECTIONS
+- GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT, GUNICORN_KEEPALIVE
+- GUNICORN_MAX_REQUESTS (0 = nunca se reciclan los workers)
+- TIMEOUT_UPLOAD / TIMEOUT_PREVIEW: límites por ruta que aplica la propia aplicación
+
+Recarga sin cortes: `kill -HUP <maestro>` arranca workers nuevos y retira los antiguos
+cuando terminan sus peticiones (ver recargar.sh para desplegar código nuevo).
+"""
+import gc
+import importlib.util
+import os
+
+# Servidor
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+wsgi_app = 'app:create_app()'
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+pidfile = os.environ.get('GUNICORN_PIDFILE', '/tmp/gunicorn-facturas.pid')
+
+# Workers. Con sync un renderizado lento de vista previa ocupa el worker entero; con
+# gthread cada worker atiende varias peticiones a la vez con sus hilos
+CLASES_WORKER = {'sync': 'sync', 'gthread': 'gthread', 'threaded': 'gthread', 'gevent': 'gevent'}
+worker_class = CLASES_WORKER.get(os.environ.get('GUNICORN_WORKER_CLASS', 'gthread').lower())
+if worker_class is None:
+    print(f"⚠️ GUNICORN_WORKER_CLASS no válida: {os.environ['GUNICORN_WORKER_CLASS']}, se usa gthread")
+    worker_class = 'gthread'
+if worker_class == 'gevent' and importlib.util.find_spec('gevent') is None:
+    print("Advertencia: gevent no está instalado (pip install gevent), se usa gthread")
+    worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', max(2, os.cpu_count() or 1)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# Tiempos. Los de cada ruta los aplica la aplicación (la subida se corta con un 408 y
+# la vista previa recurre al texto extraído); gunicorn solo mata un worker sync que
+# pase de `timeout`, así que tiene que cubrir el más largo de ellos
+TIMEOUT_UPLOAD = int(os.environ.get('TIMEOUT_UPLOAD', 300))
+TIMEOUT_PREVIEW = int(os.environ.get('TIMEOUT_PREVIEW', 30))
+timeout = max(int(os.environ.get('GUNICORN_TIMEOUT', 60)), TIMEOUT_UPLOAD + 30, TIMEOUT_PREVIEW + 30)
+# Al recargar o parar, lo que tienen los workers antiguos para terminar sus peticiones
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', TIMEOUT_UPLOAD))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Logs por la salida estándar, como el resto de la aplicación
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+# Detrás del proxy de Dokploy/Docker
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+
+def when_ready(server):
+    server.log.info(f"🚀 Servidor de facturas listo: {workers} workers {worker_class}"
+                    + (f" x {threads} hilos" if worker_class == 'gthread' else "")
+                    + f", timeout {timeout} s (subida {TIMEOUT_UPLOAD} s, vista previa {TIMEOUT_PREVIEW} s)")
+
+
+def pre_fork(server, worker):
+    # Lo cargado en el maestro (mapeo e índices) pasa a la generación permanente del
+    # recolector: así los workers no tocan esas páginas y siguen compartidas con el maestro
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # Con preload el worker hereda el mapeo que leyó el maestro al arrancar (el maestro no
+    # vigila el archivo): si el JSON ha cambiado desde entonces, se lee antes de atender
+    if preload_app:
+        try:
+            import app
+            app.SERVICIO_MAPEO.recargar()
+        except Exception as e:
+            server.log.warning(f"No se pudo comprobar el mapeo al arrancar el worker: {e}")
+
+
+def worker_exit(server, worker):
+    # Al recargar o parar, los trabajos de carga de este worker terminan antes de cerrar
+    # su pool de procesos (hasta graceful_timeout; los que no lleguen se recuperan como error)
+    try:
+        import app
+        app.detener_trabajos()
+    except Exception as e:
+        server.log.warning(f"No se pudieron terminar los trabajos de carga: {e}")
@@ -6,7 +6,7 @@ import sys
 import webbrowser
 from threading import Timer
 from flask import Flask
-from app import app
+from app import create_app
 
 def open_browser():
     """Abrir el navegador automáticamente"""
@@ -37,5 +37,6 @@ if __name__ == '__main__':
     Timer(1, open_browser).start()
     
     # Iniciar la aplicación
+    app = create_app()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=True)
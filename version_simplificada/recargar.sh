@@ -0,0 +1,42 @@
+#!/bin/bash
+# Recarga gunicorn sin cortar las peticiones en curso (ver gunicorn.conf.py)
+#
+#   ./recargar.sh          workers nuevos con la configuración de gunicorn releída. Con
+#                          preload heredan del maestro el código y el mapeo que leyó al
+#                          arrancar; si el JSON ha cambiado desde entonces lo vuelven a
+#                          leer al crearse (post_fork) y después por su vigilancia
+#   ./recargar.sh codigo   arranca un maestro nuevo con el código actual y, cuando tiene
+#                          workers, retira el anterior. No usarlo si gunicorn es el PID 1
+#                          del contenedor: al salir el maestro antiguo se pararía el
+#                          contenedor (allí el código nuevo llega con una imagen nueva)
+
+PIDFILE=${GUNICORN_PIDFILE:-/tmp/gunicorn-facturas.pid}
+ESPERA=${RECARGA_ESPERA:-60}
+
+if [ ! -f "$PIDFILE" ]; then
+    echo "❌ No se encontró $PIDFILE: ¿está gunicorn en marcha?"
+    exit 1
+fi
+ANTERIOR=$(cat "$PIDFILE")
+
+if [ "$1" != "codigo" ]; then
+    kill -HUP "$ANTERIOR" && echo "🔄 Workers renovados (maestro $ANTERIOR)"
+    exit $?
+fi
+
+# Con USR2 el maestro actual arranca uno nuevo que comparte el socket (las conexiones que
+# lleguen mientras tanto esperan en su cola). El nuevo escribe su pid en <pidfile>.2 y lo
+# pasa a <pidfile> cuando termina el anterior
+kill -USR2 "$ANTERIOR" || exit 1
+for _ in $(seq 1 "$ESPERA"); do
+    sleep 1
+    NUEVO=$(cat "$PIDFILE.2" 2>/dev/null)
+    if [ -n "$NUEVO" ] && pgrep -P "$NUEVO" > /dev/null; then
+        # TERM: el maestro antiguo deja de aceptar y espera a que terminen sus peticiones
+        kill -TERM "$ANTERIOR"
+        echo "✅ Código recargado: maestro $NUEVO (el anterior, $ANTERIOR, termina sus peticiones)"
+        exit 0
+    fi
+done
+echo "❌ El maestro nuevo no arrancó en ${ESPERA} s; se mantiene el $ANTERIOR"
+exit 1
@@ -3,7 +3,9 @@ Script para iniciar la aplicación simplificada
 """
 import os
 from datetime import datetime
-from app import app
+from app import create_app
+
+app = create_app()
 
 # Añadir la función now para utilizarla en las plantillas
 @app.context_processor
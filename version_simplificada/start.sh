@@ -50,5 +50,11 @@ echo "🎯 PATH actual: $PATH"
 echo "🎯 Binarios poppler disponibles:"
 ls -la /usr/bin/pdf* 2>/dev/null || echo "   Ninguno encontrado en /usr/bin"
 
-echo "🚀 Iniciando Flask..."
-exec python app.py
+# SERVIDOR=desarrollo usa el servidor de Flask (un solo hilo, solo para pruebas)
+if [ "${SERVIDOR:-gunicorn}" = "desarrollo" ]; then
+    echo "🚀 Iniciando Flask (servidor de desarrollo)..."
+    exec python app.py
+fi
+
+echo "🚀 Iniciando gunicorn (gunicorn.conf.py)..."
+exec gunicorn -c gunicorn.conf.py
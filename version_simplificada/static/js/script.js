@@ -221,82 +221,80 @@ document.addEventListener('DOMContentLoaded', function() {
                 progressBar.setAttribute('aria-valuenow', 0);
             }
             
-            // Simular proceso de reconocimiento
-            showToast(`Iniciando reconocimiento de ${fileUpload.files.length} ${fileUpload.files.length > 1 ? 'facturas' : 'factura'}...`);
+            showToast(`Subiendo ${fileUpload.files.length} ${fileUpload.files.length > 1 ? 'facturas' : 'factura'}...`);
             
-            // Simulamos proceso en etapas con animación de progreso
-            let progress = 0;
             const updateProgress = (value) => {
-                progress = value;
                 if (progressBar) {
-                    progressBar.style.width = `${progress}%`;
-                    progressBar.setAttribute('aria-valuenow', progress);
+                    progressBar.style.width = `${value}%`;
+                    progressBar.setAttribute('aria-valuenow', value);
                 }
             };
             
-            const progressInterval = setInterval(() => {
-                if (progress < 90) {
-                    updateProgress(progress + (90 - progress) / 10);
-                }
-            }, 300);
-            
-            // Simulamos un proceso en etapas para dar más realismo
-            setTimeout(() => {
-                showToast('Extrayendo texto de los PDFs...');
-                updateProgress(30);
+            const finalizarCarga = () => {
+                procesarBtn.disabled = false;
+                procesarBtn.innerHTML = '<i class="fas fa-cogs me-1"></i> Procesar Archivos';
+                fileUpload.value = '';
+                selectedFile.textContent = "Ningún archivo seleccionado";
                 
-                setTimeout(() => {
-                    showToast('Identificando campos de las facturas...');
-                    updateProgress(60);
-                    
+                if (progressContainer) {
                     setTimeout(() => {
-                        showToast('Analizando cuentas contables...');
-                        updateProgress(80);
+                        progressContainer.classList.add('d-none');
+                    }, 1500);
+                }
+            };
+            
+            // Consultar el progreso real del trabajo hasta que termine
+            const consultarTrabajo = (estadoUrl, desde = 0) => {
+                fetch(`${estadoUrl}?desde=${desde}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        if (!data.success) {
+                            throw new Error(data.error || 'Trabajo no encontrado');
+                        }
+                        updateProgress(data.progreso);
+                        procesarBtn.innerHTML = `<i class="fas fa-spinner fa-spin me-1"></i> Procesando ${data.procesadas} de ${data.total}...`;
                         
-                        setTimeout(() => {
-                            // Finalmente enviamos los archivos al servidor
-                            fetch('/upload', {
-                                method: 'POST',
-                                body: formData
-                            })
-                            .then(response => response.json())
-                            .then(data => {
-                                if (data.success) {
-                                    clearInterval(progressInterval);
-                                    updateProgress(100);
-                                    
-                                    const plural = data.total_procesadas > 1;
-                                    showToast(`¡${data.total_procesadas} ${plural ? 'facturas procesadas' : 'factura procesada'} correctamente!`);
-                                    
-                                    // Simulamos una breve espera antes de recargar
-                                    setTimeout(() => {
-                                        window.location.reload();
-                                    }, 1500);
-                                } else {
-                                    showToast('Error al procesar las facturas: ' + data.error, false);
-                                }
-                            })
-                            .catch(error => {
-                                console.error('Error:', error);
-                                showToast('Error al procesar las facturas', false);
-                            })
-                            .finally(() => {
-                                clearInterval(progressInterval);
-                                procesarBtn.disabled = false;
-                                procesarBtn.innerHTML = '<i class="fas fa-cogs me-1"></i> Procesar Archivos';
-                                fileUpload.value = '';
-                                selectedFile.textContent = "Ningún archivo seleccionado";
-                                
-                                if (progressContainer) {
-                                    setTimeout(() => {
-                                        progressContainer.classList.add('d-none');
-                                    }, 1500);
-                                }
-                            });
-                        }, 1000);
-                    }, 800);
-                }, 1200);
-            }, 500);
+                        if (data.estado === 'completado') {
+                            const plural = data.total > 1;
+                            showToast(`¡${data.procesadas} ${plural ? 'facturas procesadas' : 'factura procesada'} correctamente!`);
+                            finalizarCarga();
+                            setTimeout(() => {
+                                window.location.reload();
+                            }, 1000);
+                        } else if (data.estado === 'error') {
+                            showToast('Error al procesar las facturas: ' + data.error, false);
+                            finalizarCarga();
+                        } else {
+                            setTimeout(() => consultarTrabajo(estadoUrl, data.siguiente), 700);
+                        }
+                    })
+                    .catch(error => {
+                        console.error('Error:', error);
+                        showToast('Error al consultar el progreso de la carga', false);
+                        finalizarCarga();
+                    });
+            };
+            
+            // Enviar los archivos; el servidor devuelve el id del trabajo inmediatamente
+            fetch('/upload', {
+                method: 'POST',
+                body: formData
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    showToast('Extrayendo e identificando los datos de las facturas...');
+                    consultarTrabajo(data.estado_url);
+                } else {
+                    showToast('Error al procesar las facturas: ' + data.error, false);
+                    finalizarCarga();
+                }
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                showToast('Error al procesar las facturas', false);
+                finalizarCarga();
+            });
         });
     }
 
@@ -304,6 +302,8 @@ document.addEventListener('DOMContentLoaded', function() {
     let currentPdfPage = 1;
     let totalPdfPages = 1;
     let currentPdfFilename = '';
+    // WebP ocupa menos que JPEG; se usa solo si el navegador lo sabe mostrar
+    const soportaWebp = document.createElement('canvas').toDataURL('image/webp').startsWith('data:image/webp');
     
     // Función para cargar vista previa del PDF
     function loadPdfPreview(facturaId, page = 1) {
@@ -320,59 +320,35 @@ document.addEventListener('DOMContentLoaded', function() {
             previewContainer.classList.add('d-none');
         }
         
-        // Cargar la vista previa usando el ID de la factura
-        fetch(`/pdf_preview/${facturaId}?page=${page}`)
+        // Metadatos (páginas) en JSON; la imagen se pide en binario para que el navegador la cachee
+        const idCodificado = encodeURIComponent(facturaId);
+        fetch(`/preview/info/${idCodificado}`)
             .then(response => response.json())
             .then(data => {
                 if (data.success) {
-                    // Si el backend devuelve imageData (base64), usarla
-                    if (data.imageData) {
-                        previewImage.src = data.imageData;
-                        // Actualizar contadores de página
-                        currentPdfPage = data.currentPage || 1;
-                        totalPdfPages = data.totalPages || 1;
-                        currentPdfFilename = facturaId; // Ahora guardamos el ID
+                    currentPdfPage = Math.min(Math.max(page, 1), data.totalPages || 1);
+                    totalPdfPages = data.totalPages || 1;
+                    currentPdfFilename = facturaId; // Ahora guardamos el ID
 
-                        pageIndicator.textContent = `Página ${currentPdfPage} de ${totalPdfPages}`;
-                        prevBtn.disabled = currentPdfPage <= 1;
-                        nextBtn.disabled = currentPdfPage >= totalPdfPages;
+                    pageIndicator.textContent = `Página ${currentPdfPage} de ${totalPdfPages}`;
+                    prevBtn.disabled = currentPdfPage <= 1;
+                    nextBtn.disabled = currentPdfPage >= totalPdfPages;
 
-                        if (data.limitedPreview) {
-                            showToast('Vista previa limitada. Para mejor visualización, instale las dependencias completas.', false);
-                        }
-
-                        previewImage.onload = function() {
-                            loadingElement.classList.add('d-none');
-                            previewContainer.classList.remove('d-none');
-                        };
-                    } else if (data.pdf_url) {
-                        // Si el backend devuelve pdf_url (archivo), cargamos como PDF renderizado por el navegador en un iframe alternativo
-                        // Reemplazamos la imagen por un iframe dinámico
-                        let iframe = document.createElement('iframe');
-                        iframe.src = data.pdf_url;
-                        iframe.width = '100%';
-                        iframe.height = '600px';
-                        iframe.style.border = '1px solid #ddd';
-
-                        // Limpiar contenedor y añadir iframe
-                        previewContainer.innerHTML = '';
-                        previewContainer.appendChild(iframe);
-
-                        iframe.onload = function() {
-                            loadingElement.classList.add('d-none');
-                            previewContainer.classList.remove('d-none');
-                        };
+                    if (data.limitedPreview) {
+                        showToast('Vista previa limitada. Para mejor visualización, instale las dependencias completas.', false);
+                    }
 
-                        currentPdfPage = 1;
-                        totalPdfPages = 1;
-                        currentPdfFilename = filename;
-                        pageIndicator.textContent = `Página ${currentPdfPage} de ${totalPdfPages}`;
-                        prevBtn.disabled = true;
-                        nextBtn.disabled = true;
-                    } else {
-                        showToast('El servidor devolvió una respuesta de vista previa incompleta.', false);
+                    const formato = (data.formatos || []).includes('webp') && soportaWebp ? 'webp' : 'jpeg';
+                    previewImage.onload = function() {
                         loadingElement.classList.add('d-none');
-                    }
+                        previewContainer.classList.remove('d-none');
+                        precargarPaginasVecinas(idCodificado, currentPdfPage, totalPdfPages, formato);
+                    };
+                    previewImage.onerror = function() {
+                        showToast('Error al cargar la vista previa', false);
+                        loadingElement.classList.add('d-none');
+                    };
+                    previewImage.src = `/preview/imagen/${idCodificado}?page=${currentPdfPage}&formato=${formato}`;
                 } else {
                     showToast('Error al cargar la vista previa: ' + (data.error || 'desconocido'), false);
                     loadingElement.classList.add('d-none');
@@ -385,6 +361,17 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
+    // Precargar las páginas anterior y siguiente: quedan en la caché del navegador y el
+    // servidor las renderiza por lotes, así que pasar de página es inmediato
+    function precargarPaginasVecinas(idCodificado, pagina, total, formato) {
+        [pagina + 1, pagina - 1].forEach(vecina => {
+            if (vecina >= 1 && vecina <= total) {
+                const imagen = new Image();
+                imagen.src = `/preview/imagen/${idCodificado}?page=${vecina}&formato=${formato}`;
+            }
+        });
+    }
+
     // Configurar botones de navegación de PDF
     const prevPageBtn = document.getElementById('prev-page-btn');
     const nextPageBtn = document.getElementById('next-page-btn');
@@ -508,6 +495,40 @@ document.addEventListener('DOMContentLoaded', function() {
     // Manejar checkboxes de procesado
     initializeProcesadoCheckboxes();
 
+    // Cargar la siguiente página de facturas bajo demanda (paginación por cursor)
+    const cargarMasBtn = document.getElementById('cargar-mas-btn');
+    if (cargarMasBtn) {
+        cargarMasBtn.addEventListener('click', function() {
+            const params = new URLSearchParams(window.location.search);
+            params.set('cursor', cargarMasBtn.getAttribute('data-cursor'));
+            cargarMasBtn.disabled = true;
+
+            fetch(`/dashboard/filas?${params.toString()}`)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`HTTP ${response.status}`);
+                    }
+                    const siguiente = response.headers.get('X-Siguiente-Cursor');
+                    return response.text().then(html => ({ html, siguiente }));
+                })
+                .then(({ html, siguiente }) => {
+                    document.getElementById('facturas-tbody').insertAdjacentHTML('beforeend', html);
+                    initializeControls();
+                    if (siguiente) {
+                        cargarMasBtn.setAttribute('data-cursor', siguiente);
+                        cargarMasBtn.disabled = false;
+                    } else {
+                        document.getElementById('cargar-mas-container').classList.add('d-none');
+                    }
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    cargarMasBtn.disabled = false;
+                    showToast('Error al cargar más facturas', false);
+                });
+        });
+    }
+
     // Re-inicializar checkboxes después de cargar nuevas facturas
     const originalLoadFacturas = window.loadFacturas || function() {};
     window.loadFacturas = function() {
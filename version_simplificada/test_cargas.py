@@ -0,0 +1,168 @@
+"""
+Pruebas de las subidas: trabajos de carga en segundo plano, consulta de su progreso,
+facturas guardadas en la base de datos y búsquedas, y el pool de procesos compartido.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import esperar_trabajo, pdfs_factura, subir_facturas
+
+
+def test_subida_responde_al_momento_y_guarda_las_facturas(aplicacion, cliente):
+    respuesta = cliente.post('/upload', data={'file': pdfs_factura(3), 'modo': 'secuencial'},
+                             content_type='multipart/form-data')
+    assert respuesta.status_code == 202
+    datos = respuesta.get_json()
+    assert datos['total'] == 3 and datos['estado_url'].endswith(datos['job_id'])
+
+    estado = esperar_trabajo(cliente, datos['estado_url'])
+    assert estado['estado'] == 'completado', estado['error']
+    assert (estado['modo'], estado['procesadas'], estado['progreso']) == ('secuencial', 3, 100)
+    assert [f['nombre'] for f in estado['facturas']] == [f'factura_42_{i}.pdf' for i in range(3)]
+    assert len(estado['tiempos']) == 3 and estado['siguiente'] == 3
+
+    filas = aplicacion.Factura.query.order_by(aplicacion.Factura.posicion).all()
+    assert [f.trabajo_id for f in filas] == [datos['job_id']] * 3
+    for fila in filas:
+        # Los campos detectados y los metadatos del PDF se guardan con la factura
+        assert json.loads(fila.campos)['tipo'] == fila.tipo
+        documento = aplicacion.db.session.get(aplicacion.DocumentoPDF, fila.sha256)
+        assert documento.num_paginas >= 1 and json.loads(documento.textos)
+
+
+def test_progreso_desde_devuelve_solo_las_facturas_nuevas(cliente):
+    estado = subir_facturas(cliente, pdfs_factura(4), modo='secuencial')
+    url = f"/api/jobs/{estado['job_id']}"
+    parcial = cliente.get(f'{url}?desde=3').get_json()
+    assert [f['nombre'] for f in parcial['facturas']] == ['factura_42_3.pdf']
+    assert parcial['siguiente'] == 4
+    assert cliente.get(f'{url}?desde=9').get_json()['facturas'] == []
+
+
+def test_subidas_no_validas(cliente):
+    assert cliente.post('/upload', data={}, content_type='multipart/form-data').status_code == 400
+    respuesta = cliente.post('/upload', data={'file': pdfs_factura(1), 'modo': 'otro'},
+                             content_type='multipart/form-data')
+    assert respuesta.status_code == 400
+    assert cliente.get('/api/jobs/no-existe').status_code == 404
+
+
+def test_mismo_pdf_dos_veces_son_dos_facturas_con_un_documento(aplicacion, cliente):
+    for _ in range(2):
+        estado = subir_facturas(cliente, pdfs_factura(1), modo='secuencial')
+        assert estado['estado'] == 'completado'
+    filas = aplicacion.Factura.query.all()
+    assert len(filas) == 2 and filas[0].id != filas[1].id
+    assert filas[0].sha256 == filas[1].sha256
+    assert aplicacion.DocumentoPDF.query.count() == 1
+
+
+def test_busqueda_por_id_nombre_y_nombre_renombrado(aplicacion, cliente):
+    factura = subir_facturas(cliente, pdfs_factura(1), modo='secuencial')['facturas'][0]
+    for clave in (factura['id'], factura['nombre'], factura['archivo_procesado']):
+        datos = cliente.get(f'/copiar_movimiento/{clave}').get_json()
+        assert datos == {'success': True, 'concepto': factura['movimiento_contable']}
+    assert cliente.get('/copiar_movimiento/no-existe').status_code == 404
+
+    assert cliente.post(f"/toggle_procesado/{factura['id']}").get_json()['procesado'] is True
+    aplicacion.db.session.expire_all()
+    assert aplicacion.db.session.get(aplicacion.Factura, factura['id']).procesado is True
+
+
+def test_pipeline_con_pool_da_lo_mismo_que_en_secuencia(aplicacion, cliente):
+    secuencial = subir_facturas(cliente, pdfs_factura(6, semilla=7), modo='secuencial')
+    pipeline = subir_facturas(cliente, pdfs_factura(6, semilla=7), modo='pipeline')
+    assert pipeline['estado'] == 'completado', pipeline['error']
+    assert pipeline['modo'] == 'pipeline'
+    columnas = ('nombre', 'tipo', 'cups', 'direccion', 'importe', 'comunidad', 'cuenta')
+    assert ([{c: f[c] for c in columnas} for f in pipeline['facturas']]
+            == [{c: f[c] for c in columnas} for f in secuencial['facturas']])
+
+
+def test_pool_compartido_entre_trabajos(aplicacion):
+    aplicacion._reiniciar_pool()
+    try:
+        # Varios trabajos que piden el pool a la vez reciben el mismo
+        with ThreadPoolExecutor(max_workers=8) as hilos:
+            pools = list(hilos.map(lambda _: aplicacion._obtener_pool(), range(8)))
+        assert all(pool is pools[0] for pool in pools)
+
+        # Descartar un pool que ya se sustituyó no afecta al actual
+        anterior = pools[0]
+        aplicacion._reiniciar_pool(anterior)
+        actual = aplicacion._obtener_pool()
+        assert actual is not anterior
+        aplicacion._reiniciar_pool(anterior)
+        assert aplicacion._obtener_pool() is actual
+    finally:
+        aplicacion._reiniciar_pool()
+
+
+def test_trabajos_abandonados_se_marcan_como_error(aplicacion, cliente):
+    ahora = time.time()
+    for id_trabajo, actualizado in (('abandonado', ahora - aplicacion.TRABAJOS_CADUCIDAD_SEGUNDOS - 5),
+                                    ('en_curso', ahora)):
+        aplicacion.db.session.add(aplicacion.TrabajoCarga(
+            id=id_trabajo, estado='procesando', modo='secuencial', total=2, procesadas=1,
+            creado=ahora - 3600, actualizado=actualizado))
+    aplicacion.db.session.commit()
+
+    estado = cliente.get('/api/jobs/abandonado').get_json()
+    assert estado['estado'] == 'error' and 'vuelve a subir' in estado['error']
+    assert cliente.get('/api/jobs/en_curso').get_json()['estado'] == 'procesando'
+
+
+def test_latido_renueva_los_trabajos_de_este_proceso(aplicacion, bd):
+    aplicacion.db.session.add(aplicacion.TrabajoCarga(
+        id='local', estado='procesando', modo='secuencial', total=1, procesadas=0, creado=0, actualizado=0))
+    aplicacion.db.session.commit()
+    aplicacion._TRABAJOS_LOCALES.add('local')
+    try:
+        aplicacion._latido_trabajos()
+        aplicacion.db.session.commit()
+    finally:
+        aplicacion._TRABAJOS_LOCALES.discard('local')
+    aplicacion.db.session.expire_all()
+    assert aplicacion.db.session.get(aplicacion.TrabajoCarga, 'local').actualizado > time.time() - 60
+
+
+def test_detener_trabajos_espera_a_los_que_estan_en_curso(aplicacion, monkeypatch):
+    ejecutor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(aplicacion, '_EJECUTOR_TRABAJOS', ejecutor)
+    empezado = threading.Event()
+
+    def trabajo_lento():
+        empezado.set()
+        time.sleep(0.3)
+        return 'terminado'
+
+    futuro = ejecutor.submit(trabajo_lento)
+    empezado.wait()
+    aplicacion._obtener_pool()
+    aplicacion.detener_trabajos()
+    assert futuro.done() and futuro.result() == 'terminado'
+    assert aplicacion._PROCESS_POOL is None
+
+
+def test_documento_registrado_a_la_vez_por_otro_trabajo(aplicacion, bd, monkeypatch):
+    sha = 'a' * 64
+    # Otro trabajo inserta el documento entre la consulta y el insert de este
+    with bd.engine.begin() as conexion:
+        conexion.execute(aplicacion.DocumentoPDF.__table__.insert().values(
+            sha256=sha, tamano=10, num_paginas=3, textos=json.dumps(['uno'])))
+    consultar = bd.session.get
+    llamadas = []
+
+    def get_tardio(modelo, clave):
+        llamadas.append(clave)
+        return None if len(llamadas) == 1 else consultar(modelo, clave)
+
+    monkeypatch.setattr(bd.session, 'get', get_tardio)
+    fila = aplicacion.registrar_documento_pdf('no-se-lee.pdf', {
+        'sha256': sha, 'tamano': 10, 'num_paginas': 3, 'paginas': ['uno', 'dos']})
+    monkeypatch.undo()
+    bd.session.commit()
+    assert fila.sha256 == sha and len(llamadas) == 2
+    assert json.loads(bd.session.get(aplicacion.DocumentoPDF, sha).textos) == ['uno', 'dos']
@@ -0,0 +1,166 @@
+"""
+Pruebas de la consulta de facturas: paginación por cursor, filtros y orden de la API y
+del dashboard, vista previa con ETag/304 y exportaciones (ZIP, CSV, JSON Lines, XLSX).
+"""
+import io
+import json
+import re
+import zipfile
+from datetime import date, datetime, timedelta
+
+import openpyxl
+import pytest
+
+from conftest import pdfs_factura, subir_facturas
+
+
+@pytest.fixture
+def facturas(aplicacion, bd):
+    """Siete facturas procesadas en minutos consecutivos (la 0 es la más antigua)"""
+    inicio = datetime(2025, 3, 1, 9, 0)
+    filas = []
+    for i in range(7):
+        filas.append(aplicacion.Factura(
+            id=f'{i:032x}', nombre=f'factura_{i}.pdf', archivo_procesado=f'Factura Ñandú {i}',
+            tipo='Agua' if i % 2 else 'Luz', fecha=date(2025, 1, 1 + i), importe=f'{100 + i},5{i} EUR',
+            comunidad=f'COMUNIDAD {i % 3}', cuenta='6281000', movimiento_contable=f'Movimiento {i}',
+            created_at=inicio + timedelta(minutes=i)))
+    bd.session.add_all(filas)
+    bd.session.commit()
+    return filas
+
+
+def _todas_las_paginas(cliente, consulta):
+    nombres, cursor = [], None
+    while True:
+        url = f'/api/facturas?{consulta}' + (f'&cursor={cursor}' if cursor else '')
+        datos = cliente.get(url).get_json()
+        assert datos['success'], datos
+        nombres += [f['nombre'] for f in datos['facturas']]
+        cursor = datos['siguiente_cursor']
+        if not cursor:
+            return nombres
+
+
+def test_paginacion_por_cursor_sin_repetir_ni_saltar(cliente, facturas):
+    assert _todas_las_paginas(cliente, 'limite=3') == [f'factura_{i}.pdf' for i in range(7)]
+    assert _todas_las_paginas(cliente, 'limite=2&orden=-procesamiento') == [f'factura_{i}.pdf' for i in range(6, -1, -1)]
+    assert _todas_las_paginas(cliente, 'limite=2&orden=comunidad') == [
+        'factura_0.pdf', 'factura_3.pdf', 'factura_6.pdf', 'factura_1.pdf', 'factura_4.pdf',
+        'factura_2.pdf', 'factura_5.pdf']
+
+
+def test_filtros_y_campos(cliente, facturas):
+    assert _todas_las_paginas(cliente, 'tipo=Agua') == ['factura_1.pdf', 'factura_3.pdf', 'factura_5.pdf']
+    assert _todas_las_paginas(cliente, 'comunidad=COMUNIDAD 0&comunidad=COMUNIDAD 1') == [
+        'factura_0.pdf', 'factura_1.pdf', 'factura_3.pdf', 'factura_4.pdf', 'factura_6.pdf']
+    assert _todas_las_paginas(cliente, 'fecha_desde=2025-01-03&fecha_hasta=04/01/2025') == [
+        'factura_2.pdf', 'factura_3.pdf']
+    datos = cliente.get('/api/facturas?limite=1&campos=id,importe').get_json()
+    assert datos['facturas'] == [{'id': f'{0:032x}', 'importe': '100,50 EUR'}]
+
+
+@pytest.mark.parametrize('consulta', ['orden=importe', 'cursor=no-es-un-cursor', 'campos=clave',
+                                      'fecha_desde=ayer', 'procesado=quizas'])
+def test_parametros_no_validos(cliente, facturas, consulta):
+    respuesta = cliente.get(f'/api/facturas?{consulta}')
+    assert respuesta.status_code == 400 and respuesta.get_json()['success'] is False
+
+
+def test_dashboard_muestra_primero_las_ultimas(cliente, facturas):
+    html = cliente.get('/dashboard?limite=3').get_data(as_text=True)
+    assert re.findall(r'factura_(\d)\.pdf', html)[:1] == ['6']
+    assert set(re.findall(r'factura_(\d)\.pdf', html)) == {'6', '5', '4'}
+    cursor = re.search(r'data-cursor="([^"]+)"', html).group(1)
+
+    respuesta = cliente.get(f'/dashboard/filas?limite=3&cursor={cursor}')
+    assert set(re.findall(r'factura_(\d)\.pdf', respuesta.get_data(as_text=True))) == {'3', '2', '1'}
+    assert respuesta.headers['X-Siguiente-Cursor']
+    # Un orden no válido no rompe el dashboard: se usan los parámetros por defecto
+    assert cliente.get('/dashboard?orden=importe').status_code == 200
+
+
+def test_vista_previa_responde_304_sin_volver_a_renderizar(aplicacion, cliente, monkeypatch):
+    factura = subir_facturas(cliente, pdfs_factura(1), modo='secuencial')['facturas'][0]
+    url = f"/preview/imagen/{factura['id']}?page=1"
+    primera = cliente.get(url)
+    assert primera.status_code == 200 and primera.headers['ETag']
+
+    def sin_renderizar(*args, **kwargs):
+        raise AssertionError("No debería renderizarse la imagen")
+
+    monkeypatch.setattr(aplicacion, 'imagen_vista_previa', sin_renderizar)
+    segunda = cliente.get(url, headers={'If-None-Match': primera.headers['ETag']})
+    assert segunda.status_code == 304 and segunda.data == b''
+    assert segunda.headers['ETag'] == primera.headers['ETag']
+    assert cliente.get(f"/preview/imagen/{factura['id']}?page=99").status_code == 404
+
+
+def test_exportar_zip_con_los_pdfs_renombrados(aplicacion, cliente):
+    estado = subir_facturas(cliente, pdfs_factura(3), modo='secuencial')
+    respuesta = cliente.get('/exportar/zip')
+    assert respuesta.status_code == 200 and respuesta.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(respuesta.data)) as zf:
+        nombres = zf.namelist()
+        assert len(nombres) == 3 and all(n.endswith('.pdf') for n in nombres)
+        assert all(zf.read(n).startswith(b'%PDF') for n in nombres)
+
+    # Solo las seleccionadas, en el orden pedido
+    ids = [f['id'] for f in estado['facturas']][::-1][:2]
+    respuesta = cliente.post('/exportar/zip', data={'ids': ids})
+    with zipfile.ZipFile(io.BytesIO(respuesta.data)) as zf:
+        esperados = [aplicacion.nombre_descarga_factura(aplicacion.db.session.get(aplicacion.Factura, i))
+                     for i in ids]
+        assert zf.namelist() == esperados
+
+
+def test_exportar_movimientos_csv(aplicacion, cliente, facturas):
+    respuesta = cliente.get('/exportar/movimientos?formato=csv&tipo=Agua')
+    assert respuesta.status_code == 200 and respuesta.mimetype == 'text/csv'
+    texto = respuesta.data.decode('utf-8')
+    assert texto.startswith('\ufeff')
+    lineas = texto[1:].splitlines()
+    assert lineas[0].split(';') == list(aplicacion.COLUMNAS_MOVIMIENTOS)
+    primera = lineas[1].split(';')
+    assert primera[:2] == ['02/01/2025', 'COMUNIDAD 1'] and primera[4] == '101,51'
+    assert primera[7] == 'Factura Ñandú 1'
+    assert len(lineas) == 4
+
+
+def test_exportar_movimientos_jsonl(cliente, facturas):
+    respuesta = cliente.get('/exportar/movimientos?formato=jsonl&orden=-procesamiento&limite=1')
+    movimientos = [json.loads(linea) for linea in respuesta.data.decode('utf-8').splitlines()]
+    assert len(movimientos) == 7
+    assert movimientos[0]['fecha'] == '2025-01-07' and movimientos[0]['importe'] == 106.56
+    assert cliente.get('/exportar/movimientos?formato=pdf').status_code == 400
+    assert cliente.get('/exportar/movimientos?orden=importe').status_code == 400
+
+
+def test_exportar_movimientos_xlsx_es_un_libro_valido(cliente, facturas):
+    respuesta = cliente.get('/exportar/movimientos?formato=xlsx')
+    assert respuesta.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(respuesta.data)) as zf:
+        assert zf.testzip() is None
+        hoja = zf.read('xl/worksheets/sheet1.xml').decode('utf-8')
+    assert hoja.count('<row>') == 8 and 'Factura Ñandú 6' in hoja
+
+
+def test_exportar_movimientos_xlsx_se_lee_con_openpyxl(aplicacion, cliente, facturas):
+    fila = facturas[2]
+    fila.comunidad = 'COMUNIDAD PEÑA & "ÁVILA" <Norte>'
+    fila.importe = '1234,56 EUR'
+    aplicacion.db.session.commit()
+
+    respuesta = cliente.get('/exportar/movimientos?formato=xlsx&limite=2')
+    libro = openpyxl.load_workbook(io.BytesIO(respuesta.data))
+    hoja = libro['Movimientos']
+    filas = list(hoja.iter_rows(values_only=True))
+    assert filas[0] == aplicacion.COLUMNAS_MOVIMIENTOS
+    assert len(filas) == 8
+    movimiento = dict(zip(filas[0], filas[3]))
+    assert movimiento['fecha'] == datetime(2025, 1, 3)
+    assert movimiento['comunidad'] == 'COMUNIDAD PEÑA & "ÁVILA" <Norte>'
+    assert movimiento['importe'] == 1234.56
+    assert movimiento['archivo'] == 'Factura Ñandú 2'
+    assert movimiento['id'] == f'{2:032x}'
+    assert hoja.cell(row=4, column=5).number_format == '#,##0.00'
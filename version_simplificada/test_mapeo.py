@@ -0,0 +1,161 @@
+"""
+Pruebas del mapeo: recarga en caliente y aviso al resto de workers, snapshot
+precompilado, reasignación incremental de las facturas guardadas y reparto de la
+reasignación entre workers.
+"""
+import copy
+import json
+import os
+import threading
+
+import pytest
+
+from conftest import escribir_mapeo, generar_mapeo, pdfs_factura, subir_facturas
+
+
+def esperar_reasignacion(aplicacion):
+    """Espera a que termine la reasignación encolada (el ejecutor tiene un solo hilo)"""
+    aplicacion._EJECUTOR_REASIGNACION.submit(lambda: None).result()
+
+
+@pytest.fixture
+def mapeo(aplicacion, bd):
+    """(mapeo, direcciones) del archivo de pruebas; al terminar se vuelve a instalar el original"""
+    mapeo, direcciones = generar_mapeo(20)
+    yield copy.deepcopy(mapeo), dict(direcciones)
+    escribir_mapeo(mapeo, direcciones)
+    aplicacion.SERVICIO_MAPEO.recargar(forzar=True)
+    esperar_reasignacion(aplicacion)
+
+
+def test_recarga_en_caliente(aplicacion, mapeo):
+    entradas, direcciones = mapeo
+    servicio = aplicacion.SERVICIO_MAPEO
+    version = servicio.recargar(forzar=True)['version']
+
+    entradas['ES0021999999999999999AB'] = {'comunidad': 'COMUNIDAD NUEVA', 'cuenta': '6289999'}
+    escribir_mapeo(entradas, direcciones)
+    estado = servicio.recargar()
+    assert estado['version'] == version + 1 and estado['error'] is None
+    assert estado['entradas']['cups_contadores'] == 21
+    assert 'ES0021999999999999999AB' in aplicacion.MAPEO_ACTUAL['MAPEO_CUENTAS_CONTABLES']
+    assert aplicacion.asignar_cuenta_contable_con_tipos('ES0021999999999999999AB', None, 'Luz') == (
+        'COMUNIDAD NUEVA', '6289999')
+    # Sin cambios en el archivo no se vuelve a construir
+    assert servicio.recargar()['version'] == version + 1
+
+    # Un JSON roto no sustituye al mapeo instalado
+    with open(os.environ['MAPEO_CONFIG_PATH'], 'w') as f:
+        f.write('{roto')
+    estado = servicio.recargar()
+    assert estado['error'] and estado['version'] == version + 1
+    assert 'ES0021999999999999999AB' in aplicacion.MAPEO_ACTUAL['MAPEO_CUENTAS_CONTABLES']
+    esperar_reasignacion(aplicacion)
+
+
+def test_recarga_avisada_a_otro_worker_fuera_de_la_peticion(aplicacion, cliente, mapeo, monkeypatch):
+    # Otro worker: su propio servicio sobre el mismo archivo de mapeo y de aviso
+    otro = aplicacion.ServicioMapeo(aplicacion.MAPEO_CONFIG_PATH, 0, aplicacion.MAPEO_AVISO_RECARGA_PATH)
+    hilos = []
+    recargado = threading.Event()
+
+    def recargar(forzar=False):
+        hilos.append(threading.current_thread().name)
+        recargado.set()
+        return otro.estado
+
+    monkeypatch.setattr(otro, 'recargar', recargar)
+    otro.iniciar_vigilancia()
+
+    version = aplicacion.SERVICIO_MAPEO.estado['version']
+    respuesta = cliente.post('/api/mapeo/recargar')
+    assert respuesta.status_code == 200 and respuesta.get_json()['version'] == version + 1
+    assert cliente.get('/api/mapeo').get_json()['version'] == version + 1
+
+    # La petición del otro worker solo despierta a su hilo de vigilancia
+    otro.comprobar_aviso()
+    assert recargado.wait(5)
+    assert hilos == ['vigilancia-mapeo']
+    esperar_reasignacion(aplicacion)
+
+
+def test_snapshot_del_mapeo(aplicacion, tmp_path, monkeypatch):
+    ruta_json, ruta_snapshot = str(tmp_path / 'mapeo.json'), str(tmp_path / 'mapeo.pkl')
+    escribir_mapeo(*generar_mapeo(10), ruta=ruta_json)
+    construida = aplicacion.leer_mapeo_json(ruta_json, ruta_snapshot)
+    assert os.path.exists(ruta_snapshot)
+
+    def sin_construir(*args, **kwargs):
+        raise AssertionError("Debería cargarse del snapshot")
+
+    monkeypatch.setattr(aplicacion, 'construir_configuracion_mapeo', sin_construir)
+    cargada = aplicacion.leer_mapeo_json(ruta_json, ruta_snapshot)
+    assert cargada['HUELLA_MAPEO'] == construida['HUELLA_MAPEO']
+    assert cargada['MAPEO_CUENTAS_CONTABLES'] == construida['MAPEO_CUENTAS_CONTABLES']
+
+    with open(ruta_json, 'rb') as f:
+        sha_json = aplicacion.hashlib.sha256(f.read()).hexdigest()
+    assert aplicacion.cargar_snapshot_mapeo(ruta_snapshot, sha_json) is not None
+    # Otro JSON u otro formato de snapshot: la cabecera no coincide y no se usa
+    assert aplicacion.cargar_snapshot_mapeo(ruta_snapshot, '0' * 64) is None
+    monkeypatch.setattr(aplicacion, 'FORMATO_SNAPSHOT_MAPEO', aplicacion.FORMATO_SNAPSHOT_MAPEO + 1)
+    assert aplicacion.cargar_snapshot_mapeo(ruta_snapshot, sha_json) is None
+    monkeypatch.undo()
+
+    # Un snapshot dañado se descarta y se reconstruye
+    with open(ruta_snapshot, 'wb') as f:
+        f.write(b'no es un pickle')
+    assert aplicacion.cargar_snapshot_mapeo(ruta_snapshot, sha_json) is None
+    assert aplicacion.leer_mapeo_json(ruta_json, ruta_snapshot)['HUELLA_MAPEO'] == construida['HUELLA_MAPEO']
+    assert aplicacion.cargar_snapshot_mapeo(ruta_snapshot, sha_json) is not None
+
+
+def test_reasignacion_incremental_tras_recargar(aplicacion, cliente, mapeo):
+    entradas, direcciones = mapeo
+    estado = subir_facturas(cliente, pdfs_factura(12, semilla=3, mapeo=entradas), modo='secuencial')
+    comunidades = {e['comunidad'] for e in entradas.values()}
+    asignada = next(f['comunidad'] for f in estado['facturas'] if f['comunidad'] in comunidades)
+
+    # Se renombra la comunidad de una entrada en los dos mapeos
+    for datos in list(entradas.values()) + list(direcciones.values()):
+        if datos['comunidad'] == asignada:
+            datos['comunidad'] = 'COMUNIDAD RENOMBRADA'
+    escribir_mapeo(entradas, direcciones)
+    aplicacion.SERVICIO_MAPEO.recargar()
+    esperar_reasignacion(aplicacion)
+
+    resumen = cliente.get('/api/mapeo').get_json()['reasignacion']
+    assert resumen['revisadas'] == 12
+    assert 1 <= resumen['actualizadas'] <= resumen['afectadas'] < resumen['revisadas']
+    aplicacion.db.session.expire_all()
+    comunidades_guardadas = {f.comunidad for f in aplicacion.Factura.query}
+    assert 'COMUNIDAD RENOMBRADA' in comunidades_guardadas and asignada not in comunidades_guardadas
+
+
+def test_la_reasignacion_de_una_version_la_hace_un_solo_worker(aplicacion, cliente, mapeo):
+    assert aplicacion.reclamar_reasignacion('huella:1') is True
+    assert aplicacion.reclamar_reasignacion('huella:1') is False
+
+    # Este worker no la reclamó: no reasigna y muestra el resumen que guarde el otro
+    resumen = aplicacion._ejecutar_reasignacion(None, 'huella:1')
+    assert 'actualizadas' not in resumen
+    aplicacion.ReasignacionMapeo.query.filter_by(clave='huella:1').update(
+        {'resumen': json.dumps({'actualizadas': 4, 'afectadas': 5}), 'worker': 1234})
+    aplicacion.db.session.commit()
+    datos = cliente.get('/api/mapeo').get_json()['reasignacion']
+    assert (datos['actualizadas'], datos['worker']) == (4, 1234)
+
+    # La reasignación pedida a mano no se reparte: siempre se ejecuta
+    respuesta = cliente.post('/api/mapeo/reasignar')
+    assert respuesta.status_code == 200 and 'actualizadas' in respuesta.get_json()
+
+
+def test_asignacion_con_una_sola_configuracion(aplicacion):
+    config = aplicacion.construir_configuracion_mapeo(
+        {'Q22EA038022': {'comunidad': 'COMUNIDAD INSTANTANEA', 'cuenta': '6280001'}}, {})
+    campos = {'tipo': 'Agua', 'contador': 'Q22EA038022'}
+    assert aplicacion.asignar_comunidad_cuenta(campos, config)['origen'] == 'contador'
+    assert aplicacion.asignar_comunidad_cuenta(campos)['origen'] == 'tipo'
+    # La configuración publicada es de solo lectura
+    with pytest.raises(TypeError):
+        aplicacion.MAPEO_ACTUAL['HUELLA_MAPEO'] = 'otra'